@@ -0,0 +1 @@
+"""Benchmarks for :mod:`zmigrate`, see ``python -m benchmarks.run --help``."""
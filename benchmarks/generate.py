@@ -0,0 +1,83 @@
+"""Generate synthetic migration trees for benchmarking."""
+
+from argparse import ArgumentParser
+from os import makedirs
+from os.path import join
+from typing import Iterable, Optional
+
+
+def version(i: int) -> str:
+    """Return the revision name of the ``i``-th generated revision."""
+    return '0.%d.%d' % (i // 10000, i % 10000 + 1)
+
+
+def generate(
+    root: str,
+    revisions: int = 100,
+    statements: int = 5,
+    statement_size: int = 64,
+    seed_every: int = 0,
+    seed_rows: int = 1000,
+    seed_format: str = 'sql',
+) -> None:
+    """Write a tree of ``revisions`` revisions under ``root``.
+
+    Every revision inserts ``statements - 1`` rows of ``statement_size``
+    bytes of payload into a shared ``bench`` table (the first one creates it).
+    Every ``seed_every``-th revision also gets ``seed_rows`` rows of seed data,
+    either as ``seed.sql`` or as a ``seed/bench.csv`` bulk file.
+    """
+    payload = 'x' * statement_size
+    for i in range(revisions):
+        base = join(root, version(i))
+        makedirs(base)
+        with open(join(base, 'up.sql'), 'w', encoding='utf-8') as fh:
+            if i == 0:
+                fh.write('CREATE TABLE bench (id INTEGER PRIMARY KEY, rev INTEGER, payload TEXT);\n')
+            for _ in range(max(0, statements - 1)):
+                fh.write("INSERT INTO bench (rev, payload) VALUES (%d, '%s');\n" % (i, payload))
+        with open(join(base, 'down.sql'), 'w', encoding='utf-8') as fh:
+            if i == 0:
+                fh.write('DROP TABLE bench;\n')
+            else:
+                fh.write('DELETE FROM bench WHERE rev = %d;\n' % i)
+        with open(join(base, 'readme'), 'w', encoding='utf-8') as fh:
+            fh.write('synthetic revision %d\n' % i)
+
+        seeded = seed_every and i % seed_every == 0
+        if seeded and seed_format == 'csv':
+            makedirs(join(base, 'seed'))
+            with open(join(base, 'seed', 'bench.csv'), 'w', encoding='utf-8') as fh:
+                fh.write('rev,payload\n')
+                fh.writelines('%d,%s\n' % (i, payload) for _ in range(seed_rows))
+        with open(join(base, 'seed.sql'), 'w', encoding='utf-8') as fh:
+            if seeded and seed_format == 'sql':
+                fh.writelines(
+                    "INSERT INTO bench (rev, payload) VALUES (%d, '%s');\n" % (i, payload)
+                    for _ in range(seed_rows)
+                )
+
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = ArgumentParser(description=generate.__doc__.splitlines()[0])
+    parser.add_argument('root')
+    parser.add_argument('--revisions', type=int, default=100)
+    parser.add_argument('--statements', type=int, default=5)
+    parser.add_argument('--statement-size', type=int, default=64)
+    parser.add_argument('--seed-every', type=int, default=0)
+    parser.add_argument('--seed-rows', type=int, default=1000)
+    parser.add_argument('--seed-format', choices=('sql', 'csv'), default='sql')
+    args = parser.parse_args(argv)
+    generate(
+        args.root,
+        args.revisions,
+        args.statements,
+        args.statement_size,
+        args.seed_every,
+        args.seed_rows,
+        args.seed_format,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""Time the phases of a migration run against synthetic trees.
+
+Each scenario generates a tree with :mod:`benchmarks.generate`, migrates a
+fresh database (``apply``) and then runs again with nothing to do (``noop``).
+The time spent in every phase is reported:
+
+* ``scan``: listing the tree and parsing the revision names
+* ``plan``: loading the applied revisions and computing the plan
+* ``read``: reading and splitting scripts
+* ``execute``: running statements and loading bulk seed data
+* ``bookkeeping``: writes to the ``migrations`` table
+* ``commit``: commits
+* ``other``: everything else (logging, readme, checksums...)
+
+Cold start of the CLI is timed separately by :mod:`benchmarks.startup` and
+reported as the ``startup`` scenario.
+
+Results are written as JSON together with the commit they were measured on,
+and ``--compare`` prints the change against an earlier result file::
+
+    python -m benchmarks.run --output before.json
+    git checkout my-branch
+    python -m benchmarks.run --output after.json --compare before.json
+"""
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from contextlib import contextmanager
+from json import dump, load
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+from unittest import mock
+import platform
+import subprocess
+import sys
+
+import zmigrate
+from zmigrate import script
+from zmigrate.registry import SUPPORTED_DRIVERS
+from zmigrate.tree import Tree
+
+from benchmarks.generate import generate
+from benchmarks.startup import measure as measure_startup
+
+PHASES = ('scan', 'plan', 'read', 'execute', 'bookkeeping', 'commit', 'other')
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    'tiny': dict(revisions=10),
+    'many': dict(revisions=5000, statements=1),
+    'large': dict(revisions=5, statements=50000),
+    'seed-sql': dict(revisions=50, seed_every=5, seed_rows=20000),
+    'seed-csv': dict(revisions=50, seed_every=5, seed_rows=20000, seed_format='csv'),
+}
+
+
+class Timer:
+    """Accumulate the self time spent in nested, named phases."""
+
+    def __init__(self) -> None:
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.stack: List[float] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = perf_counter()
+        self.stack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - started
+            self.totals[name] += elapsed - self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            with self.phase(name):
+                return fn(*args, **kwargs)
+        return timed
+
+
+class TimedConnection:
+    """Proxy to a DB-API connection timing its commits."""
+
+    def __init__(self, conn, timer: Timer) -> None:
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, 'commit', timer.wrap('commit', conn.commit))
+
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name: str, value) -> None:
+        setattr(self._conn, name, value)
+
+
+def instrument(db, timer: Timer) -> None:
+    db.conn = TimedConnection(db.conn, timer)
+    for method in ('execute_batch', 'bulk_load'):
+        setattr(db, method, timer.wrap('execute', getattr(db, method)))
+    for method in ('insert_row', 'delete_row', 'insert_rows', 'delete_rows'):
+        setattr(db, method, timer.wrap('bookkeeping', getattr(db, method)))
+
+
+def run_once(args) -> Dict[str, float]:
+    timer = Timer()
+    started = perf_counter()
+    with timer.phase('other'):
+        tree = Tree(args.migration_dir)
+        with timer.phase('scan'):
+            dirs = zmigrate.load_dirs(args, tree.names())
+        with mock.patch.object(zmigrate, 'get_applied', timer.wrap('plan', zmigrate.get_applied)), \
+                mock.patch.object(zmigrate, 'plan', timer.wrap('plan', zmigrate.plan)), \
+                mock.patch.object(zmigrate, 'execute_stream', timer.wrap('read', zmigrate.execute_stream)), \
+                mock.patch.object(script, 'execute_stream', timer.wrap('read', script.execute_stream)):
+            with SUPPORTED_DRIVERS[args.driver](args) as db:
+                instrument(db, timer)
+                zmigrate.migrate(args, dirs, db, tree)
+    result = {phase: round(timer.totals[phase], 6) for phase in PHASES}
+    result['total'] = round(perf_counter() - started, 6)
+    return result
+
+
+def drop_database(args) -> None:
+    if args.driver == 'sqlite3':
+        return
+    admin = zmigrate.parse_args(
+        ['--driver', args.driver, '--host', args.host, '--user', args.user,
+         '--password', args.password, '--database', 'postgres']
+    )
+    with SUPPORTED_DRIVERS[args.driver](admin) as db:
+        db.drop_database(args.database)
+
+
+def run_scenario(name: str, options, workdir: str) -> Dict[str, Dict[str, float]]:
+    root = join(workdir, name)
+    generate(root, **SCENARIOS[name])
+    argv = [
+        '--migration-dir', root,
+        '--driver', options.driver,
+        '--seed', 'yes',
+        '--transaction', options.transaction,
+    ]
+    if options.driver == 'sqlite3':
+        argv += ['--database', join(workdir, name + '.db')]
+    else:
+        argv += ['--host', options.host, '--user', options.user,
+                 '--password', options.password, '--database', 'zmigrate_bench']
+    args = zmigrate.parse_args(argv)
+    drop_database(args)
+    try:
+        return {'apply': run_once(args), 'noop': run_once(args)}
+    finally:
+        drop_database(args)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    print('%-10s %-6s %-12s %10s %10s %8s' % ('scenario', 'run', 'phase', 'before', 'after', 'change'))
+    for scenario, runs in new['results'].items():
+        for run, phases in runs.items():
+            before = old['results'].get(scenario, {}).get(run, {})
+            for phase, after in phases.items():
+                if phase not in before:
+                    continue
+                change = (after - before[phase]) / before[phase] * 100 if before[phase] else 0.0
+                print('%-10s %-6s %-12s %10.4f %10.4f %+7.1f%%' % (
+                    scenario, run, phase, before[phase], after, change))
+
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = ArgumentParser(description='Benchmark zmigrate against synthetic migration trees.')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS))
+    parser.add_argument('--driver', default='sqlite3', choices=sorted(SUPPORTED_DRIVERS))
+    parser.add_argument('--transaction', default='statement',
+                        choices=('statement', 'migration', 'batch'))
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--startup-runs', default=5, type=int,
+                        help='processes timed by the startup benchmark (0 to skip it)')
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    options = parser.parse_args(argv)
+
+    report: Dict[str, Any] = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'driver': options.driver,
+        'transaction': options.transaction,
+        'scenarios': {name: SCENARIOS[name] for name in options.scenario or SCENARIOS},
+        'results': {},
+    }
+    with TemporaryDirectory() as workdir:
+        for name in report['scenarios']:
+            try:
+                report['results'][name] = run_scenario(name, options, workdir)
+            except Exception as exc:  # e.g. no Postgres server reachable
+                print('%s: skipped (%s)' % (name, exc), file=sys.stderr)
+                continue
+            print('%s: %s' % (name, report['results'][name]))
+
+    if options.startup_runs > 0:
+        report['results']['startup'] = {'cold': measure_startup(options.startup_runs)}
+        print('startup: %s' % report['results']['startup'])
+
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as fh:
+            dump(report, fh, indent=1)
+    if options.compare:
+        with open(options.compare, 'r', encoding='utf-8') as fh:
+            compare(load(fh), report)
+
+
+if __name__ == '__main__':
+    main()
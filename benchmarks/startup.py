@@ -0,0 +1,57 @@
+"""Time how long a fresh interpreter takes to start zmigrate.
+
+Each run spawns a new Python process so that nothing is cached in
+``sys.modules``. Two steps are timed:
+
+* ``import``: ``import zmigrate``
+* ``cli``: parsing the command line and loading the selected driver, i.e.
+  everything a run does before connecting to the database
+
+The reported time is the median of ``runs`` processes, minus the median time
+of starting a bare interpreter.
+"""
+
+from argparse import ArgumentParser
+from statistics import median
+from typing import Dict, Iterable, Optional
+import json
+import subprocess
+import sys
+import time
+
+PROBES = {
+    'baseline': "pass",
+    'import': "import zmigrate",
+    'cli': (
+        "import zmigrate; "
+        "from zmigrate.registry import SUPPORTED_DRIVERS; "
+        "args = zmigrate.parse_args(['--driver', 'sqlite3', '--migration-dir', '.']); "
+        "SUPPORTED_DRIVERS[args.driver]"
+    ),
+}
+
+
+def time_probe(code: str, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', code])
+        timings.append(time.perf_counter() - started)
+    return median(timings)
+
+
+def measure(runs: int = 5) -> Dict[str, float]:
+    timings = {name: time_probe(code, runs) for name, code in PROBES.items()}
+    baseline = timings.pop('baseline')
+    return {name: round(max(0.0, value - baseline), 6) for name, value in timings.items()}
+
+
+def main(argv: Optional[Iterable[str]] = None) -> None:
+    parser = ArgumentParser(description='Time the startup of zmigrate.')
+    parser.add_argument('--runs', default=5, type=int)
+    options = parser.parse_args(argv)
+    print(json.dumps(measure(options.runs), indent=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@ import shutil
 import sqlite3
 from pathlib import Path
 import sys
+from types import SimpleNamespace
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
@@ -77,7 +78,7 @@ def test_sqlite_migration(tmp_path):
     assert cur.fetchone()[0] == 0
     cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
     tables = {row[0] for row in cur.fetchall()}
-    assert tables == {"migrations", "sqlite_sequence"}
+    assert tables == {"migrations", "migrations_stats", "sqlite_sequence"}
     conn.close()
 
     run_cli([
@@ -129,10 +130,1352 @@ def test_auto_install(monkeypatch):
     def fake_check_call(cmd, **kwargs):
         calls.append(cmd)
 
-    monkeypatch.setattr("importlib.import_module", fake_import)
-    monkeypatch.setattr("subprocess.check_call", fake_check_call)
-
+    from zmigrate import drivers
     from zmigrate.drivers import ensure_package
 
+    # importlib.import_module is patched last: monkeypatch itself uses it to
+    # resolve dotted targets.
+    monkeypatch.setattr(drivers, "PRODUCTION", False)
+    monkeypatch.setattr(drivers, "_packages", {})
+    monkeypatch.setattr("subprocess.check_call", fake_check_call)
+    monkeypatch.setattr("importlib.import_module", fake_import)
+
     mod = ensure_package("missing", "missing-package")
     assert calls and mod is not None
+    assert ensure_package("missing", "missing-package") is mod
+    assert len(calls) == 1
+
+    import pytest
+
+    calls.clear()
+    drivers._packages.clear()
+    drivers.PRODUCTION = True
+    with pytest.raises(Exception, match="production mode"):
+        ensure_package("missing", "missing-package")
+    assert not calls
+
+
+def test_drivers_load_lazily():
+    import subprocess
+
+    code = (
+        "import sys, zmigrate; "
+        "assert 'zmigrate.drivers' not in sys.modules; "
+        "from zmigrate.registry import SUPPORTED_DRIVERS; "
+        "assert SUPPORTED_DRIVERS['sqlite3'].__name__ == 'SQLite3'; "
+        "assert 'zmigrate.drivers' in sys.modules; "
+        "assert 'sqlite3' in SUPPORTED_DRIVERS and 'nope' not in SUPPORTED_DRIVERS"
+    )
+    subprocess.check_call([sys.executable, "-c", code], cwd=Path(__file__).resolve().parents[1])
+
+
+def test_plan_uses_applied_set():
+    dirs = [Dir("0.0.1"), Dir("0.0.2"), Dir("0.0.3")]
+    args = SimpleNamespace(direction="up", range=Range("^0.0.2"))
+    pending = zmigrate.plan(args, dirs, {"0.0.1"})
+    assert [str(d) for d in pending] == ["0.0.2"]
+
+    args = SimpleNamespace(direction="down", range=Range())
+    pending = zmigrate.plan(args, list(reversed(dirs)), {"0.0.1", "0.0.3"})
+    assert [str(d) for d in pending] == ["0.0.3", "0.0.1"]
+
+
+def test_fast_path_head_marker(tmp_path, caplog):
+    import logging
+
+    db_path = tmp_path / "test.db"
+    mig_dir = tmp_path / "migration"
+    shutil.copytree(Path("tests/sqlite3/migration"), mig_dir)
+    argv = [
+        "--migration-dir",
+        str(mig_dir),
+        "--driver",
+        "sqlite3",
+        "--database",
+        str(db_path),
+        "--fast-path",
+    ]
+
+    run_cli(argv)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT revision FROM migrations_head").fetchall() == [("0.0.2",)]
+    conn.close()
+
+    with caplog.at_level(logging.INFO):
+        run_cli(argv)
+    assert "already at head" in caplog.text
+
+    (mig_dir / "0.0.3").mkdir()
+    (mig_dir / "0.0.3" / "up.sql").write_text("CREATE TABLE extra (id INTEGER);")
+    (mig_dir / "0.0.3" / "seed.sql").write_text("")
+    (mig_dir / "0.0.3" / "down.sql").write_text("DROP TABLE extra;")
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        run_cli(argv)
+    assert "already at head" not in caplog.text
+    assert "Migrating 0.0.3" in caplog.text
+
+    run_cli(argv[:-1] + ["-d", "down", "-r", "0.0.3^0.0.3"])
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM migrations_head").fetchone()[0] == 0
+    conn.close()
+
+
+def test_transaction_modes_roll_back(tmp_path):
+    import pytest
+
+    mig_dir = tmp_path / "migration"
+    for name, up in [
+        ("0.0.1", "CREATE TABLE a (id INTEGER);\nINSERT INTO a VALUES (1);"),
+        ("0.0.2", "CREATE TABLE b (id INTEGER); INSERT INTO b VALUES (1);"),
+        ("0.0.3", "CREATE TABLE c (id INTEGER);\nINSERT INTO missing VALUES (1);"),
+    ]:
+        (mig_dir / name).mkdir(parents=True)
+        (mig_dir / name / "up.sql").write_text(up)
+
+    def tables(db_path):
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        names = {row[0] for row in rows}
+        revisions = {row[0] for row in conn.execute("SELECT revision FROM migrations")}
+        conn.close()
+        return names, revisions
+
+    for mode, expected in [
+        ("batch", set()),
+        ("migration", {"0.0.1", "0.0.2"}),
+    ]:
+        db_path = tmp_path / ("%s.db" % mode)
+        with pytest.raises(sqlite3.OperationalError):
+            run_cli([
+                "--migration-dir",
+                str(mig_dir),
+                "--driver",
+                "sqlite3",
+                "--database",
+                str(db_path),
+                "--transaction",
+                mode,
+            ])
+        names, revisions = tables(db_path)
+        assert revisions == expected
+        assert "c" not in names
+        assert {"a", "b"}.issubset(names) == bool(expected)
+
+
+def test_non_transactional_revisions(tmp_path, caplog):
+    import json
+    import pytest
+    from zmigrate.drivers import Postgres, SQLite3
+
+    calls = []
+
+    class FakeCursor:
+        rowcount = -1
+
+        def execute(self, sql, params=None):
+            calls.append(sql)
+
+        def close(self):
+            pass
+
+    class FakeConn:
+        autocommit = True
+
+        def cursor(self):
+            return FakeCursor()
+
+        def commit(self):
+            pass
+
+    # One query holding several statements would run in an implicit
+    # transaction block, where CONCURRENTLY fails.
+    db = Postgres.__new__(Postgres)
+    db.conn = FakeConn()
+    db.execute_batch(["CREATE INDEX CONCURRENTLY i ON t (x);", "CREATE INDEX CONCURRENTLY j ON t (y);"])
+    assert calls == ["CREATE INDEX CONCURRENTLY i ON t (x);", "CREATE INDEX CONCURRENTLY j ON t (y);"]
+
+    mig_dir = tmp_path / "migration"
+    for name, up in [("0.0.1", "CREATE TABLE a (id INTEGER);"), ("0.0.2", "VACUUM;")]:
+        (mig_dir / name).mkdir(parents=True)
+        (mig_dir / name / "up.sql").write_text(up)
+    (mig_dir / "0.0.2" / "meta.json").write_text(json.dumps({"transaction": False}))
+    argv = ["--migration-dir", str(mig_dir), "--driver", "sqlite3"]
+
+    # Leaving a caller's transaction (batched tenants) would commit part of it.
+    args = zmigrate.parse_args(argv + ["--database", str(tmp_path / "nested.db")])
+    tree = zmigrate.open_tree(args)
+    with SQLite3(args) as db:
+        db.begin()
+        with pytest.raises(Exception, match="--tenant-batch 1"):
+            zmigrate.migrate(args, zmigrate.load_dirs(args, tree.names()), db, tree)
+        db.rollback()
+
+    run_cli(argv + ["--database", str(tmp_path / "batch.db"), "--transaction", "batch"])
+    assert "0.0.2 can't run inside a transaction: committing the batch so far" in caplog.text
+    conn = sqlite3.connect(tmp_path / "batch.db")
+    assert conn.execute("SELECT COUNT(*) FROM migrations").fetchone()[0] == 2
+    conn.close()
+
+
+def test_iter_statements_splits_sql():
+    from zmigrate.script import iter_statements
+
+    sql = (
+        "-- leading; comment\n"
+        "CREATE TABLE a (x TEXT); INSERT INTO a VALUES ('it''s; ok');\n"
+        "/* block ; /* nested ; */ still ; */\n"
+        "CREATE FUNCTION f() RETURNS trigger AS $body$\n"
+        "BEGIN\n  RETURN NEW;\nEND;\n$body$ LANGUAGE plpgsql;\n"
+        "CREATE TRIGGER t AFTER INSERT ON a BEGIN\n"
+        "  UPDATE a SET x = CASE WHEN 1 THEN 'a' ELSE 'b' END;\n"
+        "END;\n"
+        "BEGIN;\n"
+        "-- trailing comment only;\n"
+    )
+    statements = list(iter_statements(sql.splitlines(True)))
+    assert len(statements) == 5
+    assert statements[1] == "INSERT INTO a VALUES ('it''s; ok');"
+    assert statements[2].endswith("$body$ LANGUAGE plpgsql;")
+    assert statements[3].endswith("END;")
+    assert statements[4] == "BEGIN;"
+
+
+def test_execute_stream_batches(tmp_path):
+    from zmigrate.drivers import SQLite3
+    from zmigrate.script import execute_stream
+
+    script = tmp_path / "seed.sql"
+    with open(script, "w") as fh:
+        fh.write("CREATE TABLE t (id INTEGER);\n")
+        for i in range(100):
+            fh.write("INSERT INTO t VALUES (%d);\n" % i)
+
+    batches = []
+    with SQLite3(SimpleNamespace(database=str(tmp_path / "t.db"))) as db:
+        original = db.execute_batch
+
+        def record(statements):
+            batches.append(len(statements))
+            original(statements)
+
+        db.execute_batch = record
+        with open(script) as fh:
+            execute_stream(db, fh, batchSize=256)
+        assert db.execute("SELECT COUNT(*) FROM t", readRows=True)[0][0] == 100
+    assert len(batches) > 1 and sum(batches) == 101
+
+
+def test_seed_bulk_load(tmp_path):
+    mig_dir = tmp_path / "migration"
+    rev = mig_dir / "0.0.1"
+    (rev / "seed").mkdir(parents=True)
+    (rev / "up.sql").write_text(
+        "CREATE TABLE users (id INTEGER, name TEXT);\n"
+        "CREATE TABLE tags (id INTEGER, label TEXT);"
+    )
+    with open(rev / "seed" / "users.csv", "w") as fh:
+        fh.write("id,name\n")
+        for i in range(25000):
+            fh.write('%d,"user, %d"\n' % (i, i))
+        fh.write("25000,\n")
+        fh.write('25001,""\n25002,"two\nlines, ""quoted"""\n')
+    (rev / "seed" / "tags.tsv").write_text("id\tlabel\n1\ta\\tb\n2\t\\N\n")
+
+    db_path = tmp_path / "seed.db"
+    run_cli([
+        "--migration-dir",
+        str(mig_dir),
+        "--driver",
+        "sqlite3",
+        "--database",
+        str(db_path),
+        "--seed",
+    ])
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 25003
+    assert conn.execute("SELECT name FROM users WHERE id = 7").fetchone()[0] == "user, 7"
+    assert conn.execute("SELECT name FROM users WHERE id = 25000").fetchone()[0] is None
+    assert conn.execute("SELECT name FROM users WHERE id = 25001").fetchone()[0] == ""
+    assert conn.execute("SELECT name FROM users WHERE id = 25002").fetchone()[0] == 'two\nlines, "quoted"'
+    assert conn.execute("SELECT label FROM tags ORDER BY id").fetchall() == [("a\tb",), (None,)]
+    conn.close()
+
+
+def test_multiple_targets(tmp_path):
+    import pytest
+
+    mig_dir = tmp_path / "migration"
+    shutil.copytree(Path("tests/sqlite3/migration"), mig_dir)
+    good = [tmp_path / ("tenant%d.db" % i) for i in range(3)]
+    bad = tmp_path / "missing" / "tenant.db"
+    targets_file = tmp_path / "targets"
+    targets_file.write_text(
+        "# tenants\n%s\n%s\n{\"database\": \"%s\"}\n%s\n" % (good[0], bad, good[1], good[2])
+    )
+
+    with pytest.raises(Exception, match="1 of 4"):
+        run_cli([
+            "--migration-dir",
+            str(mig_dir),
+            "--driver",
+            "sqlite3",
+            "--targets",
+            str(targets_file),
+            "--jobs",
+            "2",
+        ])
+
+    for path in good:
+        conn = sqlite3.connect(path)
+        assert conn.execute("SELECT COUNT(*) FROM migrations").fetchone()[0] == 2
+        conn.close()
+
+
+def test_schema_tenants_batching():
+    from zmigrate import tenants
+
+    class FakeDb:
+        inTransaction = False
+
+        def __init__(self):
+            self.schema = None
+            self.events = []
+
+        def list_schemas(self, pattern):
+            assert pattern == "tenant_%"
+            return ["tenant_a", "tenant_b", "tenant_c"]
+
+        def set_schema(self, schema, create=False):
+            self.schema = schema
+
+        def begin(self):
+            self.inTransaction = True
+            self.events.append("begin")
+
+        def commit(self):
+            self.inTransaction = False
+            self.events.append("commit")
+
+        def rollback(self):
+            self.inTransaction = False
+            self.events.append("rollback")
+
+    def work(args, db):
+        if db.schema == "tenant_c":
+            raise Exception("boom")
+        db.events.append(db.schema)
+
+    db = FakeDb()
+    schemas = tenants.resolve(db, ["tenant_*", "tenant_a", "extra"])
+    assert schemas == ["tenant_a", "tenant_b", "tenant_c", "extra"]
+
+    args = SimpleNamespace(tenant_batch=2, direction="up", fast_path=False)
+    results = tenants.run(args, db, schemas, [], work)
+    assert [(r.target, r.ok) for r in results] == [
+        ("tenant_a", True), ("tenant_b", True), ("tenant_c", False), ("extra", False),
+    ]
+    assert db.events == ["begin", "tenant_a", "tenant_b", "commit", "begin", "rollback"]
+
+
+def test_tenant_batch_rechecks_head_after_lock(monkeypatch):
+    from contextlib import contextmanager
+    from zmigrate import head, tenants
+
+    names = ["0.0.1"]
+    markers = {}
+    planned = []
+
+    class FakeDb:
+        inTransaction = False
+
+        def __init__(self):
+            self.schema = None
+            self.events = []
+
+        def set_schema(self, schema, create=False):
+            self.schema = schema
+
+        def has_table(self, table):
+            return self.schema in markers
+
+        def get_rows(self, table, columns, limit=0):
+            return [("0.0.1", markers[self.schema])]
+
+        @contextmanager
+        def migration_lock(self):
+            # Another process migrated tenant_a while this one waited.
+            if self.schema == "tenant_a":
+                markers["tenant_a"] = head.fingerprint(names)
+            yield True
+
+        def begin(self):
+            self.inTransaction = True
+            self.events.append("begin")
+
+        def commit(self):
+            self.inTransaction = False
+            self.events.append("commit")
+
+        def rollback(self):
+            self.inTransaction = False
+            self.events.append("rollback")
+
+    monkeypatch.setattr(zmigrate, "migrate_plan", lambda args, dirs, db, tree: planned.append(db.schema))
+    args = SimpleNamespace(tenant_batch=2, direction="up", fast_path=True, lock=True)
+    db = FakeDb()
+    dirs = [Dir(name) for name in names]
+    results = tenants.run(
+        args, db, ["tenant_a", "tenant_b"], names,
+        lambda schemaArgs, db: zmigrate.migrate(schemaArgs, dirs, db, object()),
+    )
+    assert [(r.target, r.ok) for r in results] == [("tenant_a", True), ("tenant_b", True)]
+    # tenant_b has no marker table yet: the batch carries on in its transaction.
+    assert planned == ["tenant_b"]
+    assert db.events == ["begin", "commit"]
+
+
+def test_tenant_bookkeeping_ignores_public():
+    import re
+    from zmigrate import backfill, head
+    from zmigrate.drivers import Postgres
+
+    names = ["0.0.1", "0.0.2"]
+    # public is migrated; tenant_a is new and has no bookkeeping tables yet.
+    tables = {
+        ("public", "migrations_head"): [("0.0.2", head.fingerprint(names))],
+        ("public", "migrations_backfill"): [("users", '"42"', 42)],
+    }
+    searchPath = ["public"]
+
+    def resolve(name):
+        match = re.fullmatch(r'(?:"(\w+)"\.)?(\w+)', name)
+        for schema in [match.group(1)] if match.group(1) else searchPath:
+            if (schema, match.group(2)) in tables:
+                return tables[(schema, match.group(2))]
+        return None
+
+    class FakeCursor:
+        rowcount = -1
+
+        def execute(self, sql, params=None):
+            self.rows = []
+            if sql.startswith("SET search_path TO"):
+                searchPath[:] = re.findall(r'"?(\w+)"?', sql[len("SET search_path TO"):])
+            elif sql.startswith("SELECT to_regclass"):
+                self.rows = [(params[0] if resolve(params[0]) is not None else None,)]
+            elif sql.startswith(("SELECT", "DELETE")):
+                rows = resolve(re.search(r"FROM (\S+)", sql).group(1))
+                if rows is None:
+                    raise Exception("relation does not exist")
+                if sql.startswith("DELETE"):
+                    rows.clear()
+                self.rows = list(rows)
+
+        def fetchone(self):
+            return self.rows.pop(0) if self.rows else None
+
+        def close(self):
+            pass
+
+    class FakeConn:
+        autocommit = True
+
+        def cursor(self):
+            return FakeCursor()
+
+        def commit(self):
+            pass
+
+        def rollback(self):
+            pass
+
+    db = Postgres.__new__(Postgres)
+    db.conn = FakeConn()
+    db.set_schema("tenant_a")
+    assert searchPath == ["tenant_a", "public"]
+    assert not head.matches(db, names)
+    assert backfill.checkpoints(db, "0.0.2") == {}
+    head.clear(db)
+    backfill.clear(db, "0.0.2")
+    assert all(tables.values())
+
+
+def test_manifest_rescans_changed_revisions(tmp_path, monkeypatch):
+    import os
+    from zmigrate.tree import Manifest
+
+    mig_dir = tmp_path / "migration"
+    shutil.copytree(Path("tests/sqlite3/migration"), mig_dir)
+    manifest_path = str(tmp_path / "manifest.json")
+
+    tree = Manifest(str(mig_dir), manifest_path)
+    assert sorted(tree.names()) == ["0.0.1", "0.0.2"]
+    assert tree.has("0.0.1", "up.sql") and not tree.has("0.0.1", "meta.json")
+    assert tree.has("0.0.2", "readme")
+    tree.save()
+
+    scanned = []
+    original = Manifest._scan
+    monkeypatch.setattr(Manifest, "_scan", lambda self, name: scanned.append(name) or original(self, name))
+
+    tree = Manifest(str(mig_dir), manifest_path)
+    tree.names()
+    assert tree.has("0.0.1", "up.sql") and tree.has("0.0.2", "up.sql")
+    assert scanned == [] and not tree.dirty
+
+    (mig_dir / "0.0.2" / "seed").mkdir()
+    (mig_dir / "0.0.2" / "seed" / "users.csv").write_text("id\n1\n")
+    stat = os.stat(mig_dir / "0.0.2")
+    os.utime(mig_dir / "0.0.2", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    tree = Manifest(str(mig_dir), manifest_path)
+    tree.names()
+    assert tree.files("0.0.1", "seed") == []
+    assert tree.files("0.0.2", "seed") == ["users.csv"]
+    assert scanned == ["0.0.2"]
+
+
+def test_verify_detects_drift(tmp_path, monkeypatch):
+    import pytest
+    from zmigrate.checksum import file_checksum
+    from zmigrate.tree import Tree
+
+    # Scripts are hashed while they execute, not read a second time.
+    plain = tmp_path / "plain"
+    shutil.copytree(Path("tests/sqlite3/migration"), plain)
+    with open(plain / "0.0.1" / "up.sql", "ab") as fh:
+        fh.write(b"\r\nCREATE TABLE crlf (x TEXT);\r\n-- \xc3\xa9\r\n")
+    with monkeypatch.context() as m:
+        m.setattr(Tree, "checksum", lambda *a: pytest.fail("read twice"))
+        run_cli(["--migration-dir", str(plain), "--driver", "sqlite3",
+                 "--database", str(tmp_path / "plain.db"), "--seed"])
+    conn = sqlite3.connect(tmp_path / "plain.db")
+    stored = dict(conn.execute("SELECT revision, up_checksum FROM migrations").fetchall())
+    conn.close()
+    for revision in ("0.0.1", "0.0.2"):
+        with open(plain / revision / "up.sql", "rb") as fh:
+            assert stored[revision] == file_checksum(fh)
+
+    db_path = tmp_path / "test.db"
+    mig_dir = tmp_path / "migration"
+    shutil.copytree(Path("tests/sqlite3/migration"), mig_dir)
+    argv = [
+        "--migration-dir",
+        str(mig_dir),
+        "--driver",
+        "sqlite3",
+        "--database",
+        str(db_path),
+        "--manifest",
+        str(tmp_path / "manifest.json"),
+    ]
+    run_cli(argv + ["--seed"])
+    run_cli(["verify"] + argv)
+
+    with open(mig_dir / "0.0.2" / "up.sql", "a") as fh:
+        fh.write("\n-- edited after the fact\n")
+    with pytest.raises(Exception, match="1 applied script"):
+        run_cli(["verify"] + argv)
+
+
+def test_squash_baseline(tmp_path, caplog):
+    import logging
+
+    old_dir = tmp_path / "old"
+    shutil.copytree(Path("tests/sqlite3/migration"), old_dir)
+    existing = tmp_path / "existing.db"
+    common = ["--driver", "sqlite3", "--seed"]
+    run_cli(["--migration-dir", str(old_dir), "--database", str(existing)] + common)
+
+    baseline = tmp_path / "baseline"
+    run_cli([
+        "squash",
+        "--migration-dir",
+        str(old_dir),
+        "--driver",
+        "sqlite3",
+        "--range",
+        "^0.0.2",
+        "--output",
+        str(baseline),
+    ])
+    assert "CREATE TABLE icons" in (baseline / "up.sql").read_text()
+    down = (baseline / "down.sql").read_text()
+    assert down.index("icons") < down.index("users")
+
+    new_dir = tmp_path / "new"
+    new_dir.mkdir()
+    shutil.copytree(baseline, new_dir / "0.0.2")
+
+    # Existing databases already have every replaced revision.
+    run_cli(["--migration-dir", str(new_dir), "--database", str(existing)] + common)
+    with caplog.at_level(logging.WARNING):
+        run_cli(["status", "--migration-dir", str(new_dir), "--database", str(existing)] + common)
+    assert "missing from the tree" not in caplog.text
+
+    fresh = tmp_path / "fresh.db"
+    run_cli(["--migration-dir", str(new_dir), "--database", str(fresh)] + common)
+    conn = sqlite3.connect(fresh)
+    revisions = {row[0] for row in conn.execute("SELECT revision FROM migrations")}
+    assert revisions == {"0.0.1", "0.0.2"}
+    assert conn.execute("SELECT COUNT(*) FROM icons").fetchone()[0] == 1
+    conn.close()
+
+    run_cli(["--migration-dir", str(new_dir), "--database", str(fresh), "--driver", "sqlite3",
+             "-d", "down"])
+    conn = sqlite3.connect(fresh)
+    assert conn.execute("SELECT COUNT(*) FROM migrations").fetchone()[0] == 0
+    conn.close()
+
+    # A database with only part of the replaced revisions can't take the baseline.
+    import pytest
+    partial = tmp_path / "partial.db"
+    run_cli(["--migration-dir", str(old_dir), "--database", str(partial), "--range", "^0.0.1"] + common)
+    with pytest.raises(Exception, match="only partially applied"):
+        run_cli(["--migration-dir", str(new_dir), "--database", str(partial)] + common)
+    applied = tmp_path / "applied.txt"
+    applied.write_text("0.0.1\n")
+    with pytest.raises(Exception, match="only partially applied"):
+        run_cli(["compile", "--migration-dir", str(new_dir), "--applied", str(applied),
+                 "-o", str(tmp_path / "plan.sql")] + common)
+
+
+def test_template_clone(tmp_path, caplog):
+    import logging
+
+    mig_dir = tmp_path / "migration"
+    shutil.copytree(Path("tests/sqlite3/migration"), mig_dir)
+    tpl_dir = tmp_path / "templates"
+
+    def provision(name):
+        run_cli([
+            "--migration-dir",
+            str(mig_dir),
+            "--driver",
+            "sqlite3",
+            "--database",
+            str(tmp_path / name),
+            "--seed",
+            "--template",
+            "--template-dir",
+            str(tpl_dir),
+        ])
+
+    provision("a.db")
+    with caplog.at_level(logging.INFO):
+        provision("b.db")
+    assert "Restoring" in caplog.text and "Migrating" not in caplog.text
+    assert len(list(tpl_dir.iterdir())) == 1
+
+    conn = sqlite3.connect(tmp_path / "b.db")
+    assert conn.execute("SELECT COUNT(*) FROM migrations").fetchone()[0] == 2
+    assert conn.execute("SELECT COUNT(*) FROM icons").fetchone()[0] == 1
+    conn.close()
+
+    with open(mig_dir / "0.0.2" / "seed.sql", "a") as fh:
+        fh.write("\nINSERT INTO icons (title, uri) VALUES ('other', 'other.png');\n")
+    provision("c.db")
+    # The template of the previous tree was dropped.
+    assert len(list(tpl_dir.iterdir())) == 1
+    conn = sqlite3.connect(tmp_path / "c.db")
+    assert conn.execute("SELECT COUNT(*) FROM icons").fetchone()[0] == 2
+    conn.close()
+
+    # Existing databases are migrated without touching the template.
+    shutil.rmtree(tpl_dir)
+    provision("a.db")
+    assert not tpl_dir.exists()
+    conn = sqlite3.connect(tmp_path / "a.db")
+    assert conn.execute("SELECT COUNT(*) FROM migrations").fetchone()[0] == 2
+    conn.close()
+
+
+def test_benchmark_harness(tmp_path):
+    from benchmarks.generate import generate
+    from benchmarks.run import PHASES, run_once
+
+    root = tmp_path / "tree"
+    generate(str(root), revisions=3, statements=3, seed_every=2, seed_rows=5, seed_format="csv")
+    args = zmigrate.parse_args([
+        "--migration-dir", str(root), "--driver", "sqlite3",
+        "--database", str(tmp_path / "bench.db"), "--seed",
+    ])
+    result = run_once(args)
+    assert set(PHASES).issubset(result)
+    assert result["read"] > 0 and result["execute"] > 0 and result["bookkeeping"] > 0
+
+    conn = sqlite3.connect(tmp_path / "bench.db")
+    assert conn.execute("SELECT COUNT(*) FROM bench").fetchone()[0] == 3 * 2 + 2 * 5
+    conn.close()
+
+
+def test_postgres_bulk_load_uses_copy():
+    import io
+    from zmigrate.drivers import Postgres
+
+    calls = []
+
+    class FakeCursor:
+        rowcount = 2
+
+        def copy_expert(self, sql, fh, size=None):
+            calls.append((sql, fh.read()))
+
+        def close(self):
+            pass
+
+    class FakeConn:
+        def cursor(self):
+            return FakeCursor()
+
+        def commit(self):
+            calls.append("commit")
+
+    db = Postgres.__new__(Postgres)
+    db.conn = FakeConn()
+    assert db.bulk_load("users", ["id", "name"], io.StringIO("1,a\n2,b\n"), "csv") == 2
+    assert calls == [
+        ("COPY users (id, name) FROM STDIN WITH (FORMAT csv)", "1,a\n2,b\n"),
+        "commit",
+    ]
+
+
+def test_hooks_and_profile(tmp_path):
+    import json
+    from zmigrate import hooks
+
+    events = []
+    hooks.register(events.append)
+    try:
+        run_cli([
+            "--migration-dir",
+            "tests/sqlite3/migration",
+            "--driver",
+            "sqlite3",
+            "--database",
+            str(tmp_path / "db.sqlite"),
+            "--seed",
+            "--profile",
+            str(tmp_path / "profile.json"),
+        ])
+    finally:
+        hooks.unregister(events.append)
+    assert not hooks.enabled
+
+    stops = [e for e in events if e.phase == "stop"]
+    assert [e.name for e in stops if e.kind == "migration"] == ["0.0.1", "0.0.2"]
+    assert all(e.elapsed is not None for e in stops)
+    assert any(e.kind == "script" and e.bytes for e in stops)
+    assert any(e.kind == "statement" and e.rows == 1 for e in stops)
+
+    with open(tmp_path / "profile.json") as fh:
+        report = json.load(fh)
+    assert [m["name"] for m in report["migrations"]] == ["0.0.1", "0.0.2"]
+    assert report["slowest_statements"]
+    assert report["slowest_statements"][0]["revision"] in ("0.0.1", "0.0.2")
+
+
+def test_stats_and_progress(tmp_path, caplog):
+    import logging
+    from zmigrate import stats
+
+    db_path = tmp_path / "db.sqlite"
+    base = [
+        "--migration-dir",
+        "tests/sqlite3/migration",
+        "--driver",
+        "sqlite3",
+        "--database",
+        str(db_path),
+    ]
+    run_cli(base + ["--seed"])
+    run_cli(base + ["-d", "down"])
+    run_cli(base)
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT revision, duration, size, applied_at FROM migrations ORDER BY revision"
+    ).fetchall()
+    assert [r[0] for r in rows] == ["0.0.1", "0.0.2"]
+    assert all(r[1] >= 0 and r[2] > 0 and r[3] for r in rows)
+    history = conn.execute(
+        "SELECT direction, COUNT(*) FROM migrations_stats GROUP BY direction"
+    ).fetchall()
+    assert dict(history) == {"down": 2, "up": 4}
+    conn.close()
+
+    with caplog.at_level(logging.INFO):
+        run_cli(base + ["stats", "-n", "1"])
+    assert "Full upgrade takes about" in caplog.text
+    assert caplog.text.count("average") == 1
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO):
+        progress = stats.Progress("revision", ["a", "b", "c"], {"a": 1.0, "c": 2.0}, interval=0)
+        assert "Estimated 3s for 2 of 3" in caplog.text
+        assert progress.eta() is None
+        progress.advance("a")
+    assert progress.eta() >= 2.0
+    assert "1/3 revision(s) done" in caplog.text
+
+
+def test_compile_offline(tmp_path):
+    mig_dir = tmp_path / "migration"
+    shutil.copytree(Path("tests/sqlite3/migration"), mig_dir)
+    (mig_dir / "0.0.2" / "seed").mkdir()
+    (mig_dir / "0.0.2" / "seed" / "icons.csv").write_text('title,uri,active\n"it\'s",a.png,1\nb,b.png,\n')
+    base = ["--migration-dir", str(mig_dir), "--driver", "sqlite3", "--seed"]
+
+    out = tmp_path / "plan.sql"
+    run_cli(["compile"] + base + ["-o", str(out), "--transaction", "migration"])
+    sql = out.read_text()
+    assert sql.count("BEGIN;") == 2 and sql.count("COMMIT;") == 2
+    conn = sqlite3.connect(tmp_path / "offline.db")
+    conn.executescript(sql)
+    assert [r[0] for r in conn.execute("SELECT revision FROM migrations ORDER BY revision")] == [
+        "0.0.1", "0.0.2",
+    ]
+    assert conn.execute("SELECT COUNT(*) FROM icons").fetchone()[0] == 3
+    assert conn.execute("SELECT COUNT(*) FROM icons WHERE active IS NULL").fetchone()[0] == 1
+    conn.close()
+
+    # The compiled bookkeeping is what a live run records.
+    run_cli(["verify"] + base + ["--database", str(tmp_path / "offline.db")])
+
+    applied = tmp_path / "applied.txt"
+    applied.write_text("0.0.1\n")
+    run_cli(["compile"] + base + ["-o", str(out), "--applied", str(applied)])
+    sql = out.read_text()
+    assert "Migrating 0.0.2" in sql and "Migrating 0.0.1" not in sql
+    assert "BEGIN;" not in sql and "ALTER TABLE migrations" not in sql
+    # The plan applies cleanly to a database migrated by a live run.
+    import subprocess
+    current = tmp_path / "current.db"
+    run_cli(base + ["--database", str(current), "--range", "^0.0.1"])
+    if shutil.which("sqlite3"):
+        proc = subprocess.run(["sqlite3", "-bail", str(current)], input=sql, text=True, capture_output=True)
+        assert proc.returncode == 0 and proc.stderr == ""
+    else:
+        conn = sqlite3.connect(current)
+        conn.executescript(sql)
+        conn.close()
+    run_cli(["verify"] + base + ["--database", str(current)])
+
+    # A migrations table created by an older zmigrate gets the new columns.
+    run_cli(["compile"] + base + ["-o", str(out), "--applied", str(applied), "--legacy-table"])
+    sql = out.read_text()
+    conn = sqlite3.connect(tmp_path / "old.db")
+    conn.executescript(
+        (mig_dir / "0.0.1" / "up.sql").read_text()
+        + "CREATE TABLE migrations (id INTEGER PRIMARY KEY, revision TEXT NOT NULL UNIQUE);"
+        + "INSERT INTO migrations (revision) VALUES ('0.0.1');"
+    )
+    conn.executescript(sql)
+    assert conn.execute("SELECT size > 0 FROM migrations WHERE revision = '0.0.2'").fetchone() == (1,)
+    conn.close()
+
+    run_cli(["compile"] + base[:2] + ["--driver", "postgres", "--seed", "-o", str(out)])
+    assert "ALTER TABLE migrations ADD COLUMN IF NOT EXISTS up_checksum TEXT;" in out.read_text()
+
+    run_cli(["compile"] + base + ["-o", str(out), "-d", "down"])
+    conn = sqlite3.connect(tmp_path / "offline.db")
+    conn.executescript(out.read_text())
+    assert conn.execute("SELECT COUNT(*) FROM migrations").fetchone()[0] == 0
+    conn.close()
+
+
+def test_batched_bookkeeping(tmp_path):
+    from benchmarks.generate import generate
+    from zmigrate import hooks
+
+    root = tmp_path / "tree"
+    generate(str(root), revisions=20, statements=1)
+    db_path = tmp_path / "db.sqlite"
+    base = ["--migration-dir", str(root), "--driver", "sqlite3", "--database", str(db_path)]
+    run_cli(base)
+
+    statements = []
+
+    def hook(event):
+        if event.kind == "statement" and event.phase == "stop":
+            statements.append(event)
+
+    hooks.register(hook)
+    try:
+        run_cli(base + ["-d", "down", "--transaction", "batch"])
+    finally:
+        hooks.unregister(hook)
+    deletes = [e for e in statements if e.name.startswith("DELETE FROM migrations")]
+    assert len(deletes) == 1 and deletes[0].rows == 20
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM migrations").fetchone()[0] == 0
+    assert conn.execute(
+        "SELECT COUNT(*) FROM migrations_stats WHERE direction = 'down'"
+    ).fetchone()[0] == 20
+    conn.close()
+
+    # Values are bound, not interpolated.
+    evil = "x'); DROP TABLE migrations; --"
+    with zmigrate.SUPPORTED_DRIVERS["sqlite3"](SimpleNamespace(database=str(db_path))) as db:
+        db.insert_row("migrations", revision=evil)
+        assert db.get_rows("migrations", ["revision"], revision=evil) == [(evil,)]
+
+
+def test_version_index(tmp_path):
+    from zmigrate.index import Index
+
+    assert Dir("0.1.0") > Dir("0.0.70000")
+    assert Dir("0.256.0") < Dir("1.0.0")
+    assert sorted([Dir("0.0.10"), Dir("0.0.9"), Dir("10.0.0")])[-1] == Dir("10.0.0")
+    assert len({Dir("1.2.3"), Dir("1.2.3")}) == 1
+
+    index = Index(Dir("0.%d.%d" % (i // 1000, i % 1000)) for i in range(100000))
+    up = SimpleNamespace(direction="up", range=Range("0.50.998^0.51.1"))
+    assert [str(d) for d in index.select(up)] == ["0.50.998", "0.50.999", "0.51.0", "0.51.1"]
+    down = SimpleNamespace(direction="down", range=Range("0.51.1^0.50.999"))
+    assert [str(d) for d in zmigrate.plan(down, index, {"0.51.1", "0.50.999"})] == [
+        "0.51.1", "0.50.999",
+    ]
+    assert Dir("0.99.999") in index and Dir("0.100.0") not in index
+
+    small = Index((Dir("0.0.%d" % i) for i in range(5)), reverse=True)
+    expected = [Dir("0.0.%d" % i) for i in reversed(range(5))]
+    assert [small[i] for i in range(-5, 5)] == expected + expected
+    assert small[1:4] == expected[1:4] and small[::-2] == expected[::-2]
+    import pytest
+    with pytest.raises(IndexError):
+        small[5]
+
+    run_cli([
+        "--migration-dir", "tests/sqlite3/migration", "--driver", "sqlite3",
+        "--database", str(tmp_path / "db.sqlite"), "-r", "^0.0.1",
+    ])
+    args = zmigrate.parse_args([
+        "status", "--migration-dir", "tests/sqlite3/migration", "--driver", "sqlite3",
+        "--database", str(tmp_path / "db.sqlite"),
+    ])
+    assert [str(d) for d in zmigrate.status(args, zmigrate.open_tree(args))] == ["0.0.2"]
+
+
+def test_dependency_schedule(tmp_path, caplog):
+    import json
+    import threading
+    import time
+    from zmigrate import schedule
+    from zmigrate.meta import Meta
+
+    pending = [Dir("0.0.%d" % i) for i in range(1, 6)]
+    metas = {d: Meta() for d in pending}
+    metas[Dir("0.0.2")] = Meta(depends=["0.0.1"])
+    metas[Dir("0.0.3")] = Meta(depends=["0.0.1"])
+    up = SimpleNamespace(direction="up")
+    deps = schedule.dependencies(up, pending, metas, set())
+    assert deps[Dir("0.0.2")] == deps[Dir("0.0.3")] == {Dir("0.0.1")}
+    assert deps[Dir("0.0.4")] == {Dir("0.0.1"), Dir("0.0.2"), Dir("0.0.3")}
+    assert deps[Dir("0.0.5")] == {Dir("0.0.4")}
+    down = schedule.dependencies(SimpleNamespace(direction="down"), pending, metas, set())
+    assert down[Dir("0.0.1")] == {Dir("0.0.2"), Dir("0.0.3"), Dir("0.0.4")}
+
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def work(dir):
+        with lock:
+            active.append(dir)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(dir)
+
+    schedule.run(pending, deps, work, 4)
+    assert max(peak) == 2
+
+    root = tmp_path / "migration"
+    scripts = {
+        "0.0.1": ("CREATE TABLE a (x INTEGER); CREATE TABLE b (x INTEGER);", None),
+        "0.0.2": ("INSERT INTO a VALUES (1);", ["0.0.1"]),
+        "0.0.3": ("INSERT INTO missing VALUES (1);", ["0.0.1"]),
+        "0.0.4": ("INSERT INTO b VALUES (1);", None),
+    }
+    for name, (sql, depends) in scripts.items():
+        (root / name).mkdir(parents=True)
+        (root / name / "up.sql").write_text(sql)
+        (root / name / "down.sql").write_text("")
+        if depends:
+            (root / name / "meta.json").write_text(json.dumps({"depends": depends}))
+    db_path = tmp_path / "db.sqlite"
+    argv = ["--migration-dir", str(root), "--driver", "sqlite3", "--database", str(db_path)]
+    argv += ["--parallel", "2"]
+    import pytest
+    # SQLite has a single writer: the revisions run one at a time.
+    with pytest.raises(sqlite3.OperationalError, match="missing"):
+        run_cli(argv)
+    assert "--parallel is ignored: sqlite3" in caplog.text
+    conn = sqlite3.connect(db_path)
+    revisions = {row[0] for row in conn.execute("SELECT revision FROM migrations")}
+    conn.close()
+    assert revisions == {"0.0.1", "0.0.2"}
+
+    (root / "0.0.3" / "up.sql").write_text("INSERT INTO b VALUES (2);")
+    run_cli(argv)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM migrations").fetchone()[0] == 4
+    assert conn.execute("SELECT COUNT(*) FROM b").fetchone()[0] == 2
+    conn.close()
+
+
+def test_online_mode(tmp_path, monkeypatch):
+    import pytest
+    from zmigrate import online
+    from zmigrate.drivers import Postgres
+    from zmigrate.meta import Meta
+
+    assert online.needs_autocommit("-- build it\nCREATE UNIQUE INDEX CONCURRENTLY i ON t (x)")
+    assert online.needs_autocommit("/* x */ vacuum analyze t")
+    assert not online.needs_autocommit("CREATE INDEX i ON t (x)")
+    args = SimpleNamespace(online=False, lock_timeout="5s", statement_timeout="0", retries=5)
+    assert online.settings(args, Meta()) is None
+    settings = online.settings(args, Meta(online={"lock_timeout": "200ms", "retries": 2}))
+    assert (settings.lock_timeout, settings.statement_timeout, settings.retries) == ("200ms", "0", 2)
+    args.online = True
+    assert online.settings(args, Meta(online=False)) is None
+    with pytest.raises(Exception):
+        online.settings(args, Meta(online={"lock_timeout": "1s; DROP TABLE t"}))
+
+    calls = []
+    delays = []
+    monkeypatch.setattr(online, "sleep", delays.append)
+
+    class LockNotAvailable(Exception):
+        pgcode = online.LOCK_NOT_AVAILABLE
+
+    class FakeCursor:
+        rowcount = -1
+
+        def execute(self, sql, params=None):
+            calls.append(sql)
+            if sql.endswith("ALTER TABLE t ADD COLUMN y INTEGER") and len(delays) < 2:
+                raise LockNotAvailable()
+            self.rows = [("1min", "0")] if "current_setting" in sql else []
+
+        def fetchone(self):
+            return self.rows.pop() if self.rows else None
+
+        def close(self):
+            pass
+
+    class FakeConn:
+        autocommit = False
+
+        def cursor(self):
+            return FakeCursor()
+
+        def commit(self):
+            calls.append("commit")
+
+        def rollback(self):
+            calls.append("rollback")
+
+    db = Postgres.__new__(Postgres)
+    db.conn = FakeConn()
+    db.online = settings
+    db.execute_batch(["ALTER TABLE t ADD COLUMN y INTEGER"])
+    assert len(delays) == 2 and all(0 <= d <= 1.0 for d in delays)
+    assert calls.count("rollback") == 2 and calls[-1] == "commit"
+    # SET LOCAL ends with the implicit transaction of the statement.
+    assert calls[-2].startswith("SET LOCAL lock_timeout = '200ms'; SET LOCAL statement_timeout = '0';")
+
+    delays.clear()
+    calls.clear()
+    db.begin()
+    db.execute_batch(["ALTER TABLE t ADD COLUMN z INTEGER"])
+    assert calls[-2:] == [
+        "SET LOCAL lock_timeout = '1min'; SET LOCAL statement_timeout = '0'",
+        "RELEASE SAVEPOINT zmigrate_online",
+    ]
+    settings.retries = 1
+    with pytest.raises(LockNotAvailable):
+        db.execute_batch(["ALTER TABLE t ADD COLUMN y INTEGER"])
+    assert calls.count("ROLLBACK TO SAVEPOINT zmigrate_online") == 1 and len(delays) == 1
+    db.rollback()
+
+    # In autocommit the session settings are restored even if the statement fails.
+    calls.clear()
+    delays.clear()
+    settings.retries = 0
+    db.conn.autocommit = True
+    with pytest.raises(LockNotAvailable):
+        db.execute_batch(["ALTER TABLE t ADD COLUMN y INTEGER"])
+    assert calls[-2:] == ["SET lock_timeout = '1min'; SET statement_timeout = '0'", "commit"]
+    assert calls.count("SELECT current_setting('lock_timeout'), current_setting('statement_timeout')") == 0
+
+    # VACUUM can't run inside the per-revision transaction: online mode
+    # notices and runs the revision outside of one.
+    root = tmp_path / "migration"
+    (root / "0.0.1").mkdir(parents=True)
+    (root / "0.0.1" / "up.sql").write_text("CREATE TABLE t (x INTEGER);\nVACUUM;\n")
+    (root / "0.0.1" / "down.sql").write_text("DROP TABLE t;")
+    argv = ["--migration-dir", str(root), "--driver", "sqlite3",
+            "--database", str(tmp_path / "db.sqlite"), "--transaction", "migration"]
+    with pytest.raises(sqlite3.OperationalError):
+        run_cli(argv)
+    run_cli(argv + ["--online"])
+    conn = sqlite3.connect(tmp_path / "db.sqlite")
+    assert conn.execute("SELECT revision FROM migrations").fetchall() == [("0.0.1",)]
+    conn.close()
+
+
+def test_resumable_backfill(tmp_path):
+    import json
+    import pytest
+    from zmigrate import backfill
+
+    assert backfill.bind("UPDATE t SET p = '5%' WHERE id BETWEEN :first AND :last::int", "%s") == (
+        "UPDATE t SET p = '5%%' WHERE id BETWEEN %s AND %s::int", ["first", "last"]
+    )
+
+    root = tmp_path / "migration"
+    (root / "0.0.1").mkdir(parents=True)
+    (root / "0.0.1" / "up.sql").write_text(
+        "CREATE TABLE t (x INTEGER PRIMARY KEY, y INTEGER CHECK (y < 30));\n"
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 25)\n"
+        "INSERT INTO t (x) SELECT i FROM n;\n"
+    )
+    (root / "0.0.1" / "down.sql").write_text("DROP TABLE t;")
+    spec = {"table": "t", "key": "x", "batch_size": 10,
+            "statement": "UPDATE t SET y = x * 2 WHERE x BETWEEN :first AND :last"}
+    (root / "0.0.1" / "backfill.json").write_text(json.dumps(spec))
+    db_path = tmp_path / "db.sqlite"
+    argv = ["--migration-dir", str(root), "--driver", "sqlite3", "--database", str(db_path),
+            "--transaction", "migration"]
+    with pytest.raises(sqlite3.IntegrityError):
+        run_cli(argv)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM t WHERE y IS NOT NULL").fetchone()[0] == 10
+    assert conn.execute("SELECT last_key, processed FROM migrations_backfill").fetchall() == [("10", 10)]
+    conn.close()
+
+    # The rerun skips up.sql (the table exists) and continues after key 10.
+    spec["statement"] = "UPDATE t SET y = x WHERE x BETWEEN :first AND :last"
+    (root / "0.0.1" / "backfill.json").write_text(json.dumps(spec))
+    run_cli(argv)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT SUM(y) FROM t").fetchone()[0] == 2 * 55 + sum(range(11, 26))
+    assert conn.execute("SELECT processed FROM migrations_backfill").fetchone()[0] == 25
+    assert conn.execute("SELECT COUNT(*) FROM migrations").fetchone()[0] == 1
+    conn.close()
+
+    run_cli(argv + ["--direction", "down"])
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM migrations_backfill").fetchone()[0] == 0
+    conn.close()
+
+
+def test_sqlite_fast_mode(tmp_path, monkeypatch):
+    import pytest
+    from zmigrate.drivers import SQLite3
+
+    db_path = tmp_path / "fast.db"
+    db = SQLite3(SimpleNamespace(database=str(db_path), sqlite_fast="wal"))
+    assert db.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.conn.execute("PRAGMA synchronous").fetchone()[0] == 0
+    db.execute("CREATE TABLE t (x INTEGER)")
+    other = sqlite3.connect(db_path, timeout=0)
+    with pytest.raises(sqlite3.OperationalError):
+        other.execute("SELECT * FROM t").fetchall()
+    db.close()
+    assert other.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert other.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    other.close()
+
+    run_cli([
+        "--migration-dir",
+        "tests/sqlite3/migration",
+        "--driver",
+        "sqlite3",
+        "--database",
+        str(tmp_path / "seeded.db"),
+        "--seed",
+        "--sqlite-fast",
+        "--maintenance",
+        "vacuum",
+    ])
+    conn = sqlite3.connect(tmp_path / "seeded.db")
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()[0] == 1
+    conn.close()
+
+    # Tenants share their database: it is maintained once, after all of them.
+    from copy import copy
+    from zmigrate import tenants
+
+    maintained = []
+    monkeypatch.setattr(SQLite3, "maintain", lambda self, vacuum=False: maintained.append(vacuum))
+
+    def run_all(args, connect, names, work):
+        for schema in ("tenant_a", "tenant_b"):
+            schemaArgs = copy(args)
+            schemaArgs.database = str(tmp_path / (schema + ".db"))
+            with connect(schemaArgs) as db:
+                work(schemaArgs, db)
+        return []
+
+    monkeypatch.setattr(tenants, "run_all", run_all)
+    argv = ["--migration-dir", "tests/sqlite3/migration", "--driver", "sqlite3",
+            "--database", str(tmp_path / "tenants.db"), "--schemas", "tenant_*", "--maintenance", "vacuum"]
+    run_cli(argv)
+    assert maintained == [True]
+    run_cli(argv)
+    assert maintained == [True]
+
+
+def test_migration_lock(tmp_path, caplog):
+    import logging
+    import threading
+    import time
+    from zmigrate.drivers import SQLite3
+
+    db_path = tmp_path / "test.db"
+    argv = [
+        "--migration-dir",
+        "tests/sqlite3/migration",
+        "--driver",
+        "sqlite3",
+        "--database",
+        str(db_path),
+        "--fast-path",
+    ]
+    holder = SQLite3(SimpleNamespace(database=str(db_path)))
+    with caplog.at_level(logging.INFO):
+        with holder.migration_lock() as waited:
+            assert not waited
+            assert (tmp_path / "test.db.lock").read_text().startswith("zmigrate ")
+            waiter = threading.Thread(target=run_cli, args=(argv,))
+            waiter.start()
+            time.sleep(0.3)
+            assert waiter.is_alive()
+            # This "process" migrates while the other one waits.
+            args = zmigrate.parse_args(argv)
+            tree = zmigrate.open_tree(args)
+            zmigrate.migrate_plan(args, zmigrate.load_dirs(args, tree.names()), holder, tree)
+        waiter.join(10)
+    holder.close()
+    assert not waiter.is_alive()
+    assert "Waiting for the migration lock held by zmigrate " in caplog.text
+    assert "migrated to head by another process" in caplog.text
+    assert not (tmp_path / "test.db.lock").exists()
+
+
+def test_pack_bundle(tmp_path):
+    import pytest
+    from zmigrate.bundle import Bundle
+    from zmigrate.tree import Tree
+
+    bundle_path = tmp_path / "migrations.zmp"
+    run_cli(["pack", "--migration-dir", "tests/sqlite3/migration", "-o", str(bundle_path), "--compress"])
+    tree = Tree("tests/sqlite3/migration")
+    bundle = Bundle(str(bundle_path))
+    assert sorted(bundle.names()) == sorted(tree.names())
+    for name in tree.names():
+        for script in ("up.sql", "down.sql", "seed.sql"):
+            assert bundle.has(name, script) == tree.has(name, script)
+            if tree.has(name, script):
+                assert bundle.checksum(name, script) == tree.checksum(name, script)
+                with bundle.open(name, script) as fh, tree.open(name, script) as expected:
+                    assert fh.read() == expected.read()
+        assert bundle.files(name, "seed") == tree.files(name, "seed")
+    assert bundle.verify() == []
+
+    db_path = tmp_path / "bundle.db"
+    argv = ["--migration-dir", str(bundle_path), "--driver", "sqlite3", "--database", str(db_path), "--seed"]
+    run_cli(argv)
+    run_cli(["verify"] + argv)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM migrations").fetchone()[0] == len(tree.names())
+    conn.close()
+
+    # Flip a byte inside the first blob.
+    data = bytearray(bundle_path.read_bytes())
+    data[20] ^= 0xFF
+    bundle_path.write_bytes(bytes(data))
+    with pytest.raises(Exception, match="corrupt"):
+        run_cli(["verify"] + argv)
+
+    bundle.close()
+    empty = tmp_path / "empty.zmp"
+    empty.write_bytes(b"")
+    with pytest.raises(Exception, match="not a migration bundle"):
+        Bundle(str(empty))
+
+
+def test_split_seed_scripts(tmp_path, monkeypatch, caplog):
+    import json
+    import logging
+    from zmigrate.drivers import SQLite3
+
+    root = tmp_path / "migration"
+    (root / "0.0.1" / "seed.d").mkdir(parents=True)
+    (root / "0.0.1" / "up.sql").write_text(
+        "CREATE TABLE a (x INTEGER); CREATE TABLE b (x INTEGER); CREATE TABLE c (x INTEGER);"
+    )
+    (root / "0.0.1" / "down.sql").write_text("DROP TABLE a; DROP TABLE b; DROP TABLE c;")
+    for table in "abc":
+        (root / "0.0.1" / "seed.d" / f"{table}.sql").write_text(
+            f"INSERT INTO {table} VALUES (1); INSERT INTO {table} VALUES (2);"
+        )
+
+    def migrate(name):
+        db_path = tmp_path / name
+        with caplog.at_level(logging.INFO):
+            run_cli(["--migration-dir", str(root), "--driver", "sqlite3",
+                     "--database", str(db_path), "--seed", "--seed-jobs", "3"])
+        conn = sqlite3.connect(db_path)
+        counts = [conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in "abc"]
+        conn.close()
+        assert counts == [2, 2, 2]
+
+    # SQLite falls back to one connection.
+    migrate("serial.db")
+    assert "over 3 connection(s)" not in caplog.text
+    assert caplog.text.count("Loaded ") == 3
+
+    caplog.clear()
+    monkeypatch.setattr(SQLite3, "concurrent", True)
+    migrate("parallel.db")
+    assert "Loading 3 seed script(s) over 3 connection(s)" in caplog.text
+
+    caplog.clear()
+    (root / "0.0.1" / "meta.json").write_text(json.dumps({"seed_order": ["c.sql"]}))
+    migrate("ordered.db")
+    assert "over 3 connection(s)" not in caplog.text
+    loaded = [line for line in caplog.text.splitlines() if "Loaded " in line]
+    assert [line.split("seed.d/")[1][0] for line in loaded] == ["c", "a", "b"]
+
+    # Templates are rebuilt when a split seed script or meta.json changes.
+    from zmigrate import template
+    from zmigrate.tree import Tree
+
+    args = zmigrate.parse_args(["--migration-dir", str(root), "--driver", "sqlite3", "--seed"])
+    dirs = zmigrate.load_dirs(args, ["0.0.1"])
+    fingerprints = {template.fingerprint(args, Tree(str(root)), dirs)}
+    (root / "0.0.1" / "seed.d" / "a.sql").write_text("INSERT INTO a VALUES (3);")
+    fingerprints.add(template.fingerprint(args, Tree(str(root)), dirs))
+    (root / "0.0.1" / "meta.json").write_text(json.dumps({"seed_order": ["b.sql"]}))
+    fingerprints.add(template.fingerprint(args, Tree(str(root)), dirs))
+    assert len(fingerprints) == 3
+
+    # A manifest's cached checksums are reused instead of reading the files.
+    from zmigrate.tree import Manifest
+
+    manifest = str(tmp_path / "manifest.json")
+    first = Manifest(str(root), manifest)
+    expected = template.fingerprint(args, first, dirs)
+    first.save()
+    hashed = []
+    realChecksum = Tree.checksum
+    monkeypatch.setattr(Tree, "checksum", lambda self, dir, name: hashed.append(name) or realChecksum(self, dir, name))
+    assert template.fingerprint(args, Manifest(str(root), manifest), dirs) == expected
+    assert hashed == []
@@ -1,15 +1,26 @@
 """Command line interface for ``zmigrate``."""
 
 from argparse import ArgumentParser
-from os import listdir
+from copy import copy
+from dataclasses import replace
 from os.path import isdir, isfile
-from typing import Iterable, Optional
+from time import monotonic
+from typing import Any, Callable, Iterable, List, Optional, Set
 import logging
+import sys
+import threading
 
+from zmigrate import backfill, checksum, head, hooks, online, schedule, seed, stats, targets, template, tenants
+from zmigrate.bookkeeping import Bookkeeping, now
 from zmigrate.config import Config, load as load_config
 from zmigrate.dir import Dir
-from zmigrate.drivers import SUPPORTED_DRIVERS
+from zmigrate.index import Index
+from zmigrate.meta import Meta, read as read_meta
+from zmigrate.registry import SUPPORTED_DRIVERS
 from zmigrate.range import Range
+from zmigrate.script import execute_file, execute_stream
+from zmigrate.squash import check_baseline
+from zmigrate.tree import Manifest, Tree
 
 logger = logging.getLogger(__name__)
 
@@ -34,11 +45,22 @@ def dir_validator(value: str) -> str:
         return value
     raise Exception(f"{value} isn't a valid directory path")
 
+def tree_validator(value: str) -> str:
+    if isdir(value) or isfile(value):
+        return value
+    raise Exception(f"{value} isn't a migration directory or bundle")
+
 def parse_args(argv: Optional[Iterable[str]] = None) -> Config:
     """Return parsed CLI arguments as a :class:`~zmigrate.config.Config`."""
 
     cfg = load_config()
     parser = ArgumentParser()
+    parser.add_argument(
+        'command',
+        nargs='?',
+        default='migrate',
+        choices=('migrate', 'status', 'verify', 'squash', 'stats', 'compile', 'pack')
+    )
     parser.add_argument(
         '-d',
         '--direction',
@@ -62,16 +84,35 @@ def parse_args(argv: Optional[Iterable[str]] = None) -> Config:
         const=True,
         type=str_to_bool
     )
+    parser.add_argument(
+        '-F',
+        '--fast-path',
+        default=cfg.fast_path,
+        nargs='?',
+        const=True,
+        type=str_to_bool
+    )
+    parser.add_argument(
+        '-t',
+        '--transaction',
+        default=cfg.transaction,
+        choices=('statement', 'migration', 'batch')
+    )
     parser.add_argument(
         '-m',
         '--migration-dir',
         default=cfg.migration_dir,
-        type=dir_validator
+        type=tree_validator
+    )
+    parser.add_argument(
+        '--manifest',
+        default=cfg.manifest,
+        type=str
     )
     parser.add_argument(
         '--driver',
         default=cfg.driver,
-        choices=SUPPORTED_DRIVERS.keys()
+        choices=SUPPORTED_DRIVERS
     )
     parser.add_argument(
         '-u',
@@ -103,105 +144,708 @@ def parse_args(argv: Optional[Iterable[str]] = None) -> Config:
         default=Range(),
         type=Range
     )
+    parser.add_argument(
+        '-o',
+        '--output',
+        default=None,
+        type=str
+    )
+    parser.add_argument(
+        '--template',
+        default=cfg.template,
+        nargs='?',
+        const=True,
+        type=str_to_bool
+    )
+    parser.add_argument(
+        '--template-dir',
+        default=cfg.template_dir,
+        type=str
+    )
+    parser.add_argument(
+        '-T',
+        '--targets',
+        default=cfg.targets,
+        type=lambda value: targets.load(file_validator(value))
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        default=cfg.jobs,
+        type=int
+    )
+    parser.add_argument(
+        '-P',
+        '--parallel',
+        default=cfg.parallel,
+        type=int
+    )
+    parser.add_argument(
+        '--schemas',
+        default=cfg.schemas,
+        type=lambda value: [x.strip() for x in value.split(',') if x.strip()]
+    )
+    parser.add_argument(
+        '--tenant-batch',
+        default=cfg.tenant_batch,
+        type=int
+    )
+    parser.add_argument(
+        '--online',
+        default=cfg.online,
+        nargs='?',
+        const=True,
+        type=str_to_bool
+    )
+    parser.add_argument(
+        '--lock-timeout',
+        default=cfg.lock_timeout,
+        type=str
+    )
+    parser.add_argument(
+        '--statement-timeout',
+        default=cfg.statement_timeout,
+        type=str
+    )
+    parser.add_argument(
+        '--retries',
+        default=cfg.retries,
+        type=int
+    )
+    parser.add_argument(
+        '--seed-jobs',
+        default=cfg.seed_jobs,
+        type=int
+    )
+    parser.add_argument(
+        '--lock',
+        default=cfg.lock,
+        nargs='?',
+        const=True,
+        type=str_to_bool
+    )
+    parser.add_argument(
+        '--sqlite-fast',
+        default=cfg.sqlite_fast,
+        nargs='?',
+        const='memory',
+        choices=('memory', 'wal')
+    )
+    parser.add_argument(
+        '--maintenance',
+        default=cfg.maintenance,
+        choices=('no', 'analyze', 'vacuum')
+    )
+    parser.add_argument(
+        '--profile',
+        default=cfg.profile,
+        type=str
+    )
+    parser.add_argument(
+        '--compress',
+        default=False,
+        nargs='?',
+        const=True,
+        type=str_to_bool
+    )
+    parser.add_argument(
+        '--applied',
+        default=None,
+        type=file_validator
+    )
+    parser.add_argument(
+        '--legacy-table',
+        default=False,
+        nargs='?',
+        const=True,
+        type=str_to_bool
+    )
+    parser.add_argument(
+        '-n',
+        '--limit',
+        default=cfg.limit,
+        type=int
+    )
     return parser.parse_args(argv)
 
 def main(argv: Optional[Iterable[str]] = None) -> None:
     args = parse_args(argv)
 
     if args.range.first and args.range.last:
-        if args.direction == "up" and args.range.last.toInt() < args.range.first.toInt():
+        if args.direction == "up" and args.range.last < args.range.first:
             raise Exception(f"Invalid range: {args.range.first} > {args.range.last}")
-        if args.direction == "down" and args.range.first.toInt() < args.range.last.toInt():
+        if args.direction == "down" and args.range.first < args.range.last:
             raise Exception(f"Invalid range: {args.range.first} < {args.range.last}")
 
-    dirs = sorted(
-        [Dir(d) for d in listdir(args.migration_dir)],
-        key=lambda x: x.toInt(),
-        reverse=args.direction == "down",
-    )
-    migrate(args, dirs)
+    tree = open_tree(args)
+    profiler = None
+    if args.profile:
+        profiler = hooks.Profiler()
+        hooks.register(profiler)
+    try:
+        if args.command == 'verify':
+            verify(args, tree)
+        elif args.command == 'squash':
+            from zmigrate.squash import squash
+            squash(args, tree, load_dirs(args, tree.names()), SUPPORTED_DRIVERS[args.driver])
+        elif args.command == 'status':
+            status(args, tree)
+        elif args.command == 'compile':
+            compile_plan(args, tree)
+        elif args.command == 'pack':
+            pack(args)
+        elif args.command == 'stats':
+            with SUPPORTED_DRIVERS[args.driver](args) as db:
+                create_migrations_table(db)
+                stats.report(db, args.limit)
+        else:
+            run(args, tree)
+    finally:
+        tree.save()
+        tree.close()
+        if profiler:
+            hooks.unregister(profiler)
+            profiler.write(args.profile)
 
-def upgrade(args, dir, db):
-    scripts = ['up.sql']
-    if args.seed:
-        scripts.append('seed.sql')
-    
-    if args.range.first and dir.toInt() < args.range.first.toInt():
+def open_tree(args) -> Tree:
+    if isfile(args.migration_dir):
+        from zmigrate.bundle import Bundle
+        return Bundle(args.migration_dir)
+    if args.manifest:
+        return Manifest(args.migration_dir, args.manifest)
+    return Tree(args.migration_dir)
+
+def run(args, tree: Tree) -> None:
+    names = tree.names()
+    if args.schemas:
+        dirs = load_dirs(args, names)
+        changed = []
+        results = tenants.run_all(
+            args,
+            SUPPORTED_DRIVERS[args.driver],
+            names,
+            lambda schemaArgs, db: changed.append(migrate(schemaArgs, dirs, db, tree)),
+        )
+        if any(changed) and args.maintenance != 'no':
+            with SUPPORTED_DRIVERS[args.driver](args) as db:
+                db.maintain(vacuum=args.maintenance == 'vacuum')
+        targets.raise_for_failures(results, 'schema')
+        return
+    dirs = None
+    provide = None
+    if template.wanted(args):
+        dirs = load_dirs(args, names)
+        provide = template.provider(
+            tree, dirs, lambda tplArgs: SUPPORTED_DRIVERS[tplArgs.driver](tplArgs),
+            lambda tplArgs, tplDirs, db: migrate(tplArgs, tplDirs, db, tree),
+        )
+    if not args.targets:
+        migrate_target(args, tree, names, dirs, provide)
         return
-    if args.range.last and dir.toInt() > args.range.last.toInt():
+
+    # Parse the tree once and share it between all workers.
+    if dirs is None:
+        dirs = load_dirs(args, names)
+    results = targets.run(
+        args,
+        args.targets,
+        lambda targetArgs: migrate_target(targetArgs, tree, names, dirs, provide),
+        args.jobs,
+    )
+    targets.raise_for_failures(results)
+
+def pack(args) -> None:
+    """Pack ``args.migration_dir`` into the bundle ``args.output``."""
+    from zmigrate.bundle import pack as pack_tree
+    if not isdir(args.migration_dir):
+        raise Exception(f"{args.migration_dir} isn't a migration directory")
+    if not args.output:
+        raise Exception("pack needs --output")
+    pack_tree(args.migration_dir, args.output, args.compress)
+
+def verify(args, tree: Tree) -> None:
+    """Fail if any applied script changed since it was applied.
+
+    A bundle is first checked against its own checksums.
+    """
+    if hasattr(tree, 'verify'):
+        corrupt = tree.verify()
+        if corrupt:
+            raise Exception(f"{len(corrupt)} corrupt file(s) in bundle {args.migration_dir}")
+    with SUPPORTED_DRIVERS[args.driver](args) as db:
+        create_migrations_table(db)
+        drift = checksum.verify(db, tree)
+    if drift:
+        raise Exception(f"{len(drift)} applied script(s) changed since they were applied")
+
+def status(args, tree: Tree) -> List[Dir]:
+    """Log the revisions of ``args.range`` that are pending and return them."""
+    dirs = load_dirs(args, tree.names())
+    with SUPPORTED_DRIVERS[args.driver](args) as db:
+        create_migrations_table(db)
+        applied = get_applied(db)
+    selected = dirs.select(args)
+    pending = plan(args, dirs, applied)
+    for dir in pending:
+        logger.info("%s: pending", dir)
+    unknown = [revision for revision in applied if Dir(revision) not in dirs]
+    if unknown:
+        # Revisions squashed into a baseline stay applied but leave the tree.
+        replaced = set()
+        for dir in dirs:
+            replaced.update(load_revision_meta(tree, dir).replaces)
+        unknown = [revision for revision in unknown if revision not in replaced]
+    for revision in sorted(unknown, key=Dir):
+        logger.warning("%s is applied but missing from the tree", revision)
+    logger.info(
+        "%d revision(s) in range, %d pending %s", len(selected), len(pending), args.direction
+    )
+    return pending
+
+def compile_plan(args, tree: Tree) -> None:
+    """Write the SQL of the pending plan to ``args.output`` (stdout by default).
+
+    The target's applied revisions are read from ``args.applied``; without it
+    the target is assumed to be empty for ``up`` and fully migrated for
+    ``down``.
+    """
+    from zmigrate import offline
+
+    dirs = load_dirs(args, tree.names())
+    if args.applied:
+        applied = offline.read_applied(args.applied)
+    elif args.direction == 'up':
+        applied = set()
+    else:
+        applied = {str(d) for d in dirs}
+    pending = plan(args, dirs, applied)
+    if not args.output or args.output == '-':
+        offline.compile_plan(
+            args, tree, pending, applied, sys.stdout, MIGRATIONS_COLUMNS, load_revision_meta
+        )
         return
+    with open(args.output, "w", encoding="utf-8") as out:
+        offline.compile_plan(
+            args, tree, pending, applied, out, MIGRATIONS_COLUMNS, load_revision_meta
+        )
+
+def load_dirs(args, names: Iterable[str]) -> Index:
+    """Parse the migration directory ``names`` into an index ordered for ``args.direction``."""
+    return Index((Dir(d) for d in names), reverse=args.direction == "down")
+
+def migrate_target(args, tree: Tree, names: List[str], dirs: Optional[Index] = None,
+                   provide: Optional[Callable[[Any], str]] = None) -> None:
+    """Migrate the database described by ``args`` to the tree made of ``names``.
+
+    ``dirs`` may hold the already parsed ``names``; otherwise they are only
+    parsed once the fast path has been ruled out. A missing database is
+    cloned from the template returned by ``provide``, see
+    :func:`zmigrate.template.provider`.
+    """
+    if provide is not None and not SUPPORTED_DRIVERS[args.driver].exists(args):
+        args = copy(args)
+        args.template_database = provide(args)
+
+    with SUPPORTED_DRIVERS[args.driver](args) as db:
+        if db.cloned:
+            return
+        if args.fast_path and args.direction == "up" and head.matches(db, names):
+            logger.info("Database is already at head. Nothing to migrate")
+            return
+        if dirs is None:
+            dirs = load_dirs(args, names)
+        migrate(args, dirs, db, tree)
 
-    migInfo = db.get_rows('migrations', '*', 1, revision="'%s'" % dir)
-    if len(migInfo) > 0:
-        logger.info("%s is already migrated. Skipping", dir)
+def in_range(args, dir) -> bool:
+    """Return whether ``dir`` falls inside ``args.range`` for ``args.direction``."""
+    first, last = args.range.first, args.range.last
+    if args.direction == 'up':
+        if first and dir < first:
+            return False
+        if last and dir > last:
+            return False
+    else:
+        if first and dir > first:
+            return False
+        if last and dir < last:
+            return False
+    return True
+
+def get_applied(db) -> Set[str]:
+    """Return every revision recorded in the ``migrations`` table using one query."""
+    return {row[0] for row in db.get_rows('migrations', ['revision'])}
+
+def plan(args, dirs, applied: Set[str]) -> List[Dir]:
+    """Return the subset of ``dirs`` that needs applying (or reverting).
+
+    ``applied`` is the set of revisions already recorded in the database, as
+    returned by :func:`get_applied`. No database access happens here. An
+    :class:`~zmigrate.index.Index` is sliced with bisect; any other sequence
+    is scanned.
+    """
+    if isinstance(dirs, Index):
+        candidates = dirs.select(args)
+    else:
+        candidates = [dir for dir in dirs if in_range(args, dir)]
+    pending = []
+    for dir in candidates:
+        migrated = str(dir) in applied
+        if args.direction == 'up' and migrated:
+            logger.debug("%s is already migrated. Skipping", dir)
+        elif args.direction == 'down' and not migrated:
+            logger.debug("%s not migrated. No downgrading needed", dir)
+        else:
+            pending.append(dir)
+    return pending
+
+def load_revision_meta(tree: Tree, dir) -> Meta:
+    if not tree.has(dir, 'meta.json'):
+        return Meta()
+    with tree.open(dir, 'meta.json') as fh:
+        return read_meta(fh)
+
+def prepare_revision(args, tree: Tree, dir, meta: Meta, db) -> Meta:
+    """Set up ``db`` for the online settings of ``dir``, see :mod:`zmigrate.online`.
+
+    Returns ``meta``, opted out of transactions when the script to run has
+    statements that can't run inside one, or when ``dir`` has a backfill
+    (whose chunks commit one by one, see :mod:`zmigrate.backfill`).
+    """
+    db.online = online.settings(args, meta)
+    if not meta.transaction:
+        return meta
+    if args.direction == 'up' and tree.has(dir, backfill.FILE):
+        logger.info("%s has a backfill, running it outside of a transaction", dir)
+        return replace(meta, transaction=False)
+    if db.online:
+        script = 'up.sql' if args.direction == 'up' else 'down.sql'
+        if online.requires_autocommit(tree, dir, script):
+            logger.info("%s has statements that can't run in a transaction", dir)
+            return replace(meta, transaction=False)
+    return meta
+
+def upgrade(args, dir, db, tree: Optional[Tree] = None, meta: Optional[Meta] = None,
+            book: Optional[Bookkeeping] = None):
+    """Apply revision ``dir``.
+
+    Its bookkeeping is queued in ``book`` when given (the caller flushes it),
+    and written right away otherwise.
+    """
+    if tree is None:
+        with open_tree(args) as tree:
+            return upgrade(args, dir, db, tree, meta, book)
+    if book is None:
+        book = Bookkeeping(db)
+        upgrade(args, dir, db, tree, meta, book)
+        book.flush()
         return
+    meta = meta or load_revision_meta(tree, dir)
+    scripts = ['up.sql']
+    if args.seed:
+        scripts.append('seed.sql')
 
+    started = monotonic()
+    size = 0
     logger.info("Migrating %s", dir)
-    readmePath = '%s/%s/readme' % (args.migration_dir, dir)
-    if isfile(readmePath):
-        with open(readmePath, "r", encoding="utf-8") as fh:
+    if tree.has(dir, 'readme'):
+        with tree.open(dir, 'readme') as fh:
             for raw_line in fh:
                 line = raw_line.strip()
                 if not line:
                     continue
                 logger.info("|- %s", line)
 
+    backfills = backfill.load(tree, dir)
+    # Started backfills mean the scripts of an interrupted run were applied.
+    startedBackfills = backfill.checkpoints(db, str(dir)) if backfills else {}
+    if startedBackfills:
+        logger.info("Resuming the backfill of %s", dir)
+
+    checksums = {column: None for column in checksum.COLUMNS.values()}
     for script in scripts:
-        scriptPath = '%s/%s/%s' % (args.migration_dir, dir, script)
-        if not isfile(scriptPath):
-            if args.skip_missing:
+        scriptPath = tree.path(dir, script)
+        if not tree.has(dir, script):
+            # A seed/ directory or a backfill on its own is a complete revision.
+            if args.skip_missing or (script == 'seed.sql' and (
+                    tree.files(dir, 'seed') or tree.files(dir, seed.SPLIT_DIR))) \
+                    or (script == 'up.sql' and backfills):
                 continue
             raise Exception('Missing %s' % scriptPath)
+        size += tree.stat(dir, script)[0]
+        if startedBackfills:
+            checksums[checksum.COLUMNS[script]] = tree.checksum(dir, script)
+            continue
         logger.info("Executing %s", scriptPath)
-        with open(scriptPath, "r", encoding="utf-8") as fh:
-            db.execute_script(fh.read().strip())
-    db.insert_row('migrations', revision="'%s'" % dir)
-
-def downgrade(args, dir, db):
-    if args.range.first and dir.toInt() > args.range.first.toInt():
-        return
-    if args.range.last and dir.toInt() < args.range.last.toInt():
-        return
+        event = hooks.start('script', scriptPath) if hooks.enabled else None
+        with tree.open_binary(dir, script) as fh:
+            checksums[checksum.COLUMNS[script]] = execute_file(db, fh)
+        if event:
+            hooks.stop(event, bytes=tree.stat(dir, script)[0])
+    if args.seed:
+        if not startedBackfills:
+            seed.load_dir(db, tree, dir)
+            seed.load_split(args, db, tree, dir, meta.seed_order, SUPPORTED_DRIVERS[args.driver])
+        size += sum(tree.stat(dir, 'seed/' + name)[0] for name in tree.files(dir, 'seed'))
+        size += sum(tree.stat(dir, name)[0] for name in seed.split_files(tree, dir))
+    for item in backfills:
+        backfill.run(db, str(dir), item, startedBackfills.get(item.name))
+    duration = monotonic() - started
+    book.insert_row(
+        'migrations',
+        revision=str(dir),
+        duration=duration,
+        size=size,
+        applied_at=now(),
+        **checksums,
+    )
+    stats.record(book, str(dir), 'up', duration, size)
+    # A baseline stands for every revision it replaced.
+    for revision in meta.replaces:
+        if revision != str(dir):
+            book.insert_row('migrations', revision=revision)
 
-    migInfo = db.get_rows('migrations', '*', 1, revision="'%s'" % dir)
-    if not len(migInfo):
-        logger.info("%s not migrated. No downgrading needed", dir)
+def downgrade(args, dir, db, tree: Optional[Tree] = None, meta: Optional[Meta] = None,
+              book: Optional[Bookkeeping] = None):
+    """Revert revision ``dir``, queueing its bookkeeping in ``book`` like :func:`upgrade`."""
+    if tree is None:
+        with open_tree(args) as tree:
+            return downgrade(args, dir, db, tree, meta, book)
+    if book is None:
+        book = Bookkeeping(db)
+        downgrade(args, dir, db, tree, meta, book)
+        book.flush()
         return
-
+    meta = meta or load_revision_meta(tree, dir)
+    started = monotonic()
+    size = 0
     logger.info("Downgrading %s", dir)
-    scriptPath = '%s/%s/down.sql' % (args.migration_dir, dir)
-    if not isfile(scriptPath):
+    scriptPath = tree.path(dir, 'down.sql')
+    if not tree.has(dir, 'down.sql'):
         if not args.skip_missing:
             raise Exception('Missing %s' % scriptPath)
     else:
         logger.info("Executing %s", scriptPath)
-        with open(scriptPath, "r", encoding="utf-8") as fh:
-            db.execute_script(fh.read().strip())
-    db.delete_row("migrations", "revision = '%s'" % dir)
+        event = hooks.start('script', scriptPath) if hooks.enabled else None
+        with tree.open(dir, 'down.sql') as fh:
+            execute_stream(db, fh)
+        size = tree.stat(dir, 'down.sql')[0]
+        if event:
+            hooks.stop(event, bytes=size)
+    book.delete_row('migrations', 'revision', str(dir))
+    if tree.has(dir, backfill.FILE):
+        backfill.clear(db, str(dir))
+    stats.record(book, str(dir), 'down', monotonic() - started, size)
+    for revision in meta.replaces:
+        if revision != str(dir):
+            book.delete_row('migrations', 'revision', revision)
 
-def migrate(args, dirs):
-    with SUPPORTED_DRIVERS[args.driver](args) as db:
-        # We create the table without columns for backwawrd-compatibility purposes.
-        # This allows us to easily add new columns and drop existing columns without
-        # issues in the future.
-        columns = [
-            {
-                'name': 'id',
-                'type': 'SERIAL',
-                'constraints': 'PRIMARY KEY'
-            },
-            {
-                'name': 'revision',
-                'type': 'TEXT',
-                'constraints': 'NOT NULL UNIQUE',
-            }
-
-        ]
-        db.create_table('migrations', columns)
+MIGRATIONS_COLUMNS = [
+    {
+        'name': 'id',
+        'type': 'SERIAL',
+        'constraints': 'PRIMARY KEY'
+    },
+    {
+        'name': 'revision',
+        'type': 'TEXT',
+        'constraints': 'NOT NULL UNIQUE',
+    },
+    {
+        'name': 'up_checksum',
+        'type': 'TEXT',
+    },
+    {
+        'name': 'seed_checksum',
+        'type': 'TEXT',
+    },
+    {
+        'name': 'duration',
+        'type': 'DOUBLE PRECISION',
+    },
+    {
+        'name': 'size',
+        'type': 'BIGINT',
+    },
+    {
+        'name': 'applied_at',
+        'type': 'TIMESTAMP',
+    },
+]
 
-        for dir in dirs:
-            if args.direction == 'up':
-                upgrade(args, dir, db)
+def create_migrations_table(db) -> None:
+    # We create the table without columns for backwawrd-compatibility purposes.
+    # This allows us to easily add new columns and drop existing columns without
+    # issues in the future.
+    db.create_table('migrations', MIGRATIONS_COLUMNS)
+    db.add_missing_columns('migrations', MIGRATIONS_COLUMNS)
+    stats.create_table(db)
+
+def mark_applied(args, dir, meta: Meta, applied: Set[str]) -> None:
+    """Update ``applied`` once ``dir`` (and what it replaces) was applied or reverted."""
+    if args.direction == 'up':
+        applied.add(str(dir))
+        applied.update(meta.replaces)
+    else:
+        applied.discard(str(dir))
+        applied.difference_update(meta.replaces)
+
+def run_serial(args, pending: List[Dir], db, tree: Tree, applied: Set[str],
+               progress: stats.Progress, nested: bool) -> None:
+    """Apply (or revert) ``pending`` in order over ``db``, updating ``applied``."""
+    step = upgrade if args.direction == 'up' else downgrade
+    # Within one transaction spanning every revision, bookkeeping is written
+    # once at the end. Otherwise it's written with each revision so that a
+    # failure never leaves reverted revisions recorded as applied.
+    book = Bookkeeping(db)
+    deferred = args.transaction == 'batch' or nested
+    if args.transaction == 'batch' and not nested:
+        db.begin()
+    try:
+        for dir in pending:
+            event = hooks.start('migration', str(dir)) if hooks.enabled else None
+            meta = load_revision_meta(tree, dir)
+            check_baseline(args, dir, meta, applied)
+            meta = prepare_revision(args, tree, dir, meta, db)
+            if not meta.transaction and nested:
+                # Leaving the caller's transaction would commit part of it.
+                raise Exception(
+                    f"{dir} can't run inside a transaction; migrate with --tenant-batch 1"
+                )
+            if not meta.transaction:
+                if args.transaction == 'batch':
+                    logger.warning(
+                        "%s can't run inside a transaction: committing the batch so far", dir
+                    )
+                logger.info("Running %s outside of a transaction", dir)
+                book.flush()
+                with db.no_transaction():
+                    step(args, dir, db, tree, meta, book)
+                    book.flush()
+                if args.transaction == 'batch':
+                    db.begin()
+            elif args.transaction == 'migration' and not nested:
+                with db.transaction():
+                    step(args, dir, db, tree, meta, book)
+                    book.flush()
             else:
-                downgrade(args, dir, db)
+                step(args, dir, db, tree, meta, book)
+                if not deferred:
+                    book.flush()
+            mark_applied(args, dir, meta, applied)
+            if event:
+                hooks.stop(event)
+            progress.advance(str(dir))
+        book.flush()
+    except BaseException:
+        if db.inTransaction and not nested:
+            db.rollback()
+        raise
+    if db.inTransaction and not nested:
+        db.commit()
+
+def run_parallel(args, pending: List[Dir], tree: Tree, applied: Set[str],
+                 progress: stats.Progress) -> None:
+    """Apply (or revert) ``pending`` following their dependencies, see :mod:`zmigrate.schedule`.
+
+    Each worker uses its own connection and records every revision as it
+    completes, so a failure leaves the bookkeeping of finished revisions
+    intact.
+    """
+    step = upgrade if args.direction == 'up' else downgrade
+    metas = {dir: load_revision_meta(tree, dir) for dir in pending}
+    for dir in pending:
+        check_baseline(args, dir, metas[dir], applied)
+    deps = schedule.dependencies(args, pending, metas, applied)
+    connections = schedule.Connections(lambda: SUPPORTED_DRIVERS[args.driver](args))
+    lock = threading.Lock()
+
+    def work(dir: Dir) -> None:
+        db = connections.get()
+        event = hooks.start('migration', str(dir)) if hooks.enabled else None
+        meta = prepare_revision(args, tree, dir, metas[dir], db)
+        book = Bookkeeping(db)
+        if not meta.transaction:
+            logger.info("Running %s outside of a transaction", dir)
+            with db.no_transaction():
+                step(args, dir, db, tree, meta, book)
+                book.flush()
+        elif args.transaction == 'migration':
+            with db.transaction():
+                step(args, dir, db, tree, meta, book)
+                book.flush()
+        else:
+            step(args, dir, db, tree, meta, book)
+            book.flush()
+        with lock:
+            mark_applied(args, dir, meta, applied)
+        if event:
+            hooks.stop(event)
+        progress.advance(str(dir))
+
+    logger.info("Running up to %d revision(s) at a time", args.parallel)
+    with connections:
+        schedule.run(pending, deps, work, args.parallel)
+
+def migrate(args, dirs, db=None, tree: Optional[Tree] = None) -> int:
+    if db is None:
+        with SUPPORTED_DRIVERS[args.driver](args) as db:
+            return migrate(args, dirs, db, tree)
+    if tree is None:
+        with open_tree(args) as tree:
+            return migrate(args, dirs, db, tree)
+    if not args.lock:
+        return migrate_plan(args, dirs, db, tree)
+    # Only one process migrates a database at a time. The others wait, and
+    # are usually done with a single query once they get the lock.
+    with db.migration_lock() as waited:
+        if waited and args.fast_path and args.direction == 'up' \
+                and head.matches(db, (str(d) for d in dirs)):
+            logger.info("Database was migrated to head by another process")
+            return 0
+        return migrate_plan(args, dirs, db, tree)
+
+def migrate_plan(args, dirs, db, tree: Tree) -> int:
+    """Apply (or revert) whatever ``dirs`` needs on ``db``; see :func:`migrate`.
+
+    Returns the number of revisions applied (or reverted).
+    """
+    create_migrations_table(db)
+
+    applied = get_applied(db)
+    pending = plan(args, dirs, applied)
+    logger.info("%d revision(s) pending", len(pending))
+    if args.direction == 'down' and pending:
+        head.clear(db)
+    if pending:
+        progress = stats.Progress(
+            'revision', [str(d) for d in pending], stats.estimates(db, args.direction)
+        )
+
+    # When the caller already opened a transaction (e.g. to batch several
+    # tenants together) it also owns committing or rolling it back.
+    nested = db.inTransaction
+    parallel = args.parallel > 1 and len(pending) > 1
+    if parallel and not db.concurrent:
+        # SQLite takes one writer at a time: the other connections would
+        # fail with "database is locked".
+        logger.warning("--parallel is ignored: %s runs one writer at a time", args.driver)
+        parallel = False
+    elif parallel and (nested or args.schemas or args.transaction == 'batch'):
+        # Extra connections can't share the caller's transaction or schema.
+        logger.warning("--parallel is ignored for this run")
+        parallel = False
+    if parallel:
+        run_parallel(args, pending, tree, applied, progress)
+    elif pending:
+        run_serial(args, pending, db, tree, applied, progress, nested)
+    # Tenants share the database: :func:`run` maintains it once at the end.
+    if pending and args.maintenance != 'no' and not nested and not args.schemas:
+        db.maintain(vacuum=args.maintenance == 'vacuum')
 
+    if args.direction == 'up':
+        # Only a fully applied tree gets a marker; anything less must keep
+        # taking the slow path.
+        if args.fast_path and dirs and all(str(d) in applied for d in dirs):
+            top = max(dirs)
+            head.write(db, str(top), head.fingerprint(str(d) for d in dirs))
+    return len(pending)
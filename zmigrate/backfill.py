@@ -0,0 +1,172 @@
+"""Resumable data backfills run in small committed chunks.
+
+Besides (or instead of) ``up.sql``, a revision may contain a
+``backfill.json`` describing one backfill or a list of them::
+
+    {
+        "table": "users",
+        "key": "id",
+        "statement": "UPDATE users SET email_lower = lower(email) WHERE id BETWEEN :first AND :last",
+        "batch_size": 5000,
+        "rate": 20000
+    }
+
+The rows of ``table`` are walked in ``key`` order, ``batch_size`` keys at a
+time (keyset pagination, ``key`` should be indexed and unique), and
+``statement`` runs once per chunk with ``:first`` and ``:last`` bound to the
+chunk's lowest and highest key. Each chunk is committed together with a
+checkpoint in ``migrations_backfill``, so an interrupted run resumes after
+the last committed chunk instead of starting over. ``rate`` caps the rows
+processed per second (``0`` for no limit).
+"""
+
+from dataclasses import dataclass
+from json import dumps, loads
+from time import monotonic, sleep
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import re
+
+from zmigrate.bookkeeping import now
+
+logger = logging.getLogger(__name__)
+
+FILE = 'backfill.json'
+TABLE = 'migrations_backfill'
+COLUMNS = [
+    {
+        'name': 'revision',
+        'type': 'TEXT',
+        'constraints': 'NOT NULL',
+    },
+    {
+        'name': 'name',
+        'type': 'TEXT',
+        'constraints': 'NOT NULL',
+    },
+    # JSON encoded key of the last processed row.
+    {
+        'name': 'last_key',
+        'type': 'TEXT',
+    },
+    {
+        'name': 'processed',
+        'type': 'BIGINT',
+    },
+    {
+        'name': 'updated_at',
+        'type': 'TIMESTAMP',
+    },
+]
+
+_BOUND = re.compile(r"(?<!:):(first|last)\b")
+
+
+@dataclass
+class Backfill:
+    table: str
+    key: str
+    statement: str
+    batch_size: int = 1000
+    # Rows per second, ``0`` for no limit.
+    rate: float = 0
+    # Identifies the checkpoint of this backfill; defaults to ``table``.
+    name: str = ""
+
+    def __post_init__(self) -> None:
+        self.name = self.name or self.table
+        if self.batch_size < 1:
+            raise Exception(f"Invalid batch_size for backfill {self.name}: {self.batch_size}")
+
+
+def load(tree, dir) -> List[Backfill]:
+    """Return the backfills of revision ``dir``."""
+    if not tree.has(dir, FILE):
+        return []
+    with tree.open(dir, FILE) as fh:
+        data = loads(fh.read())
+    backfills = [Backfill(**item) for item in (data if isinstance(data, list) else [data])]
+    names = [b.name for b in backfills]
+    if len(set(names)) != len(names):
+        raise Exception(f"Backfills of {dir} need distinct names")
+    return backfills
+
+
+def bind(statement: str, placeholder: str) -> Tuple[str, List[str]]:
+    """Replace ``:first``/``:last`` with ``placeholder`` and return the bound names in order."""
+    names: List[str] = []
+    if placeholder == '%s':
+        # psycopg2 interpolates every ``%`` once parameters are given.
+        statement = statement.replace('%', '%%')
+
+    def mark(match) -> str:
+        names.append(match.group(1))
+        return placeholder
+
+    return _BOUND.sub(mark, statement), names
+
+
+def create_table(db) -> None:
+    db.create_table(TABLE, COLUMNS)
+
+
+def checkpoints(db, revision: str) -> Dict[str, Tuple[Any, int]]:
+    """Return ``{name: (last_key, processed)}`` of the started backfills of ``revision``."""
+    if not db.has_table(TABLE):
+        return {}
+    rows = db.get_rows(TABLE, ['name', 'last_key', 'processed'], revision=revision)
+    return {
+        row[0]: (None if row[1] is None else loads(row[1]), row[2] or 0) for row in rows
+    }
+
+
+def clear(db, revision: str) -> None:
+    """Forget the checkpoints of ``revision``, e.g. once it was reverted."""
+    if db.has_table(TABLE):
+        db.delete_row(TABLE, f"revision = {db.placeholder}", (revision,))
+
+
+def run(db, revision: str, backfill: Backfill,
+        checkpoint: Optional[Tuple[Any, int]] = None) -> int:
+    """Run ``backfill`` chunk by chunk from ``checkpoint`` and return the rows processed.
+
+    ``db`` must not be inside a transaction: every chunk commits its own.
+    """
+    create_table(db)
+    ph = db.placeholder
+    if checkpoint is None:
+        db.insert_row(TABLE, revision=revision, name=backfill.name, processed=0, updated_at=now())
+        lastKey, processed = None, 0
+    else:
+        lastKey, processed = checkpoint
+        logger.info("Resuming backfill %s after %d row(s)", backfill.name, processed)
+    statement, names = bind(backfill.statement, ph)
+    select = f"SELECT {backfill.key} FROM {backfill.table}"
+    order = f"ORDER BY {backfill.key} LIMIT {int(backfill.batch_size)}"
+    update = (
+        f"UPDATE {db.qualify(TABLE)} SET last_key = {ph}, processed = {ph}, updated_at = {ph} "
+        f"WHERE revision = {ph} AND name = {ph}"
+    )
+    while True:
+        started = monotonic()
+        with db.transaction():
+            if lastKey is None:
+                keys = db.execute(f"{select} {order}", readRows=True)
+            else:
+                keys = db.execute(
+                    f"{select} WHERE {backfill.key} > {ph} {order}", readRows=True, params=(lastKey,)
+                )
+            if not keys:
+                break
+            bounds = {'first': keys[0][0], 'last': keys[-1][0]}
+            db.execute(statement, params=tuple(bounds[name] for name in names))
+            lastKey = keys[-1][0]
+            processed += len(keys)
+            db.execute(update, params=(
+                dumps(lastKey, default=str), processed, now(), revision, backfill.name,
+            ))
+        logger.debug("Backfill %s: %d row(s), up to %s", backfill.name, processed, lastKey)
+        if backfill.rate:
+            sleep(max(0.0, len(keys) / backfill.rate - (monotonic() - started)))
+    logger.info("Backfill %s done: %d row(s)", backfill.name, processed)
+    return processed
@@ -0,0 +1,43 @@
+"""Buffered writes to zmigrate's own tables.
+
+Rows recorded while applying or reverting revisions are queued and written
+by :meth:`Bookkeeping.flush` with one parameterized statement per table, so
+a batch of revisions costs one round trip instead of one per revision.
+"""
+
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Sequence, Tuple
+
+
+def now() -> str:
+    """Return the current UTC time as stored in ``applied_at`` columns."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class Bookkeeping:
+    def __init__(self, db) -> None:
+        self.db = db
+        self.deletes: Dict[Tuple[str, str], List[Any]] = {}
+        self.inserts: Dict[Tuple[str, Tuple[str, ...]], List[Sequence[Any]]] = {}
+
+    def insert_row(self, table_name: str, **values: Any) -> None:
+        self.inserts.setdefault((table_name, tuple(values)), []).append(tuple(values.values()))
+
+    def delete_row(self, table_name: str, column: str, value: Any) -> None:
+        self.deletes.setdefault((table_name, column), []).append(value)
+
+    def __len__(self) -> int:
+        return sum(map(len, self.deletes.values())) + sum(map(len, self.inserts.values()))
+
+    def flush(self) -> None:
+        """Write the queued rows, in one transaction unless one is already open."""
+        if not self.deletes and not self.inserts:
+            return
+        with nullcontext() if self.db.inTransaction else self.db.transaction():
+            for (table_name, column), values in self.deletes.items():
+                self.db.delete_rows(table_name, column, values)
+            for (table_name, columns), rows in self.inserts.items():
+                self.db.insert_rows(table_name, columns, rows)
+        self.deletes = {}
+        self.inserts = {}
@@ -0,0 +1,231 @@
+"""Single-file migration bundles.
+
+``zmigrate pack -o migrations.zmp`` packs the migration directory into one
+file that ``--migration-dir`` accepts in place of the directory. A bundle
+is laid out as::
+
+    b'ZMIGPACK' + version        (12 bytes)
+    script blobs, optionally zlib compressed
+    index                        (JSON)
+    index offset, index length, SHA-256 of the index, b'ZMIGPACK'
+
+The index maps every revision to its files, with their offset, size, mtime
+and checksum. :class:`Bundle` memory-maps the file and reads the blobs
+straight from the mapping (inflating them on the fly when compressed), so
+nothing is unpacked to disk and a file is only touched when it's read.
+"""
+
+from hashlib import sha256
+from json import dumps, loads
+from os import listdir, replace, stat
+from os.path import getsize, join
+from stat import S_ISDIR, S_ISREG
+from typing import Any, BinaryIO, Dict, List, Optional, TextIO, Tuple
+import io
+import logging
+import mmap
+import struct
+import zlib
+
+from zmigrate.checksum import CHUNK_SIZE, file_checksum
+from zmigrate.tree import Tree
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ZMIGPACK'
+VERSION = 1
+HEAD = struct.Struct('<8sI')
+TRAILER = struct.Struct('<QQ32s8s')
+# Bytes of compressed data inflated per read.
+READ_SIZE = 1 << 16
+
+
+class BlobReader(io.RawIOBase):
+    """Read one blob from a memoryview of the bundle, inflating it if ``compressed``."""
+
+    def __init__(self, view: memoryview, compressed: bool) -> None:
+        super().__init__()
+        self.view = view
+        self.pos = 0
+        self.inflate = zlib.decompressobj() if compressed else None
+        self.pending = b''
+        self.pendingPos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        # The bundle's mapping can't be closed while views of it exist.
+        self.view.release()
+        super().close()
+
+    def readinto(self, buffer) -> int:
+        if self.inflate is None:
+            n = min(len(buffer), len(self.view) - self.pos)
+            buffer[:n] = self.view[self.pos:self.pos + n]
+            self.pos += n
+            return n
+        while self.pendingPos >= len(self.pending):
+            if self.pos >= len(self.view):
+                self.pending = self.inflate.flush()
+                self.pendingPos = 0
+                if not self.pending:
+                    return 0
+                break
+            chunk = self.view[self.pos:self.pos + READ_SIZE]
+            self.pos += len(chunk)
+            self.pending = self.inflate.decompress(chunk)
+            self.pendingPos = 0
+        n = min(len(buffer), len(self.pending) - self.pendingPos)
+        buffer[:n] = self.pending[self.pendingPos:self.pendingPos + n]
+        self.pendingPos += n
+        return n
+
+
+class Bundle(Tree):
+    """A :class:`~zmigrate.tree.Tree` read from the bundle at ``path``."""
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        # mmap can't map an empty file.
+        if getsize(path) < HEAD.size + TRAILER.size:
+            raise Exception(f"{path} is not a migration bundle")
+        with open(path, 'rb') as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        try:
+            self.revisions: Dict[str, Dict[str, List[Any]]] = self.read_index()
+        except BaseException:
+            self.close()
+            raise
+
+    def read_index(self) -> Dict[str, Dict[str, List[Any]]]:
+        magic, version = HEAD.unpack_from(self.mm, 0)
+        offset, length, digest, end = TRAILER.unpack_from(self.mm, len(self.mm) - TRAILER.size)
+        if magic != MAGIC or end != MAGIC:
+            raise Exception(f"{self.root} is not a migration bundle")
+        if version != VERSION:
+            raise Exception(f"Unsupported version {version} of bundle {self.root}")
+        with self.view[offset:offset + length] as index:
+            if sha256(index).digest() != digest:
+                raise Exception(f"The index of bundle {self.root} is corrupt")
+            return loads(bytes(index))['revisions']
+
+    def close(self) -> None:
+        """Unmap the bundle; files opened from it must be closed first."""
+        self.view.release()
+        self.mm.close()
+
+    def names(self) -> List[str]:
+        return list(self.revisions)
+
+    def entry(self, dir, name: str) -> List[Any]:
+        """Return ``[offset, size, stored size, mtime_ns, checksum, compressed]``."""
+        return self.revisions[str(dir)][name]
+
+    def has(self, dir, name: str) -> bool:
+        return name in self.revisions.get(str(dir), ())
+
+    def files(self, dir, subdir: str) -> List[str]:
+        prefix = subdir + '/'
+        return sorted(
+            name[len(prefix):] for name in self.revisions.get(str(dir), ()) if name.startswith(prefix)
+        )
+
+    def stat(self, dir, name: str) -> Tuple[int, int]:
+        entry = self.entry(dir, name)
+        return entry[1], entry[3]
+
+    def open(self, dir, name: str, newline: Optional[str] = None) -> TextIO:
+        return io.TextIOWrapper(self.open_binary(dir, name), encoding="utf-8", newline=newline)
+
+    def open_binary(self, dir, name: str) -> BinaryIO:
+        offset, _, stored, _, _, compressed = self.entry(dir, name)
+        return io.BufferedReader(BlobReader(self.view[offset:offset + stored], bool(compressed)))
+
+    def checksum(self, dir, name: str) -> str:
+        return self.entry(dir, name)[4]
+
+    def verify(self) -> List[str]:
+        """Return the files whose content doesn't match their checksum."""
+        bad = []
+        for name, files in self.revisions.items():
+            for file in files:
+                try:
+                    with self.open_binary(name, file) as fh:
+                        ok = file_checksum(fh) == self.checksum(name, file)
+                except zlib.error:
+                    ok = False
+                if not ok:
+                    logger.error("%s is corrupt", self.path(name, file))
+                    bad.append('%s/%s' % (name, file))
+        logger.info("Verified %d revision(s) of bundle %s", len(self.revisions), self.root)
+        return bad
+
+
+def revision_files(root: str, name: str) -> List[str]:
+    """Return the files of revision ``name``, one level of subdirectories deep."""
+    base = join(root, name)
+    files = []
+    for item in sorted(listdir(base)):
+        st = stat(join(base, item))
+        if S_ISDIR(st.st_mode):
+            files.extend(
+                '%s/%s' % (item, sub) for sub in sorted(listdir(join(base, item)))
+                if S_ISREG(stat(join(base, item, sub)).st_mode)
+            )
+        elif S_ISREG(st.st_mode):
+            files.append(item)
+    return files
+
+
+def write_blob(src: BinaryIO, out: BinaryIO, compress: bool) -> Tuple[int, int, str, bool]:
+    """Copy ``src`` to ``out`` and return ``(size, stored size, checksum, compressed)``."""
+    digest = sha256()
+    deflate = zlib.compressobj() if compress else None
+    start = out.tell()
+    size = 0
+    for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+        size += len(chunk)
+        out.write(deflate.compress(chunk) if deflate else chunk)
+    if deflate:
+        out.write(deflate.flush())
+        if out.tell() - start >= size:
+            # Not worth it: store the file as is.
+            out.seek(start)
+            out.truncate()
+            src.seek(0)
+            return write_blob(src, out, False)
+    return size, out.tell() - start, digest.hexdigest(), deflate is not None
+
+
+def pack(root: str, path: str, compress: bool = False) -> Tuple[int, int]:
+    """Pack the migration directory ``root`` into the bundle ``path``.
+
+    Returns the number of files and the bundle size.
+    """
+    revisions: Dict[str, Dict[str, List[Any]]] = {}
+    count = 0
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as out:
+        out.write(HEAD.pack(MAGIC, VERSION))
+        for name in sorted(listdir(root)):
+            if not S_ISDIR(stat(join(root, name)).st_mode):
+                continue
+            files = revisions[name] = {}
+            for file in revision_files(root, name):
+                filePath = join(root, name, file)
+                offset = out.tell()
+                with open(filePath, 'rb') as src:
+                    size, stored, digest, compressed = write_blob(src, out, compress)
+                files[file] = [offset, size, stored, stat(filePath).st_mtime_ns, digest, int(compressed)]
+                count += 1
+        index = dumps({'revisions': revisions}, separators=(',', ':')).encode('utf-8')
+        offset = out.tell()
+        out.write(index)
+        out.write(TRAILER.pack(offset, len(index), sha256(index).digest(), MAGIC))
+        size = out.tell()
+    replace(tmpPath, path)
+    logger.info("Packed %d file(s) of %d revision(s) into %s (%d bytes)", count, len(revisions), path, size)
+    return count, size
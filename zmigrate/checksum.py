@@ -0,0 +1,67 @@
+"""Checksums of applied scripts and drift detection."""
+
+from hashlib import sha256
+from typing import BinaryIO, List, Tuple
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20
+# Scripts whose checksum is stored, with the ``migrations`` column holding it.
+COLUMNS = {'up.sql': 'up_checksum', 'seed.sql': 'seed_checksum'}
+
+
+def file_checksum(fh: BinaryIO) -> str:
+    """Return the hex SHA-256 of ``fh``, read in fixed-size chunks."""
+    digest = sha256()
+    for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashingReader(io.RawIOBase):
+    """Pass the binary stream ``fh`` through, hashing every byte read from it."""
+
+    def __init__(self, fh: BinaryIO) -> None:
+        super().__init__()
+        self.fh = fh
+        self.digest = sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = self.fh.readinto(buffer)
+        self.digest.update(memoryview(buffer)[:n])
+        return n
+
+    def hexdigest(self) -> str:
+        """Return the hex SHA-256 of ``fh``, reading whatever is left of it."""
+        for chunk in iter(lambda: self.fh.read(CHUNK_SIZE), b''):
+            self.digest.update(chunk)
+        return self.digest.hexdigest()
+
+
+def verify(db, tree) -> List[Tuple[str, str, str]]:
+    """Compare the checksums stored in ``migrations`` against ``tree``.
+
+    Returns ``(revision, script, problem)`` for every drifted script. Rows
+    recorded before checksums were stored are not checked.
+    """
+    names = set(tree.names())
+    rows = db.get_rows('migrations', ['revision'] + list(COLUMNS.values()))
+    drift = []
+    for row in rows:
+        revision = row[0]
+        for (script, _), stored in zip(COLUMNS.items(), row[1:]):
+            if stored is None:
+                continue
+            if revision not in names or not tree.has(revision, script):
+                drift.append((revision, script, 'missing'))
+            elif tree.checksum(revision, script) != stored:
+                drift.append((revision, script, 'modified'))
+    for revision, script, problem in drift:
+        logger.error("%s/%s has been %s since it was applied", revision, script, problem)
+    logger.info("Verified %d revision(s), %d drifted script(s)", len(rows), len(drift))
+    return drift
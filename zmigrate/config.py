@@ -1,9 +1,9 @@
 """Configuration loader for :mod:`zmigrate`."""
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from json import loads
 from os.path import isfile
-from typing import Any, Dict, Literal
+from typing import Any, Dict, List, Literal
 
 
 @dataclass
@@ -11,12 +11,50 @@ class Config:
     direction: Literal["up", "down"] = "up"
     seed: str = "no"
     skip_missing: str = "no"
+    fast_path: str = "no"
+    transaction: Literal["statement", "migration", "batch"] = "statement"
     migration_dir: str = "migration"
+    # Path of the JSON index caching the layout of ``migration_dir``.
+    manifest: str = ""
     driver: str = "pg"
     host: str = "localhost"
     user: str = "postgres"
     database: str = "postgres"
     password: str = ""
+    # Each target is a database name or a mapping overriding any of the
+    # connection settings above.
+    targets: List[Any] = field(default_factory=list)
+    jobs: int = 4
+    # Connections used to run independent revisions of one database at once,
+    # see zmigrate.schedule.
+    parallel: int = 1
+    # Postgres schema names or ``LIKE`` patterns (``*`` also works) to migrate
+    # as separate tenants of ``database``.
+    schemas: List[str] = field(default_factory=list)
+    tenant_batch: int = 1
+    # Clone fresh databases from a template migrated once per tree version.
+    template: str = "no"
+    template_dir: str = ".zmigrate-templates"
+    # Connections loading a revision's ``seed.d/`` scripts at once.
+    seed_jobs: int = 4
+    # Serialize concurrent runs against a database with an advisory lock
+    # (a lock file for SQLite).
+    lock: str = "yes"
+    # ``memory`` or ``wal``: journal of the SQLite fast mode, which also
+    # turns off fsync and locks the database file while migrating.
+    sqlite_fast: str = ""
+    # ``analyze`` or ``vacuum`` the database after applying revisions.
+    maintenance: str = "no"
+    # Write a JSON report of per-revision and per-statement timings here.
+    profile: str = ""
+    # Run Postgres statements with lock/statement timeouts and retry lock
+    # timeouts, see zmigrate.online.
+    online: str = "no"
+    lock_timeout: str = "5s"
+    statement_timeout: str = "0"
+    retries: int = 5
+    # Number of revisions listed by the ``stats`` command.
+    limit: int = 10
 
 
 def load(cfg_path: str = "config.json") -> Config:
@@ -1,29 +1,36 @@
 """Representation of a migration directory version."""
 
-from dataclasses import dataclass
+from collections import namedtuple
 from typing import Optional
 
 
-@dataclass
-class Dir:
-    """Semantic version representation used for migration directories."""
+class Dir(namedtuple('Dir', ('major', 'minor', 'patch'))):
+    """Semantic version representation used for migration directories.
 
-    major: int = 0
-    minor: int = 0
-    patch: int = 0
+    Versions are tuples, so they compare, sort and hash by
+    ``(major, minor, patch)`` whatever the size of each component.
+    """
 
-    def __init__(self, name: Optional[str] = None) -> None:
+    __slots__ = ()
+
+    def __new__(cls, name: Optional[str] = None) -> "Dir":
         if name is None:
-            return
+            return super().__new__(cls, 0, 0, 0)
         tokens = name.split(".")
         if len(tokens) != 3 or not all(t.isdigit() for t in tokens):
             raise Exception(f"Invalid directory name: {name}")
-        self.major, self.minor, self.patch = map(int, tokens)
+        return super().__new__(cls, *map(int, tokens))
+
+    def __getnewargs__(self):  # pragma: no cover - pickling
+        return (str(self),)
 
     def __str__(self) -> str:  # pragma: no cover - trivial
         return f"{self.major}.{self.minor}.{self.patch}"
 
     def toInt(self) -> int:
-        """Return an integer representation sortable by version."""
-        return (self.major << 24) | (self.minor << 16) | self.patch
+        """Return the legacy packed integer of the version.
 
+        It collides once ``minor`` exceeds 255 or ``patch`` exceeds 65535;
+        compare ``Dir`` objects directly instead.
+        """
+        return (self.major << 24) | (self.minor << 16) | self.patch
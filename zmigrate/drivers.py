@@ -1,26 +1,163 @@
 """Database driver implementations."""
 
-from typing import Any, Iterable, List, Optional
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from itertools import islice
+from time import monotonic
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+import csv
 import importlib
+import os
+import re
+import socket
 import subprocess
 import sys
 import logging
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from zmigrate import hooks, online, registry
+from zmigrate.script import iter_statements
+from zmigrate.utils import no_impl
 
 logger = logging.getLogger(__name__)
 
 
+# Never install missing dependencies at runtime when set (e.g. in images
+# that are built with their dependencies).
+PRODUCTION = os.getenv("ZMIGRATE_PRODUCTION", "").lower() in ("1", "yes", "true")
+
+_packages: dict = {}
+
+
 def ensure_package(module: str, package: Optional[str] = None):
-    """Import ``module`` installing ``package`` via pip if needed."""
+    """Import ``module`` installing ``package`` via pip if needed.
+
+    The result is cached, so the check only happens once per process.
+    """
+    if module in _packages:
+        return _packages[module]
     try:  # pragma: no cover - normal case
-        return importlib.import_module(module)
+        mod = importlib.import_module(module)
     except ModuleNotFoundError:
         pkg = package or module
+        if PRODUCTION:
+            raise Exception(f"Missing dependency {pkg} (not installed in production mode)")
         logger.info("Installing missing dependency %s", pkg)
         subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
-        return importlib.import_module(module)
+        mod = importlib.import_module(module)
+    _packages[module] = mod
+    return mod
+
+
+def identity() -> str:
+    """Describe this process to others waiting for the migration lock."""
+    return f"zmigrate {socket.gethostname()}:{os.getpid()}"
+
+
+# Size of the reads issued while streaming a file through ``COPY``.
+COPY_BUFFER_SIZE = 1 << 16
+# Number of rows handed to ``executemany`` at a time.
+BULK_CHUNK_SIZE = 10000
+
+_TEXT_ESCAPE = re.compile(r"\\(.)")
+_CSV_FIELD = re.compile(r'"((?:[^"]|"")*)"|([^,"\r\n]*)')
+_TEXT_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+
+
+def unescape_text(value: str) -> Optional[str]:
+    """Decode a field in Postgres ``COPY`` text format (``\\N`` is ``NULL``)."""
+    if value == '\\N':
+        return None
+    if '\\' not in value:
+        return value
+    return _TEXT_ESCAPE.sub(lambda m: _TEXT_ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def split_csv(record: str) -> List[Optional[str]]:
+    """Split one CSV record; like ``COPY``, only unquoted empty fields are ``NULL``."""
+    row: List[Optional[str]] = []
+    pos = 0
+    while True:
+        match = _CSV_FIELD.match(record, pos)
+        quoted, plain = match.group(1), match.group(2)
+        row.append(quoted.replace('""', '"') if quoted is not None else (plain or None))
+        pos = match.end()
+        if pos >= len(record):
+            return row
+        if record[pos] != ',':
+            raise Exception('Malformed CSV record: %s' % record[:80])
+        pos += 1
+
+
+def read_csv(fh: TextIO) -> Iterator[List[Optional[str]]]:
+    pending = ''
+    for line in fh:
+        pending += line
+        if pending.count('"') % 2:
+            # A quoted field continues on the next line.
+            continue
+        record = pending.rstrip('\r\n')
+        pending = ''
+        if record:
+            yield split_csv(record)
+    if pending:
+        raise Exception('Unterminated quoted CSV field: %s' % pending[:80])
+
+
+def read_rows(fh: TextIO, fmt: str) -> Iterator[List[Optional[str]]]:
+    """Yield the rows of ``fh`` in Postgres ``csv`` or ``text`` format, ``None`` for ``NULL``."""
+    if fmt == 'csv':
+        return read_csv(fh)
+    return (
+        [unescape_text(value) for value in row]
+        for row in csv.reader(fh, delimiter='\t', quoting=csv.QUOTE_NONE)
+    )
+
+
+@lru_cache(maxsize=256)
+def insert_sql(table_name: str, columns: Tuple[str, ...], placeholder: str) -> str:
+    return "INSERT INTO %s (%s) VALUES (%s)" % (
+        table_name, ", ".join(columns), ", ".join(placeholder for _ in columns)
+    )
+
+
+@lru_cache(maxsize=256)
+def select_sql(table_name: str, columns: Tuple[str, ...], keys: Tuple[str, ...],
+               limit: int, placeholder: str) -> str:
+    stmt = "SELECT " + ", ".join(columns) + f" FROM {table_name}"
+    if keys:
+        stmt += " WHERE " + " AND ".join(f"{k} = {placeholder}" for k in keys)
+    if limit > 0:
+        stmt += f" LIMIT {int(limit)}"
+    return stmt
 
 
 class Driver:
+    # Parameter marker of the driver's DB-API module.
+    placeholder = '?'
+    # ``True`` while an explicit transaction opened by :meth:`begin` is active.
+    # Statements executed meanwhile are not committed individually.
+    inTransaction = False
+    # ``True`` when the database was just created from ``args.template_database``.
+    cloned = False
+    # Current schema, see :meth:`set_schema`.
+    schema = ''
+    # Whether several connections can usefully write to the database at once.
+    concurrent = False
+    # :class:`zmigrate.online.Online` settings of the running revision; only
+    # honoured by :class:`Postgres`.
+    online: Optional['online.Online'] = None
+
+    @classmethod
+    def exists(cls, args: Any) -> bool:
+        """Return whether the database described by ``args`` exists already."""
+        raise no_impl('exists')
+
     def __enter__(self) -> "Driver":  # pragma: no cover - trivial
         return self
 
@@ -30,34 +167,244 @@ class Driver:
     def close(self) -> None:  # pragma: no cover - overridden
         pass
 
+    def begin(self) -> None:  # pragma: no cover - overridden
+        self.inTransaction = True
+
+    def commit(self) -> None:  # pragma: no cover - overridden
+        self.inTransaction = False
+
+    def rollback(self) -> None:  # pragma: no cover - overridden
+        self.inTransaction = False
+
+    @contextmanager
+    def transaction(self) -> Iterator["Driver"]:
+        """Run the enclosed statements in one transaction, rolling back on error."""
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    @contextmanager
+    def no_transaction(self) -> Iterator["Driver"]:
+        """Run the enclosed statements outside of any transaction block."""
+        yield self
+
+    @contextmanager
+    def migration_lock(self) -> Iterator[bool]:
+        """Hold the lock serializing migrations of the database (and schema).
+
+        Yields whether another process held it first, in which case it may
+        have done the work meanwhile.
+        """
+        yield False
+
+    def execute_batch(self, statements: List[str]) -> None:
+        """Execute a batch of complete statements produced by :mod:`zmigrate.script`."""
+        self.execute_script("\n".join(statements))
+
+    def execute_many(self, statement: str, rows: List[Sequence[Any]]) -> None:
+        """Execute the parameterized ``statement`` once for each of ``rows``."""
+        if not rows:
+            return
+        event = hooks.start('statement', statement) if hooks.enabled else None
+        cur = self.conn.cursor()
+        cur.executemany(statement, rows)
+        if not self.inTransaction:
+            self.conn.commit()
+        if event:
+            hooks.stop(event, rows=len(rows))
+        cur.close()
+
+    def qualify(self, table_name: str) -> str:
+        """Return ``table_name`` qualified with the schema selected by :meth:`set_schema`."""
+        return table_name
+
+    def insert_row(self, table_name: str, **values: Any) -> None:
+        """Insert one row; ``values`` are bound as parameters."""
+        self.execute(
+            insert_sql(self.qualify(table_name), tuple(values), self.placeholder),
+            params=tuple(values.values()),
+        )
+
+    def insert_rows(self, table_name: str, columns: Sequence[str], rows: List[Sequence[Any]]) -> None:
+        self.execute_many(insert_sql(self.qualify(table_name), tuple(columns), self.placeholder), rows)
+
+    def delete_row(self, table_name: str, constraints: str, params: Sequence[Any] = ()) -> None:
+        """Delete the rows matching ``constraints``, whose markers are bound to ``params``."""
+        table_name = self.qualify(table_name)
+        if constraints:
+            self.execute(f"DELETE FROM {table_name} WHERE {constraints}", params=tuple(params))
+        else:
+            self.execute(f"DELETE FROM {table_name}")
+
+    def delete_rows(self, table_name: str, column: str, values: List[Any]) -> None:
+        """Delete the rows whose ``column`` is one of ``values``."""
+        self.execute_many(
+            f"DELETE FROM {self.qualify(table_name)} WHERE {column} = {self.placeholder}",
+            [(value,) for value in values],
+        )
+
+    def get_rows(self, table_name: str, columns: Iterable[str], limit: int = 0, **constraints: Any):
+        stmt = select_sql(self.qualify(table_name), tuple(columns), tuple(constraints), limit, self.placeholder)
+        return self.execute(stmt, readRows=True, params=tuple(constraints.values()))
+
+    def bulk_load(self, table_name: str, columns: List[str], fh: TextIO, fmt: str) -> int:
+        """Stream rows from ``fh`` into ``table_name`` and return the row count.
+
+        ``fmt`` is ``csv`` or ``text`` (tab separated), see :mod:`zmigrate.seed`.
+        """
+        raise no_impl('bulk_load')
+
+    def has_table(self, table_name: str) -> bool:  # pragma: no cover - overridden
+        raise no_impl('has_table')
+
+    def get_columns(self, table_name: str) -> List[str]:  # pragma: no cover - overridden
+        raise no_impl('get_columns')
+
+    def dump(self, out: TextIO) -> None:
+        """Write SQL recreating the database's schema and data to ``out``."""
+        raise no_impl('dump')
+
+    def drop_database(self, database_name: str) -> None:
+        raise no_impl('drop_database')
+
+    def add_missing_columns(self, table_name: str, columns: list) -> None:
+        """Add the ``columns`` that ``table_name`` doesn't have yet.
+
+        Columns are added without their constraints, so they must be nullable.
+        """
+        existing = set(self.get_columns(table_name))
+        for x in columns:
+            if x.get('name') not in existing:
+                logger.info("Adding column %s to %s", x.get('name'), table_name)
+                self.execute(
+                    f"ALTER TABLE {self.qualify(table_name)} ADD COLUMN {x.get('name')} {x.get('type')}"
+                )
+
+    def maintain(self, vacuum: bool = False) -> None:
+        """Refresh the planner statistics, after rewriting the database when ``vacuum``."""
+        with self.no_transaction():
+            if vacuum:
+                logger.info("Vacuuming")
+                self.execute("VACUUM")
+            logger.info("Analyzing")
+            self.execute("ANALYZE")
+
+    def set_schema(self, schema: str, create: bool = False) -> None:
+        """Make ``schema`` the default schema of the connection."""
+        raise no_impl('set_schema')
+
+    def list_schemas(self, pattern: str) -> List[str]:
+        """Return the existing schemas matching the SQL ``LIKE`` ``pattern``."""
+        raise no_impl('list_schemas')
+
+
+def set_timeouts(scope: str, lockTimeout: str, statementTimeout: str) -> str:
+    """Return the SQL setting the timeouts; ``scope`` is ``''`` or ``' LOCAL'``."""
+    return "SET%s lock_timeout = '%s'; SET%s statement_timeout = '%s'" % (
+        scope, lockTimeout, scope, statementTimeout)
+
+
+# First key of zmigrate's advisory locks (``zmig``).
+LOCK_CLASS = 0x7a6d6967
+LOCK_HOLDERS = (
+    "SELECT a.pid, a.application_name, a.client_addr FROM pg_catalog.pg_locks l "
+    "JOIN pg_catalog.pg_stat_activity a ON a.pid = l.pid "
+    "WHERE l.locktype = 'advisory' AND l.granted AND l.objsubid = 2 "
+    "AND l.classid::bigint = %s AND l.objid::bigint = %s"
+)
+
 
 class Postgres(Driver):
+    placeholder = '%s'
+    concurrent = True
+    # Whether the connection autocommitted before :meth:`begin`.
+    autocommit = False
+    # The connection's ``lock_timeout`` and ``statement_timeout``, restored
+    # after each statement run by :meth:`execute_online`.
+    timeouts: Optional[Tuple[str, str]] = None
+
     def __init__(self, args: Any) -> None:
         psycopg2 = ensure_package("psycopg2", "psycopg2-binary")
+        self.extras = ensure_package("psycopg2.extras", "psycopg2-binary")
 
+        self.args = args
         self.conn = psycopg2.connect(host=args.host, user=args.user, password=args.password)
         self.conn.set_session(autocommit=True)
         rows = self.execute(
-            "SELECT 1 FROM pg_catalog.pg_database WHERE datname = '%s'" % args.database,
+            "SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s",
             readRows=True,
+            params=(args.database,),
         )
         if not rows:
-            self.create_database(args.database)
+            template = getattr(args, 'template_database', None)
+            self.create_database(args.database, template)
+            self.cloned = template is not None
         self.conn.close()
         self.conn = psycopg2.connect(
             host=args.host, user=args.user, password=args.password, database=args.database
         )
 
+    @classmethod
+    def exists(cls, args: Any) -> bool:
+        psycopg2 = ensure_package("psycopg2", "psycopg2-binary")
+        conn = psycopg2.connect(host=args.host, user=args.user, password=args.password)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM pg_catalog.pg_database WHERE datname = %s", (args.database,))
+                return cur.fetchone() is not None
+        finally:
+            conn.close()
+
     def close(self) -> None:  # pragma: no cover - cleanup
         self.conn.close()
 
-    def execute(self, statements: str, readRows: bool = False) -> List[Iterable[Any]]:
+    def begin(self) -> None:
+        # psycopg2 opens the transaction implicitly on the first statement,
+        # unless the connection autocommits (inside :meth:`no_transaction`).
+        self.autocommit = self.conn.autocommit
+        if self.autocommit:
+            self.conn.autocommit = False
+        self.inTransaction = True
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self.inTransaction = False
+        if self.autocommit:
+            self.conn.autocommit = True
+
+    def rollback(self) -> None:
+        self.conn.rollback()
+        self.inTransaction = False
+        if self.autocommit:
+            self.conn.autocommit = True
+
+    @contextmanager
+    def no_transaction(self) -> Iterator["Driver"]:
+        if self.inTransaction:
+            self.commit()
+        self.conn.autocommit = True
+        try:
+            yield self
+        finally:
+            self.conn.autocommit = False
+
+    def execute(self, statements: str, readRows: bool = False,
+                params: Optional[Sequence[Any]] = None) -> List[Iterable[Any]]:
         resp: List[Iterable[Any]] = []
         if not statements.strip():
             return resp
+        event = hooks.start('statement', statements) if hooks.enabled else None
         cur = self.conn.cursor()
-        cur.execute(statements)
-        self.conn.commit()
+        # Without parameters psycopg2 leaves ``%`` in the statements alone.
+        cur.execute(statements, params)
+        if not self.inTransaction:
+            self.conn.commit()
+        if event:
+            hooks.stop(event, rows=cur.rowcount if cur.rowcount >= 0 else None)
         while readRows:
             row = cur.fetchone()
             if row is None:
@@ -69,50 +416,356 @@ class Postgres(Driver):
     def execute_script(self, statements: str, readRows: bool = False) -> List[Iterable[Any]]:
         return self.execute(statements, readRows)
 
-    def create_database(self, database_name: str) -> None:
-        self.execute(f"CREATE DATABASE {database_name}")
+    def execute_batch(self, statements: List[str]) -> None:
+        if self.online is None and not self.conn.autocommit:
+            return super().execute_batch(statements)
+        # Several statements in one query would run in an implicit
+        # transaction block, where e.g. CREATE INDEX CONCURRENTLY fails.
+        for statement in statements:
+            if self.online is None:
+                self.execute(statement)
+            else:
+                self.execute_online(statement)
+
+    def execute_online(self, statement: str) -> None:
+        """Run ``statement`` with the online timeouts, retrying it on lock timeouts.
+
+        Inside a transaction the statement is wrapped in a savepoint, so a
+        lock timeout only rolls back the statement itself. The timeouts only
+        apply to ``statement``: the connection's own are restored after it.
+        """
+        settings = self.online
+        if self.timeouts is None:
+            rows = self.execute(
+                "SELECT current_setting('lock_timeout'), current_setting('statement_timeout')",
+                readRows=True,
+            )
+            self.timeouts = (rows[0][0], rows[0][1])
+        attempt = 0
+        while True:
+            savepoint = self.inTransaction
+            # SET LOCAL ends with the (possibly implicit) transaction.
+            scope = '' if self.conn.autocommit else ' LOCAL'
+            timeouts = set_timeouts(scope, settings.lock_timeout, settings.statement_timeout)
+            try:
+                if savepoint:
+                    self.execute("SAVEPOINT zmigrate_online")
+                if self.conn.autocommit:
+                    # Several statements in one query would run in an implicit
+                    # transaction block.
+                    self.execute(timeouts)
+                    try:
+                        self.execute(statement)
+                    finally:
+                        self.execute(set_timeouts(scope, *self.timeouts))
+                else:
+                    self.execute(f"{timeouts};\n{statement}")
+                if savepoint:
+                    self.execute(set_timeouts(scope, *self.timeouts))
+                    self.execute("RELEASE SAVEPOINT zmigrate_online")
+                return
+            except Exception as exc:
+                if getattr(exc, 'pgcode', None) != online.LOCK_NOT_AVAILABLE or attempt >= settings.retries:
+                    raise
+                if savepoint:
+                    # Also undoes the SET LOCAL.
+                    self.execute("ROLLBACK TO SAVEPOINT zmigrate_online")
+                elif not self.conn.autocommit:
+                    self.conn.rollback()
+                attempt += 1
+                online.pause(settings, attempt, statement)
+
+    def bulk_load(self, table_name: str, columns: List[str], fh: TextIO, fmt: str) -> int:
+        cur = self.conn.cursor()
+        cur.copy_expert(
+            f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT {fmt})",
+            fh,
+            size=COPY_BUFFER_SIZE,
+        )
+        count = cur.rowcount
+        if not self.inTransaction:
+            self.conn.commit()
+        cur.close()
+        return count
+
+    def create_database(self, database_name: str, template: Optional[str] = None) -> None:
+        if template:
+            logger.info("Creating %s from template %s", database_name, template)
+            self.execute(f"CREATE DATABASE {database_name} TEMPLATE {template}")
+        else:
+            self.execute(f"CREATE DATABASE {database_name}")
+
+    def drop_database(self, database_name: str) -> None:
+        with self.no_transaction():
+            self.execute(f"DROP DATABASE IF EXISTS {database_name}")
+
+    def dump(self, out: TextIO) -> None:
+        env = dict(os.environ, PGPASSWORD=self.args.password or '')
+        proc = subprocess.Popen(
+            [
+                "pg_dump",
+                "--no-owner",
+                "--no-privileges",
+                "--inserts",
+                "--host", self.args.host,
+                "--username", self.args.user,
+                "--dbname", self.args.database,
+            ],
+            stdout=subprocess.PIPE,
+            env=env,
+            text=True,
+        )
+        for line in proc.stdout:
+            # Drop psql meta-commands and the search_path reset, which would
+            # break the unqualified bookkeeping statements that follow.
+            if line.startswith(('\\', "SELECT pg_catalog.set_config('search_path'")):
+                continue
+            out.write(line)
+        if proc.wait():
+            raise Exception(f"pg_dump failed with exit code {proc.returncode}")
+
+    def execute_many(self, statement: str, rows: List[Sequence[Any]]) -> None:
+        # ``executemany`` costs a round trip per row; ``execute_batch`` sends
+        # them in pages.
+        if not rows:
+            return
+        event = hooks.start('statement', statement) if hooks.enabled else None
+        cur = self.conn.cursor()
+        self.extras.execute_batch(cur, statement, rows, page_size=BULK_CHUNK_SIZE)
+        if not self.inTransaction:
+            self.conn.commit()
+        if event:
+            hooks.stop(event, rows=len(rows))
+        cur.close()
+
+    def insert_rows(self, table_name: str, columns: Sequence[str], rows: List[Sequence[Any]]) -> None:
+        if not rows:
+            return
+        stmt = "INSERT INTO %s (%s) VALUES %%s" % (self.qualify(table_name), ", ".join(columns))
+        event = hooks.start('statement', stmt) if hooks.enabled else None
+        cur = self.conn.cursor()
+        self.extras.execute_values(cur, stmt, rows, page_size=BULK_CHUNK_SIZE)
+        if not self.inTransaction:
+            self.conn.commit()
+        if event:
+            hooks.stop(event, rows=len(rows))
+        cur.close()
+
+    def delete_rows(self, table_name: str, column: str, values: List[Any]) -> None:
+        if values:
+            self.execute(
+                f"DELETE FROM {self.qualify(table_name)} WHERE {column} = ANY(%s)",
+                params=(list(values),),
+            )
+
+    def qualify(self, table_name: str) -> str:
+        # With ``public`` on the search_path, an unqualified name would
+        # resolve to public's table while the tenant has none yet.
+        if not self.schema:
+            return table_name
+        return '"%s".%s' % (self.schema.replace('"', '""'), table_name)
+
+    def has_table(self, table_name: str) -> bool:
+        rows = self.execute("SELECT to_regclass(%s)", readRows=True, params=(self.qualify(table_name),))
+        return rows[0][0] is not None
+
+    def get_columns(self, table_name: str) -> List[str]:
+        rows = self.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = COALESCE(NULLIF(%s, ''), current_schema()) AND table_name = %s",
+            readRows=True,
+            params=(self.schema, table_name),
+        )
+        return [row[0] for row in rows]
+
+    def set_schema(self, schema: str, create: bool = False) -> None:
+        quoted = '"%s"' % schema.replace('"', '""')
+        if create:
+            self.execute(f"CREATE SCHEMA IF NOT EXISTS {quoted}")
+        self.execute(f"SET search_path TO {quoted}, public")
+        self.schema = schema
+
+    @contextmanager
+    def migration_lock(self) -> Iterator[bool]:
+        # Advisory locks are scoped to the database; the second key tells
+        # schemas apart. Inside a transaction (batched tenants) the lock must
+        # last until the commit.
+        key = zlib.crc32(self.schema.encode('utf-8'))
+        params = (LOCK_CLASS, key - (1 << 32) if key >= 1 << 31 else key)
+        xact = '_xact' if self.inTransaction else ''
+        self.execute("SELECT set_config('application_name', %s, false)", params=(identity(),))
+        rows = self.execute(f"SELECT pg_try_advisory{xact}_lock(%s, %s)", readRows=True, params=params)
+        waited = not rows[0][0]
+        if waited:
+            holders = self.execute(LOCK_HOLDERS, readRows=True, params=(LOCK_CLASS, key))
+            logger.info(
+                "Waiting for the migration lock held by %s",
+                ", ".join("%s (pid %s, %s)" % (row[1] or '?', row[0], row[2] or 'local') for row in holders)
+                or "another session",
+            )
+            started = monotonic()
+            self.execute(f"SELECT pg_advisory{xact}_lock(%s, %s)", params=params)
+            logger.info("Got the migration lock after %.1fs", monotonic() - started)
+        try:
+            yield waited
+        finally:
+            if not xact:
+                if not self.inTransaction:
+                    # Clears a transaction aborted by a failed statement.
+                    self.conn.rollback()
+                self.execute("SELECT pg_advisory_unlock(%s, %s)", params=params)
+
+    def list_schemas(self, pattern: str) -> List[str]:
+        rows = self.execute(
+            "SELECT nspname FROM pg_catalog.pg_namespace WHERE nspname LIKE %s ORDER BY nspname",
+            readRows=True,
+            params=(pattern,),
+        )
+        return [row[0] for row in rows]
 
     def create_table(self, table_name: str, columns: list) -> None:
         cols = ", ".join(
             [f"{x.get('name')} {x.get('type')} {x.get('constraints', '')}" for x in columns]
         )
-        self.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({cols})")
+        self.execute(f"CREATE TABLE IF NOT EXISTS {self.qualify(table_name)} ({cols})")
 
-    def insert_row(self, table_name: str, **args: str) -> None:
-        columns = ", ".join(args)
-        values = ", ".join(args[x] for x in args)
-        self.execute(f"INSERT INTO {table_name} ({columns}) VALUES ({values})")
+# Settings of :meth:`SQLite3.set_fast`: no fsync, a 256 MiB page cache and
+# temporary tables in memory. The exclusive lock keeps other connections
+# out, and saves taking and releasing the file lock for every transaction.
+FAST_PRAGMAS = {
+    'synchronous': 'OFF',
+    'cache_size': -262144,
+    'temp_store': 'MEMORY',
+    'locking_mode': 'EXCLUSIVE',
+}
 
-    def delete_row(self, table_name: str, constraints: str) -> None:
-        if constraints:
-            self.execute(f"DELETE FROM {table_name} WHERE {constraints}")
-        else:
-            self.execute(f"DELETE FROM {table_name}")
-
-    def get_rows(self, table_name: str, columns: Iterable[str], limit: int = 0, **constraints: str):
-        stmt = "SELECT " + ", ".join(columns) + f" FROM {table_name}"
-        if constraints:
-            stmt += " WHERE " + " AND ".join([f"{k} = {v}" for k, v in constraints.items()])
-        if limit > 0:
-            stmt += f" LIMIT {limit}"
-        return self.execute(stmt, readRows=True)
 
 class SQLite3(Driver):
     def __init__(self, args: Any) -> None:
         sqlite3 = ensure_package("sqlite3", "pysqlite3-binary")
 
-        self.conn = sqlite3.connect(args.database)
+        self.database = args.database
+        fresh = args.database == ':memory:' or not os.path.isfile(args.database) \
+            or os.path.getsize(args.database) == 0
+        # Parallel runs open connections in worker threads and close them
+        # from the main one; a connection is never used by two threads at once.
+        self.conn = sqlite3.connect(args.database, check_same_thread=False)
+        template = getattr(args, 'template_database', None)
+        if template and fresh:
+            logger.info("Restoring %s from template %s", args.database, template)
+            src = sqlite3.connect(template)
+            try:
+                src.backup(self.conn)
+            finally:
+                src.close()
+            self.cloned = True
+        self.pragmas: Dict[str, Any] = {}
+        fast = getattr(args, 'sqlite_fast', '')
+        if fast:
+            self.set_fast(fast)
+
+    @classmethod
+    def exists(cls, args: Any) -> bool:
+        # An empty file is restored from the template like a missing one.
+        return args.database != ':memory:' and os.path.isfile(args.database) \
+            and os.path.getsize(args.database) > 0
+
+    def set_fast(self, journal: str = 'memory') -> None:
+        """Trade durability for speed until :meth:`close`, see :data:`FAST_PRAGMAS`.
+
+        A crash meanwhile can corrupt the database, so this is meant for
+        files that can be recreated, e.g. freshly seeded tenants.
+        """
+        if journal not in ('memory', 'wal'):
+            raise Exception(f"Invalid SQLite fast mode journal: {journal}")
+        pragmas = dict(FAST_PRAGMAS, journal_mode=journal)
+        for name, value in pragmas.items():
+            self.pragmas[name] = self.conn.execute(f"PRAGMA {name}").fetchone()[0]
+            self.conn.execute(f"PRAGMA {name} = {value}")
+        logger.debug("SQLite fast mode on, replacing %s", self.pragmas)
 
     def close(self) -> None:  # pragma: no cover - cleanup
+        if self.pragmas:
+            self.conn.commit()
+            # The exclusive lock is only released by the next access.
+            for name, value in reversed(list(self.pragmas.items())):
+                self.conn.execute(f"PRAGMA {name} = {value}")
+            self.conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            self.pragmas = {}
         self.conn.close()
 
-    def execute(self, statements: str, readRows: bool = False):
+    def begin(self) -> None:
+        # The sqlite3 module only opens transactions implicitly before DML, so
+        # DDL would otherwise be autocommitted.
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+        self.inTransaction = True
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self.inTransaction = False
+
+    def rollback(self) -> None:
+        self.conn.rollback()
+        self.inTransaction = False
+
+    @contextmanager
+    def no_transaction(self) -> Iterator["Driver"]:
+        if self.inTransaction:
+            self.commit()
+        yield self
+
+    @contextmanager
+    def migration_lock(self) -> Iterator[bool]:
+        # A lock file next to the database, holding the identity of its
+        # owner. In-memory databases can't be shared anyway.
+        if self.database == ':memory:' or fcntl is None:
+            yield False
+            return
+        path = self.database + '.lock'
+        waited = False
+        started = monotonic()
+        while True:
+            fh = open(path, 'a+', encoding='utf-8')
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                fh.seek(0)
+                logger.info("Waiting for the migration lock held by %s", fh.read().strip() or "?")
+                waited = True
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            # The owner removes the file when done; a lock taken on a removed
+            # file doesn't count.
+            try:
+                if os.fstat(fh.fileno()).st_ino == os.stat(path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            fh.close()
+        if waited:
+            logger.info("Got the migration lock after %.1fs", monotonic() - started)
+        try:
+            fh.seek(0)
+            fh.truncate()
+            fh.write(identity())
+            fh.flush()
+            yield waited
+        finally:
+            os.remove(path)
+            fh.close()
+
+    def execute(self, statements: str, readRows: bool = False,
+                params: Optional[Sequence[Any]] = None):
         resp = []
         if not statements.strip():
             return resp
+        event = hooks.start('statement', statements) if hooks.enabled else None
         cur = self.conn.cursor()
-        cur.execute(statements)
-        self.conn.commit()
+        cur.execute(statements, params or ())
+        if not self.inTransaction:
+            self.conn.commit()
+        if event:
+            hooks.stop(event, rows=cur.rowcount if cur.rowcount >= 0 else None)
         while readRows:
             row = cur.fetchone()
             if row is None:
@@ -125,9 +778,18 @@ class SQLite3(Driver):
         resp = []
         if not statements.strip():
             return resp
+        if self.inTransaction:
+            # ``executescript`` always commits first, so run statement by
+            # statement to keep them inside the open transaction.
+            for statement in iter_statements(statements.splitlines(True)):
+                resp = self.execute(statement, readRows)
+            return resp
+        event = hooks.start('statement', statements) if hooks.enabled else None
         cur = self.conn.cursor()
         cur.executescript(statements)
         self.conn.commit()
+        if event:
+            hooks.stop(event)
         while readRows:
             row = cur.fetchone()
             if row is None:
@@ -136,33 +798,66 @@ class SQLite3(Driver):
         cur.close()
         return resp
 
+    def execute_batch(self, statements: List[str]) -> None:
+        if not self.inTransaction:
+            self.execute_script("\n".join(statements))
+            return
+        cur = self.conn.cursor()
+        for statement in statements:
+            event = hooks.start('statement', statement) if hooks.enabled else None
+            cur.execute(statement)
+            if event:
+                hooks.stop(event, rows=cur.rowcount if cur.rowcount >= 0 else None)
+        cur.close()
+
+    def bulk_load(self, table_name: str, columns: List[str], fh: TextIO, fmt: str) -> int:
+        rows = read_rows(fh, fmt)
+        stmt = "INSERT INTO %s (%s) VALUES (%s)" % (
+            table_name, ", ".join(columns), ", ".join("?" for _ in columns)
+        )
+        count = 0
+        with nullcontext() if self.inTransaction else self.transaction():
+            cur = self.conn.cursor()
+            while True:
+                chunk = list(islice(rows, BULK_CHUNK_SIZE))
+                if not chunk:
+                    break
+                event = hooks.start('statement', stmt) if hooks.enabled else None
+                cur.executemany(stmt, chunk)
+                if event:
+                    hooks.stop(event, rows=len(chunk))
+                count += len(chunk)
+            cur.close()
+        return count
+
     def create_database(self, database_name: str) -> None:
         self.execute(f"CREATE DATABASE {database_name}")
 
+    def has_table(self, table_name: str) -> bool:
+        rows = self.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            readRows=True,
+            params=(table_name,),
+        )
+        return bool(rows)
+
+    def get_columns(self, table_name: str) -> List[str]:
+        rows = self.execute(f"PRAGMA table_info({table_name})", readRows=True)
+        return [row[1] for row in rows]
+
+    def dump(self, out: TextIO) -> None:
+        for statement in self.conn.iterdump():
+            # The dump is replayed inside zmigrate's own transaction handling.
+            if statement in ('BEGIN TRANSACTION;', 'COMMIT;'):
+                continue
+            out.write(statement + "\n")
+
     def create_table(self, table_name: str, columns: list) -> None:
         cols = ", ".join(
             [f"{x.get('name')} {x.get('type')} {x.get('constraints', '')}" for x in columns]
         )
         self.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({cols})")
 
-    def insert_row(self, table_name: str, **args: str) -> None:
-        columns = ", ".join(args)
-        values = ", ".join(args[x] for x in args)
-        self.execute(f"INSERT INTO {table_name} ({columns}) VALUES ({values})")
-
-    def delete_row(self, table_name: str, constraints: str) -> None:
-        if constraints:
-            self.execute(f"DELETE FROM {table_name} WHERE {constraints}")
-        else:
-            self.execute(f"DELETE FROM {table_name}")
-
-    def get_rows(self, table_name: str, columns: Iterable[str], limit: int = 0, **constraints: str):
-        stmt = "SELECT " + ", ".join(columns) + f" FROM {table_name}"
-        if constraints:
-            stmt += " WHERE " + " AND ".join([f"{k} = {v}" for k, v in constraints.items()])
-        if limit > 0:
-            stmt += f" LIMIT {limit}"
-        return self.execute(stmt, readRows=True)
-
 
-SUPPORTED_DRIVERS = {x.__name__.lower(): x for x in Driver.__subclasses__()}
+# Kept for backward compatibility; drivers are registered in zmigrate.registry.
+SUPPORTED_DRIVERS = registry.SUPPORTED_DRIVERS
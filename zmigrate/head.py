@@ -0,0 +1,75 @@
+"""Head marker used to skip runs when the database is already up to date."""
+
+from hashlib import sha1
+from typing import Iterable, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'migrations_head'
+
+
+def fingerprint(names: Iterable[str]) -> str:
+    """Return a cheap fingerprint of a migration tree from its revision names.
+
+    Only the directory names are hashed. Revisions that are already applied
+    are never re-run, so the set of names is all that decides whether an
+    ``up`` run has anything left to do.
+    """
+    digest = sha1()
+    for name in sorted(names):
+        digest.update(name.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def create_table(db) -> None:
+    columns = [
+        {
+            'name': 'revision',
+            'type': 'TEXT',
+            'constraints': 'NOT NULL',
+        },
+        {
+            'name': 'fingerprint',
+            'type': 'TEXT',
+            'constraints': 'NOT NULL',
+        },
+    ]
+    db.create_table(TABLE, columns)
+
+
+def read(db) -> Optional[Tuple[str, str]]:
+    """Return the stored ``(revision, fingerprint)`` marker, if any.
+
+    A missing marker table is treated as a missing marker so the check can run
+    before anything has been created. The table is looked up first rather than
+    failing the read: that would abort a transaction the caller may own.
+    """
+    if not db.has_table(TABLE):
+        return None
+    rows = db.get_rows(TABLE, ['revision', 'fingerprint'], 1)
+    if not rows:
+        return None
+    return rows[0][0], rows[0][1]
+
+
+def matches(db, names: Iterable[str]) -> bool:
+    """Return whether the database head marker matches the tree ``names``."""
+    marker = read(db)
+    if marker is None:
+        return False
+    return marker[1] == fingerprint(names)
+
+
+def write(db, revision: str, treeFingerprint: str) -> None:
+    logger.debug("Recording head %s (%s)", revision, treeFingerprint)
+    create_table(db)
+    db.delete_row(TABLE, '')
+    db.insert_row(TABLE, revision=revision, fingerprint=treeFingerprint)
+
+
+def clear(db) -> None:
+    """Drop the stored marker. A missing marker table is not an error."""
+    if db.has_table(TABLE):
+        db.delete_row(TABLE, '')
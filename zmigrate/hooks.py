@@ -0,0 +1,138 @@
+"""Instrumentation hooks for migration runs.
+
+Callables registered with :func:`register` receive an :class:`Event` when a
+migration, script, bulk load or statement starts and another when it stops.
+Stop events carry the elapsed time and, where known, the number of rows
+affected and bytes read. Nothing is timed or allocated while no hook is
+registered: call sites only check the module-level ``enabled`` flag.
+"""
+
+from dataclasses import dataclass, replace
+from heapq import heappush, heappushpop
+from json import dump
+from threading import get_ident
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+enabled = False
+_hooks: List[Callable[["Event"], None]] = []
+
+
+@dataclass
+class Event:
+    kind: str  # 'migration', 'script', 'load' or 'statement'
+    name: str
+    phase: str = 'start'
+    started: float = 0.0
+    elapsed: Optional[float] = None
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+
+
+def register(hook: Callable[[Event], None]) -> None:
+    global enabled
+    _hooks.append(hook)
+    enabled = True
+
+
+def unregister(hook: Callable[[Event], None]) -> None:
+    global enabled
+    _hooks.remove(hook)
+    enabled = bool(_hooks)
+
+
+def _emit(event: Event) -> None:
+    for hook in _hooks:
+        hook(event)
+
+
+def start(kind: str, name: str, **info: Any) -> Optional[Event]:
+    """Emit and return a start event, or return ``None`` when disabled."""
+    if not enabled:
+        return None
+    event = Event(kind, name, 'start', perf_counter(), **info)
+    _emit(event)
+    return event
+
+
+def stop(event: Optional[Event], **info: Any) -> None:
+    """Emit the stop event matching ``event`` returned by :func:`start`."""
+    if event is None:
+        return
+    _emit(replace(event, phase='stop', elapsed=perf_counter() - event.started, **info))
+
+
+class Profiler:
+    """Hook collecting timings into a JSON report.
+
+    Only the ``keep`` slowest statements are retained so that memory stays
+    bounded however many statements run. Statements zmigrate runs outside of
+    any revision (its own bookkeeping) only count towards the totals.
+    """
+
+    def __init__(self, keep: int = 20) -> None:
+        self.keep = keep
+        self.started = perf_counter()
+        self.totals: Dict[str, List[float]] = {}
+        self.migrations: List[Dict[str, Any]] = []
+        self.scripts: List[Dict[str, Any]] = []
+        self.slowest: List[Tuple[float, int, Dict[str, Any]]] = []
+        self.current: Dict[int, str] = {}
+        self.count = 0
+
+    def __call__(self, event: Event) -> None:
+        if event.kind == 'migration':
+            if event.phase == 'start':
+                self.current[get_ident()] = event.name
+            else:
+                self.current.pop(get_ident(), None)
+        if event.phase != 'stop':
+            return
+        total = self.totals.setdefault(event.kind, [0, 0.0])
+        total[0] += 1
+        total[1] += event.elapsed
+        record = {
+            'name': event.name,
+            'revision': event.name if event.kind == 'migration' else self.current.get(get_ident()),
+            'elapsed': round(event.elapsed, 6),
+        }
+        if event.rows is not None:
+            record['rows'] = event.rows
+        if event.bytes is not None:
+            record['bytes'] = event.bytes
+        if event.kind == 'migration':
+            self.migrations.append(record)
+        elif event.kind in ('script', 'load'):
+            self.scripts.append(record)
+        elif record['revision'] is not None:
+            record['name'] = event.name[:500]
+            self.count += 1
+            entry = (event.elapsed, self.count, record)
+            if len(self.slowest) < self.keep:
+                heappush(self.slowest, entry)
+            else:
+                heappushpop(self.slowest, entry)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'elapsed': round(perf_counter() - self.started, 6),
+            'totals': {
+                kind: {'count': count, 'elapsed': round(elapsed, 6)}
+                for kind, (count, elapsed) in self.totals.items()
+            },
+            'migrations': self.migrations,
+            'scripts': self.scripts,
+            'slowest_statements': [record for _, _, record in sorted(self.slowest, reverse=True)],
+        }
+
+    def write(self, path: str) -> None:
+        report = self.report()
+        with open(path, "w", encoding="utf-8") as fh:
+            dump(report, fh, indent=1)
+        for record in report['slowest_statements'][:5]:
+            logger.info("Slow statement (%.3fs) in %s: %s",
+                        record['elapsed'], record['revision'], record['name'][:80])
+        logger.info("Profile written to %s", path)
@@ -0,0 +1,58 @@
+"""Sorted index of the revisions of a migration tree."""
+
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from typing import Iterable, Iterator, List, Optional
+
+from zmigrate.dir import Dir
+
+
+class Index(Sequence):
+    """Revisions sorted by version, iterated in ascending or descending order.
+
+    Ranges are sliced with bisect, so selecting a narrow range costs
+    ``O(log n)`` plus the size of the result.
+    """
+
+    __slots__ = ('dirs', 'reverse')
+
+    def __init__(self, dirs: Iterable[Dir], reverse: bool = False) -> None:
+        self.dirs: List[Dir] = sorted(dirs)
+        self.reverse = reverse
+
+    def __len__(self) -> int:
+        return len(self.dirs)
+
+    def __getitem__(self, i):
+        if not self.reverse:
+            return self.dirs[i]
+        n = len(self.dirs)
+        if isinstance(i, slice):
+            return [self.dirs[n - 1 - j] for j in range(*i.indices(n))]
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('Index index out of range')
+        return self.dirs[n - 1 - i]
+
+    def __iter__(self) -> Iterator[Dir]:
+        return reversed(self.dirs) if self.reverse else iter(self.dirs)
+
+    def __contains__(self, dir: object) -> bool:
+        i = bisect_left(self.dirs, dir)
+        return i < len(self.dirs) and self.dirs[i] == dir
+
+    def between(self, low: Optional[Dir] = None, high: Optional[Dir] = None) -> List[Dir]:
+        """Return the ascending revisions from ``low`` to ``high``, both included."""
+        start = bisect_left(self.dirs, low) if low else 0
+        end = bisect_right(self.dirs, high) if high else len(self.dirs)
+        return self.dirs[start:end]
+
+    def select(self, args) -> List[Dir]:
+        """Return the revisions inside ``args.range`` in the order ``args.direction`` runs them."""
+        first, last = args.range.first, args.range.last
+        if args.direction == 'up':
+            return self.between(first, last)
+        selected = self.between(last, first)
+        selected.reverse()
+        return selected
@@ -0,0 +1,39 @@
+"""Per-revision settings loaded from a migration directory's ``meta.json``."""
+
+from dataclasses import dataclass, field
+from json import loads
+from os.path import isfile
+from typing import Any, Dict, List, Optional, TextIO, Union
+
+
+@dataclass
+class Meta:
+    # Set to ``false`` for scripts that cannot run inside a transaction
+    # (e.g. ``CREATE INDEX CONCURRENTLY`` or ``VACUUM``).
+    transaction: bool = True
+    # Revisions squashed into this baseline, see :mod:`zmigrate.squash`.
+    replaces: List[str] = field(default_factory=list)
+    # Earlier revisions this one needs; ``None`` waits for all of them.
+    depends: Optional[List[str]] = None
+    # ``true`` or a mapping of :class:`zmigrate.online.Online` settings runs
+    # this revision in online mode, ``false`` opts it out of ``--online``.
+    online: Optional[Union[bool, Dict[str, Any]]] = None
+    # ``seed.d/`` scripts that must run in this order, sequentially.
+    seed_order: Optional[List[str]] = None
+
+
+def load(meta_path: str) -> Meta:
+    """Load revision settings from ``meta_path`` if it exists."""
+
+    data: Dict[str, Any] = {}
+    if isfile(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as fh:
+            data = loads(fh.read())
+
+    return Meta(**data)
+
+
+def read(fh: TextIO) -> Meta:
+    """Load revision settings from the open ``meta.json`` file ``fh``."""
+
+    return Meta(**loads(fh.read()))
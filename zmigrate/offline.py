@@ -0,0 +1,194 @@
+"""Compile a migration plan into a single SQL script instead of running it.
+
+The script holds every pending revision's statements followed by its
+bookkeeping in ``migrations``, wrapped in the same transactions a live run
+would use. It can be piped into ``psql`` or the ``sqlite3`` shell::
+
+    zmigrate compile --driver postgres --applied applied.txt | psql -1 mydb
+
+Seed data files are inlined: as ``COPY ... FROM stdin`` blocks for
+``psql``, and as multi-row ``INSERT`` statements for SQLite. Nothing is
+timed, so ``migrations_stats`` isn't updated.
+"""
+
+from csv import reader
+from itertools import islice
+from typing import Callable, List, Optional, Set, TextIO
+import logging
+
+from zmigrate import backfill, checksum, head, seed
+from zmigrate.drivers import read_rows
+from zmigrate.script import iter_statements
+from zmigrate.squash import check_baseline
+
+logger = logging.getLogger(__name__)
+
+# Rows per ``INSERT`` generated from SQLite seed files (SQLite's default
+# limit on the terms of a compound ``VALUES``).
+INSERT_ROWS = 500
+
+
+def read_applied(path: str) -> Set[str]:
+    """Read the applied revisions of a target, one per line."""
+    with open(path, "r", encoding="utf-8") as fh:
+        return {line.strip() for line in fh if line.strip()}
+
+
+def literal(value: Optional[str]) -> str:
+    if value is None:
+        return 'NULL'
+    return "'%s'" % value.replace("'", "''")
+
+
+def write_script(tree, dir, script: str, out: TextIO) -> None:
+    out.write("-- %s\n" % tree.path(dir, script))
+    with tree.open(dir, script) as fh:
+        for statement in iter_statements(fh):
+            out.write(statement)
+            out.write("\n" if statement.endswith(";") else "\n;\n")
+
+
+def write_seed(args, tree, dir, table: str, name: str, fmt: str, out: TextIO) -> None:
+    out.write("-- %s\n" % tree.path(dir, name))
+    with tree.open(dir, name, newline="") as fh:
+        header = fh.readline()
+        columns = next(reader([header], delimiter=seed.DELIMITERS[fmt]), [])
+        if not columns:
+            raise Exception('Missing header in %s' % tree.path(dir, name))
+        if args.driver != 'sqlite3':
+            out.write("COPY %s (%s) FROM stdin WITH (FORMAT %s);\n" % (table, ", ".join(columns), fmt))
+            last = "\n"
+            for line in fh:
+                out.write(line)
+                last = line
+            if not last.endswith("\n"):
+                out.write("\n")
+            out.write("\\.\n")
+            return
+        rows = read_rows(fh, fmt)
+        while True:
+            chunk = list(islice(rows, INSERT_ROWS))
+            if not chunk:
+                break
+            out.write("INSERT INTO %s (%s) VALUES\n" % (table, ", ".join(columns)))
+            out.write(",\n".join(
+                "(%s)" % ", ".join(literal(value) for value in row) for row in chunk
+            ))
+            out.write(";\n")
+
+
+def write_upgrade(args, tree, dir, meta, out: TextIO) -> None:
+    scripts = ['up.sql']
+    if args.seed:
+        scripts.append('seed.sql')
+    if tree.has(dir, backfill.FILE):
+        raise Exception("%s has a backfill, which can only run against a live database" % (dir,))
+    out.write("\n-- Migrating %s\n" % (dir,))
+    values = {'revision': literal(str(dir))}
+    size = 0
+    for script in scripts:
+        if not tree.has(dir, script):
+            if args.skip_missing or (script == 'seed.sql' and (
+                    tree.files(dir, 'seed') or tree.files(dir, seed.SPLIT_DIR))):
+                continue
+            raise Exception('Missing %s' % tree.path(dir, script))
+        values[checksum.COLUMNS[script]] = literal(tree.checksum(dir, script))
+        size += tree.stat(dir, script)[0]
+        write_script(tree, dir, script, out)
+    if args.seed:
+        for table, name, fmt in seed.seed_files(tree, dir):
+            size += tree.stat(dir, name)[0]
+            write_seed(args, tree, dir, table, name, fmt, out)
+        for name in seed.split_files(tree, dir, meta.seed_order):
+            size += tree.stat(dir, name)[0]
+            write_script(tree, dir, name, out)
+    values['size'] = '%d' % size
+    values['applied_at'] = 'CURRENT_TIMESTAMP'
+    out.write("INSERT INTO migrations (%s) VALUES (%s);\n" % (
+        ", ".join(values), ", ".join(values.values())))
+    for revision in meta.replaces:
+        if revision != str(dir):
+            out.write("INSERT INTO migrations (revision) VALUES (%s);\n" % literal(revision))
+
+
+def write_downgrade(args, tree, dir, meta, out: TextIO) -> None:
+    out.write("\n-- Downgrading %s\n" % (dir,))
+    if not tree.has(dir, 'down.sql'):
+        if not args.skip_missing:
+            raise Exception('Missing %s' % tree.path(dir, 'down.sql'))
+    else:
+        write_script(tree, dir, 'down.sql', out)
+    for revision in [str(dir)] + [r for r in meta.replaces if r != str(dir)]:
+        out.write("DELETE FROM migrations WHERE revision = %s;\n" % literal(revision))
+
+
+def write_missing_columns(args, columns: list, out: TextIO) -> None:
+    """Add the ``migrations`` columns a table created by an older zmigrate lacks.
+
+    Like :meth:`zmigrate.drivers.Driver.add_missing_columns`, only nullable
+    columns are added. SQLite can't add a column conditionally, so there the
+    statements are only written with ``--legacy-table``, for a target whose
+    table predates them.
+    """
+    added = [x for x in columns if not x.get('constraints')]
+    if args.driver != 'sqlite3':
+        for x in added:
+            out.write("ALTER TABLE migrations ADD COLUMN IF NOT EXISTS %s %s;\n" % (x['name'], x['type']))
+    elif args.legacy_table:
+        for x in added:
+            out.write("ALTER TABLE migrations ADD COLUMN %s %s;\n" % (x['name'], x['type']))
+
+
+def compile_plan(args, tree, pending: List, applied: Set[str], out: TextIO,
+                 columns: list, loadMeta: Callable) -> None:
+    """Write the SQL applying (or reverting) ``pending`` to ``out``.
+
+    ``columns`` describes the ``migrations`` table, created if it doesn't
+    exist, and ``loadMeta(tree, dir)`` returns a revision's settings.
+    Transactions follow ``args.transaction`` and ``meta.json`` like a live run.
+    """
+    out.write("-- Compiled by zmigrate: %d revision(s) %s\n" % (len(pending), args.direction))
+    out.write("CREATE TABLE IF NOT EXISTS migrations (%s);\n" % ", ".join(
+        f"{x.get('name')} {x.get('type')} {x.get('constraints', '')}".strip() for x in columns
+    ))
+    if args.direction == 'up' and pending:
+        write_missing_columns(args, columns, out)
+    if args.direction == 'down' and pending:
+        out.write("DROP TABLE IF EXISTS %s;\n" % head.TABLE)
+
+    step = write_upgrade if args.direction == 'up' else write_downgrade
+    inTransaction = False
+
+    def begin() -> None:
+        nonlocal inTransaction
+        out.write("BEGIN;\n")
+        inTransaction = True
+
+    def commit() -> None:
+        nonlocal inTransaction
+        out.write("COMMIT;\n")
+        inTransaction = False
+
+    if args.transaction == 'batch':
+        begin()
+    for dir in pending:
+        meta = loadMeta(tree, dir)
+        check_baseline(args, dir, meta, applied)
+        if not meta.transaction:
+            if inTransaction:
+                logger.warning(
+                    "%s can't run inside a transaction: the batch is committed before it", dir
+                )
+                commit()
+            step(args, tree, dir, meta, out)
+            if args.transaction == 'batch':
+                begin()
+        elif args.transaction == 'migration':
+            begin()
+            step(args, tree, dir, meta, out)
+            commit()
+        else:
+            step(args, tree, dir, meta, out)
+    if inTransaction:
+        commit()
+    logger.info("Compiled %d revision(s)", len(pending))
@@ -0,0 +1,102 @@
+"""Settings for running migrations against a live Postgres database.
+
+In online mode every statement runs with a ``lock_timeout`` (and optionally
+a ``statement_timeout``), so a DDL statement waiting for a lock gives up
+quickly instead of queueing all traffic behind it. Statements that failed
+on the lock timeout are retried after a jittered exponential backoff, and
+revisions holding statements that cannot run inside a transaction block
+(``CREATE INDEX CONCURRENTLY``...) run outside of one.
+
+The settings come from the command line and can be overridden per revision
+in ``meta.json``::
+
+    {"online": {"lock_timeout": "2s", "statement_timeout": "1h", "retries": 10}}
+"""
+
+from dataclasses import dataclass, fields
+from random import uniform
+from time import sleep
+from typing import Any, Optional
+import logging
+import re
+
+from zmigrate.script import iter_statements
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATE raised when ``lock_timeout`` expires.
+LOCK_NOT_AVAILABLE = '55P03'
+
+_TIMEOUT = re.compile(r"\d+\s*(?:us|ms|s|min|h|d)?", re.I)
+_LEADING_COMMENTS = re.compile(r"(?:\s|--[^\n]*(?:\n|$)|/\*.*?\*/)*", re.S)
+_NO_TRANSACTION = re.compile(
+    r"(?:create\s+(?:unique\s+)?index\s+concurrently"
+    r"|drop\s+index\s+concurrently"
+    r"|reindex\b[^;]*\bconcurrently"
+    r"|refresh\s+materialized\s+view\s+concurrently"
+    r"|vacuum\b"
+    r"|alter\s+system\b"
+    r"|(?:create|drop)\s+database\b"
+    r"|(?:create|drop)\s+tablespace\b)",
+    re.I,
+)
+
+
+@dataclass
+class Online:
+    lock_timeout: str = "5s"
+    # ``0`` disables the statement timeout.
+    statement_timeout: str = "0"
+    retries: int = 5
+    # Base and cap, in seconds, of the exponential backoff between retries.
+    backoff: float = 0.5
+    max_backoff: float = 30.0
+
+    def __post_init__(self) -> None:
+        for name in ('lock_timeout', 'statement_timeout'):
+            value = str(getattr(self, name)).strip()
+            if not _TIMEOUT.fullmatch(value):
+                raise Exception(f"Invalid {name}: {value}")
+            setattr(self, name, value)
+
+
+def settings(args, meta) -> Optional[Online]:
+    """Return the online settings of a revision, or ``None`` outside online mode."""
+    overrides: Any = meta.online
+    if overrides is False or (overrides is None and not args.online):
+        return None
+    values = {
+        'lock_timeout': args.lock_timeout,
+        'statement_timeout': args.statement_timeout,
+        'retries': args.retries,
+    }
+    if isinstance(overrides, dict):
+        unknown = set(overrides) - {f.name for f in fields(Online)}
+        if unknown:
+            raise Exception(f"Unknown online setting(s): {', '.join(sorted(unknown))}")
+        values.update(overrides)
+    return Online(**values)
+
+
+def needs_autocommit(statement: str) -> bool:
+    """Return whether ``statement`` cannot run inside a transaction block."""
+    body = statement[_LEADING_COMMENTS.match(statement).end():]
+    return _NO_TRANSACTION.match(body) is not None
+
+
+def requires_autocommit(tree, dir, script: str) -> bool:
+    """Return whether ``script`` of revision ``dir`` has a statement needing autocommit."""
+    if not tree.has(dir, script):
+        return False
+    with tree.open(dir, script) as fh:
+        return any(needs_autocommit(statement) for statement in iter_statements(fh))
+
+
+def pause(online: Online, attempt: int, statement: str) -> None:
+    """Sleep before retry ``attempt`` of ``statement`` (full jitter backoff)."""
+    delay = uniform(0, min(online.max_backoff, online.backoff * 2 ** (attempt - 1)))
+    logger.warning(
+        "Lock timeout on %s; retry %d/%d in %.2fs",
+        statement.split("\n", 1)[0][:80], attempt, online.retries, delay,
+    )
+    sleep(delay)
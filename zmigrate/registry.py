@@ -0,0 +1,95 @@
+"""Lazily loaded registry of database drivers.
+
+Drivers are referenced as ``module:attribute`` and only imported once they
+are looked up, so starting the CLI doesn't pay for drivers it won't use.
+Besides the built-in drivers, packages can provide their own through the
+``zmigrate.drivers`` entry point group::
+
+    entry_points={'zmigrate.drivers': ['mysql = zmigrate_mysql:MySQL']}
+
+Entry points are only scanned for names that aren't built in.
+"""
+
+from collections.abc import Mapping
+from importlib import import_module
+from threading import Lock
+from typing import Any, Dict, Iterator
+import logging
+
+logger = logging.getLogger(__name__)
+
+GROUP = 'zmigrate.drivers'
+BUILTIN_DRIVERS = {
+    'postgres': 'zmigrate.drivers:Postgres',
+    'sqlite3': 'zmigrate.drivers:SQLite3',
+}
+
+
+def _entry_points() -> Dict[str, str]:
+    from importlib.metadata import entry_points
+    eps = entry_points()
+    group = eps.select(group=GROUP) if hasattr(eps, 'select') else eps.get(GROUP, [])
+    return {ep.name: ep.value for ep in group}
+
+
+def load_object(ref: str) -> Any:
+    module, _, attr = ref.partition(':')
+    obj = import_module(module)
+    for name in attr.split('.') if attr else []:
+        obj = getattr(obj, name)
+    return obj
+
+
+class Registry(Mapping):
+    """Read-only mapping of driver names to driver classes, imported on access."""
+
+    def __init__(self, builtins: Dict[str, str]) -> None:
+        self.refs = dict(builtins)
+        self.loaded: Dict[str, Any] = {}
+        self.scanned = False
+        self.lock = Lock()
+
+    def scan(self) -> None:
+        with self.lock:
+            if self.scanned:
+                return
+            for name, ref in _entry_points().items():
+                self.refs.setdefault(name, ref)
+            self.scanned = True
+
+    def __getitem__(self, name: str) -> Any:
+        if name in self.loaded:
+            return self.loaded[name]
+        if name not in self.refs:
+            self.scan()
+        if name not in self.refs:
+            raise KeyError(name)
+        logger.debug("Loading driver %s from %s", name, self.refs[name])
+        driver = self.loaded[name] = load_object(self.refs[name])
+        return driver
+
+    def __contains__(self, name: object) -> bool:
+        if name not in self.refs:
+            self.scan()
+        return name in self.refs
+
+    def __iter__(self) -> Iterator[str]:
+        self.scan()
+        return iter(self.refs)
+
+    def __len__(self) -> int:
+        self.scan()
+        return len(self.refs)
+
+
+SUPPORTED_DRIVERS = Registry(BUILTIN_DRIVERS)
+
+
+def get_driver(name: str) -> Any:
+    """Return the driver class registered as ``name``."""
+    try:
+        return SUPPORTED_DRIVERS[name]
+    except KeyError:
+        raise Exception(
+            f"Unsupported driver {name!r} (available: {', '.join(sorted(SUPPORTED_DRIVERS))})"
+        ) from None
@@ -0,0 +1,127 @@
+"""Dependency scheduling of revisions over several connections.
+
+A revision may list the revisions it needs in its ``meta.json``::
+
+    {"depends": ["0.4.0"]}
+
+Only earlier revisions can be listed. A revision without ``depends`` keeps
+the strict default: it waits for every earlier revision of the plan, and
+no later revision starts before it finished. Revisions whose dependencies
+are satisfied run concurrently, lowest version first. Downgrades follow the
+same graph in reverse.
+"""
+
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from heapq import heapify, heappop, heappush
+from typing import Any, Callable, Dict, List, Set
+import logging
+import threading
+
+from zmigrate.dir import Dir
+
+logger = logging.getLogger(__name__)
+
+
+class Connections:
+    """One connection per worker thread, opened with ``connect()`` on first use.
+
+    Closing the pool closes every connection it opened, from whichever
+    thread; a connection is never used by two threads at once.
+    """
+
+    def __init__(self, connect: Callable[[], Any]) -> None:
+        self.connect = connect
+        self.local = threading.local()
+        self.opened: List[Any] = []
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> "Connections":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def get(self) -> Any:
+        """Return the connection of the calling thread."""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = self.connect()
+            with self.lock:
+                self.opened.append(db)
+        return db
+
+    def close(self) -> None:
+        for db in self.opened:
+            db.close()
+        self.opened = []
+
+
+def dependencies(args, pending: List[Dir], metas: Dict[Dir, object], applied: Set[str]) -> Dict[Dir, Set[Dir]]:
+    """Return the revisions of ``pending`` each pending revision has to wait for."""
+    pendingSet = set(pending)
+    requires: Dict[Dir, Set[Dir]] = {}
+    barrier = []  # the last undeclared revision and every declared one since
+    for dir in sorted(pending):
+        declared = metas[dir].depends
+        if declared is None:
+            requires[dir] = set(barrier)
+            barrier = [dir]
+            continue
+        requires[dir] = set()
+        for name in declared:
+            dep = Dir(name)
+            if dep >= dir:
+                raise Exception(f"{dir} can only depend on earlier revisions, not {dep}")
+            if dep in pendingSet:
+                requires[dir].add(dep)
+            elif args.direction == 'up' and name not in applied:
+                raise Exception(f"{dir} depends on {dep}, which is neither applied nor planned")
+        barrier.append(dir)
+    if args.direction == 'up':
+        return requires
+    # A revision can be reverted once everything that needs it was.
+    reverse: Dict[Dir, Set[Dir]] = {dir: set() for dir in pending}
+    for dir, deps in requires.items():
+        for dep in deps:
+            reverse[dep].add(dir)
+    return reverse
+
+
+def run(order: List[Dir], deps: Dict[Dir, Set[Dir]], work: Callable[[Dir], None], jobs: int) -> None:
+    """Call ``work`` for each revision of ``order`` once its ``deps`` are done.
+
+    Up to ``jobs`` revisions run at a time. After a failure nothing new is
+    started; the running revisions are waited for and the first error is
+    raised.
+    """
+    rank = {dir: i for i, dir in enumerate(order)}
+    waiting = {dir: set(deps[dir]) for dir in order}
+    dependents: Dict[Dir, List[Dir]] = defaultdict(list)
+    for dir, required in waiting.items():
+        for dep in required:
+            dependents[dep].append(dir)
+    ready = [(rank[dir], dir) for dir in order if not waiting[dir]]
+    heapify(ready)
+
+    error = None
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        while running or (ready and error is None):
+            while ready and error is None and len(running) < jobs:
+                _, dir = heappop(ready)
+                running[pool.submit(work, dir)] = dir
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                dir = running.pop(future)
+                exc = future.exception()
+                if exc is not None:
+                    logger.error("%s failed: %s", dir, exc)
+                    error = error or exc
+                    continue
+                for dependent in dependents[dir]:
+                    waiting[dependent].discard(dir)
+                    if not waiting[dependent]:
+                        heappush(ready, (rank[dependent], dependent))
+    if error is not None:
+        raise error
@@ -0,0 +1,152 @@
+"""Streaming SQL script reader.
+
+Scripts are consumed line by line and split into individual statements, so
+memory use is bounded by the longest statement rather than by the size of the
+file. The splitter understands quoted strings and identifiers, ``E''`` escape
+strings, ``--`` and (nested) ``/* */`` comments, Postgres dollar-quoting and
+``BEGIN ... END`` bodies of ``CREATE TRIGGER``/``CREATE FUNCTION`` statements.
+"""
+
+from typing import BinaryIO, Iterable, Iterator, List
+import io
+import re
+
+from zmigrate import hooks
+from zmigrate.checksum import HashingReader
+
+# Statements are handed to the driver in batches of roughly this many
+# characters.
+BATCH_SIZE = 1 << 20
+
+_TOKEN = re.compile(
+    r"""\b[Ee]'|'|"|--|/\*|(?<![\w$])\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$|;|\b(?:begin|case|end)\b""",
+    re.I,
+)
+_QUOTE_END = {"'": re.compile(r"'"), '"': re.compile(r'"'), "e'": re.compile(r"\\.|'", re.S)}
+_COMMENT = re.compile(r"/\*|\*/")
+_CREATE = re.compile(r"(?:\s|--[^\n]*\n|/\*.*?\*/)*create\b", re.I | re.S)
+_BLANK = re.compile(r"(?:\s|;|--[^\n]*(?:\n|$)|/\*.*?\*/)*", re.S)
+
+
+def is_blank(statement: str) -> bool:
+    """Return whether ``statement`` holds nothing but whitespace and comments."""
+    return _BLANK.fullmatch(statement) is not None
+
+
+def iter_statements(lines: Iterable[str]) -> Iterator[str]:
+    """Yield each SQL statement found in ``lines``, including its ``;``.
+
+    ``lines`` is any iterable of text lines, typically an open file. Blank and
+    comment-only statements are dropped.
+    """
+    parts: List[str] = []
+    quote = None  # closing delimiter while inside a literal, identifier or $tag$
+    comments = 0  # nesting depth of /* */ comments
+    depth = 0  # BEGIN/CASE ... END nesting inside CREATE statements
+    isCreate = None
+
+    for line in lines:
+        pos = 0
+        start = 0
+        end = len(line)
+        while pos < end:
+            if comments:
+                match = _COMMENT.search(line, pos)
+                if match is None:
+                    break
+                comments += 1 if match.group() == "/*" else -1
+                pos = match.end()
+                continue
+            if quote is not None:
+                if quote in _QUOTE_END:
+                    match = _QUOTE_END[quote].search(line, pos)
+                    while match is not None and match.group() != "'" and match.group() != '"':
+                        match = _QUOTE_END[quote].search(line, match.end())
+                    if match is None:
+                        break
+                    pos = match.end()
+                    # A doubled quote is an escaped quote, not the end.
+                    if line.startswith(match.group(), pos):
+                        pos += 1
+                        continue
+                else:
+                    idx = line.find(quote, pos)
+                    if idx < 0:
+                        break
+                    pos = idx + len(quote)
+                quote = None
+                continue
+
+            match = _TOKEN.search(line, pos)
+            if match is None:
+                break
+            token = match.group()
+            pos = match.end()
+            lowered = token.lower()
+            if token == ";":
+                if depth:
+                    continue
+                parts.append(line[start:pos])
+                statement = "".join(parts)
+                parts = []
+                start = pos
+                isCreate = None
+                if not is_blank(statement):
+                    yield statement.strip()
+            elif token == "--":
+                break
+            elif token == "/*":
+                comments = 1
+            elif token in ("'", '"'):
+                quote = token
+            elif lowered == "e'":
+                quote = "e'"
+            elif token.startswith("$"):
+                quote = token
+            else:
+                if isCreate is None:
+                    isCreate = _CREATE.match("".join(parts) + line[start:pos]) is not None
+                if not isCreate:
+                    continue
+                if lowered in ("begin", "case"):
+                    depth += 1
+                elif depth:
+                    depth -= 1
+        parts.append(line[start:])
+
+    statement = "".join(parts)
+    if not is_blank(statement):
+        yield statement.strip()
+
+
+def execute_stream(db, lines: Iterable[str], batchSize: int = BATCH_SIZE) -> None:
+    """Execute the statements read from ``lines`` through ``db`` in batches.
+
+    At most about ``batchSize`` characters of statements are held in memory
+    at any time. While hooks are registered, statements are executed one at a
+    time so that each of them gets its own timing.
+    """
+    if hooks.enabled:
+        batchSize = 1
+    batch: List[str] = []
+    size = 0
+    for statement in iter_statements(lines):
+        batch.append(statement)
+        size += len(statement)
+        if size >= batchSize:
+            db.execute_batch(batch)
+            batch = []
+            size = 0
+    if batch:
+        db.execute_batch(batch)
+
+
+def execute_file(db, fh: BinaryIO, batchSize: int = BATCH_SIZE) -> str:
+    """Execute the UTF-8 script read from ``fh`` like :func:`execute_stream`.
+
+    Returns the SHA-256 of the script, computed as it streams through, so
+    the file is only read once.
+    """
+    reader = HashingReader(fh)
+    execute_stream(db, io.TextIOWrapper(io.BufferedReader(reader), encoding="utf-8"), batchSize)
+    return reader.hexdigest()
@@ -0,0 +1,125 @@
+"""Bulk loading of seed data files.
+
+A migration directory may contain a ``seed/`` directory holding one
+``<table>.csv`` or ``<table>.tsv`` file per table. The first line of each file
+names the columns. Files are loaded in name order and streamed straight into
+the driver, which uses ``COPY ... FROM STDIN`` on Postgres and chunked
+``executemany`` on SQLite.
+
+CSV files follow the Postgres ``FORMAT csv`` conventions (an unquoted empty
+field is ``NULL``). TSV files follow the Postgres text format (``\\N`` is
+``NULL`` and backslash escapes are honoured).
+
+Independent seed scripts can be split into ``seed.d/*.sql``. They run after
+``seed.sql`` and ``seed/``, concurrently over several connections on
+Postgres, and one after the other on SQLite or when ``meta.json`` declares
+a ``seed_order``.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from csv import reader
+from os.path import splitext
+from time import monotonic
+from typing import Callable, List, Optional
+import logging
+
+from zmigrate import hooks
+from zmigrate.schedule import Connections
+from zmigrate.script import execute_stream
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'.csv': 'csv', '.tsv': 'text'}
+# Directory of independent seed scripts, loaded concurrently when possible.
+SPLIT_DIR = 'seed.d'
+DELIMITERS = {'csv': ',', 'text': '\t'}
+
+
+def seed_files(tree, dir):
+    """Return ``(table, name, format)`` for every loadable file in ``dir``'s ``seed/``."""
+    files = []
+    for name in tree.files(dir, 'seed'):
+        table, ext = splitext(name)
+        fmt = FORMATS.get(ext.lower())
+        if fmt is None:
+            logger.debug("Ignoring %s", tree.path(dir, 'seed/' + name))
+            continue
+        files.append((table, 'seed/' + name, fmt))
+    return files
+
+
+def load_file(db, tree, dir, table: str, name: str, fmt: str) -> int:
+    """Stream seed file ``name`` of revision ``dir`` into ``table``.
+
+    Returns the number of rows loaded.
+    """
+    path = tree.path(dir, name)
+    logger.info("Loading %s into %s", path, table)
+    event = hooks.start('load', path) if hooks.enabled else None
+    with tree.open(dir, name, newline="") as fh:
+        header = fh.readline()
+        columns = next(reader([header], delimiter=DELIMITERS[fmt]), [])
+        if not columns:
+            raise Exception('Missing header in %s' % path)
+        count = db.bulk_load(table, columns, fh, fmt)
+    if event:
+        hooks.stop(event, rows=count, bytes=tree.stat(dir, name)[0])
+    logger.info("|- %d row(s)", count)
+    return count
+
+
+def load_dir(db, tree, dir) -> int:
+    """Load every seed file of revision ``dir`` and return the total row count."""
+    return sum(load_file(db, tree, dir, *entry) for entry in seed_files(tree, dir))
+
+
+def split_files(tree, dir, order: Optional[List[str]] = None) -> List[str]:
+    """Return the ``seed.d/`` scripts of ``dir``: those in ``order`` first, then by name."""
+    names = [name for name in tree.files(dir, SPLIT_DIR) if name.endswith('.sql')]
+    if order:
+        missing = set(order).difference(names)
+        if missing:
+            raise Exception('Missing %s in %s' % (', '.join(sorted(missing)), tree.path(dir, SPLIT_DIR)))
+        names = list(order) + [name for name in names if name not in order]
+    return [SPLIT_DIR + '/' + name for name in names]
+
+
+def load_script(db, tree, dir, name: str) -> None:
+    path = tree.path(dir, name)
+    started = monotonic()
+    event = hooks.start('script', path) if hooks.enabled else None
+    with tree.open(dir, name) as fh:
+        execute_stream(db, fh)
+    if event:
+        hooks.stop(event, bytes=tree.stat(dir, name)[0])
+    logger.info("Loaded %s in %.2fs", path, monotonic() - started)
+
+
+def load_split(args, db, tree, dir, order: Optional[List[str]], connect: Callable) -> int:
+    """Run the ``seed.d/`` scripts of ``dir`` and return how many there were.
+
+    They run over up to ``args.seed_jobs`` extra connections opened with
+    ``connect(args)``, unless ``order`` declares an order, the driver
+    doesn't take concurrent writers or ``db`` is inside a transaction the
+    other connections couldn't see.
+    """
+    names = split_files(tree, dir, order)
+    jobs = min(args.seed_jobs, len(names))
+    if jobs <= 1 or order or not db.concurrent or db.inTransaction:
+        for name in names:
+            load_script(db, tree, dir, name)
+        return len(names)
+
+    logger.info("Loading %d seed script(s) over %d connection(s)", len(names), jobs)
+
+    def open_connection():
+        conn = connect(args)
+        if db.schema:
+            conn.set_schema(db.schema)
+        conn.online = db.online
+        return conn
+
+    with Connections(open_connection) as connections:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(lambda name: load_script(connections.get(), tree, dir, name), names))
+    return len(names)
@@ -0,0 +1,116 @@
+"""Collapse a range of old revisions into a single baseline revision.
+
+The revisions are applied to a scratch database whose resulting state is
+dumped as the baseline's ``up.sql``. The baseline is named after the last
+revision it replaces and lists every replaced revision in its ``meta.json``:
+databases that already applied them treat the baseline as applied, while
+fresh databases only run the baseline and record all replaced revisions.
+"""
+
+from copy import copy
+from json import dumps
+from os import makedirs
+from os.path import exists
+from shutil import copyfileobj
+from typing import Callable, List, Sequence, Set
+import logging
+
+from zmigrate.script import execute_stream
+from zmigrate.seed import SPLIT_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def select(args, dirs: Sequence) -> List:
+    """Return the ascending ``dirs`` covered by ``args.range``.
+
+    A baseline replaces history from the beginning, so the range has to start
+    at the first revision of the tree.
+    """
+    if not args.range.last:
+        raise Exception("squash needs a range ending at the last revision to replace")
+    ordered = sorted(dirs)
+    selected = [d for d in ordered if d <= args.range.last]
+    if args.range.first and ordered and args.range.first != ordered[0]:
+        raise Exception(f"A baseline must start at the first revision ({ordered[0]})")
+    if not selected:
+        raise Exception(f"No revision up to {args.range.last}")
+    return selected
+
+
+def check_baseline(args, dir, meta, applied: Set[str]) -> None:
+    """Refuse to apply baseline ``dir`` where only some of the revisions it replaces are."""
+    if args.direction == 'up' and applied.intersection(meta.replaces):
+        raise Exception(
+            f"{dir} is a baseline of revisions only partially applied here; "
+            "migrate with the original revisions first"
+        )
+
+
+def concat(tree, dirs: List, script: str, out: str) -> bool:
+    """Append ``script`` from each of ``dirs`` to ``out``; return whether any existed."""
+    found = [dir for dir in dirs if tree.has(dir, script)]
+    if not found:
+        return False
+    with open(out, "w", encoding="utf-8") as dst:
+        for dir in found:
+            dst.write("-- %s/%s\n" % (dir, script))
+            with tree.open(dir, script) as src:
+                copyfileobj(src, dst)
+            dst.write("\n")
+    return True
+
+
+def squash(args, tree, dirs: Sequence, connect: Callable) -> str:
+    """Write a baseline for the revisions in ``args.range`` to ``args.output``.
+
+    ``connect(args)`` opens a driver; it is used on a scratch database (an
+    in-memory database for SQLite, ``<database>_squash`` for Postgres).
+    Returns the output directory.
+    """
+    selected = select(args, dirs)
+    last = selected[-1]
+    out = args.output
+    if not out:
+        raise Exception("squash needs --output")
+    if exists(out):
+        raise Exception(f"{out} already exists")
+
+    scratchArgs = copy(args)
+    if args.driver == 'sqlite3':
+        scratchArgs.database = ':memory:'
+    else:
+        scratchArgs.database = '%s_squash' % args.database
+        with connect(args) as admin:
+            admin.drop_database(scratchArgs.database)
+
+    makedirs(out)
+    try:
+        with connect(scratchArgs) as db:
+            for dir in selected:
+                if not tree.has(dir, 'up.sql'):
+                    continue
+                logger.info("Applying %s to the scratch database", tree.path(dir, 'up.sql'))
+                with tree.open(dir, 'up.sql') as fh:
+                    execute_stream(db, fh)
+            with open('%s/up.sql' % out, "w", encoding="utf-8") as fh:
+                db.dump(fh)
+    finally:
+        if args.driver != 'sqlite3':
+            with connect(args) as admin:
+                admin.drop_database(scratchArgs.database)
+
+    concat(tree, list(reversed(selected)), 'down.sql', '%s/down.sql' % out)
+    concat(tree, selected, 'seed.sql', '%s/seed.sql' % out)
+    for dir in selected:
+        if tree.files(dir, 'seed'):
+            logger.warning("%s has seed data files that are not part of the baseline", dir)
+        if tree.files(dir, SPLIT_DIR):
+            logger.warning("%s has %s/ scripts that are not part of the baseline", dir, SPLIT_DIR)
+
+    with open('%s/readme' % out, "w", encoding="utf-8") as fh:
+        fh.write("Baseline of revisions %s to %s\n" % (selected[0], last))
+    with open('%s/meta.json' % out, "w", encoding="utf-8") as fh:
+        fh.write(dumps({'replaces': [str(d) for d in selected]}, indent=1) + "\n")
+    logger.info("Wrote baseline %s replacing %d revision(s) to %s", last, len(selected), out)
+    return out
@@ -0,0 +1,166 @@
+"""Execution statistics of applied revisions and progress reporting.
+
+Every time a revision is applied or reverted its duration and script size
+are appended to the ``migrations_stats`` table. Unlike ``migrations`` rows,
+which are deleted when a revision is reverted, these are never removed, so
+they can be used to estimate how long a plan will take.
+"""
+
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+from zmigrate.bookkeeping import now
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'migrations_stats'
+COLUMNS = [
+    {
+        'name': 'id',
+        'type': 'SERIAL',
+        'constraints': 'PRIMARY KEY'
+    },
+    {
+        'name': 'revision',
+        'type': 'TEXT',
+        'constraints': 'NOT NULL',
+    },
+    {
+        'name': 'direction',
+        'type': 'TEXT',
+        'constraints': 'NOT NULL',
+    },
+    {
+        'name': 'duration',
+        'type': 'DOUBLE PRECISION',
+    },
+    {
+        'name': 'size',
+        'type': 'BIGINT',
+    },
+    {
+        'name': 'applied_at',
+        'type': 'TIMESTAMP',
+    },
+]
+
+
+def create_table(db) -> None:
+    db.create_table(TABLE, COLUMNS)
+
+
+def record(db, revision: str, direction: str, duration: float, size: int) -> None:
+    """Append a timing through ``db``, a driver or a bookkeeping buffer."""
+    db.insert_row(
+        TABLE,
+        revision=revision,
+        direction=direction,
+        duration=duration,
+        size=size,
+        applied_at=now(),
+    )
+
+
+def estimates(db, direction: str) -> Dict[str, float]:
+    """Return the average recorded duration of each revision in ``direction``."""
+    rows = db.execute(
+        f"SELECT revision, AVG(duration) FROM {db.qualify(TABLE)} "
+        f"WHERE direction = {db.placeholder} GROUP BY revision",
+        readRows=True,
+        params=(direction,),
+    )
+    return {row[0]: float(row[1]) for row in rows if row[1] is not None}
+
+
+def slowest(db, limit: int = 10) -> List[Tuple[str, int, float, float, int]]:
+    """Return ``(revision, runs, average, maximum, size)`` of the slowest upgrades."""
+    rows = db.execute(
+        f"SELECT revision, COUNT(*), AVG(duration), MAX(duration), MAX(size) "
+        f"FROM {db.qualify(TABLE)} "
+        f"WHERE direction = 'up' GROUP BY revision ORDER BY AVG(duration) DESC LIMIT {int(limit)}",
+        readRows=True,
+    )
+    return [(row[0], row[1], float(row[2] or 0), float(row[3] or 0), row[4]) for row in rows]
+
+
+def report(db, limit: int = 10) -> List[Tuple[str, int, float, float, int]]:
+    """Log the slowest upgrades and their share of a full bootstrap."""
+    total = sum(estimates(db, 'up').values())
+    rows = slowest(db, limit)
+    logger.info("Full upgrade takes about %s", format_seconds(total))
+    for revision, runs, average, maximum, size in rows:
+        logger.info(
+            "%s: %.3fs average, %.3fs max over %d run(s), %d bytes, %.1f%% of total",
+            revision, average, maximum, runs, size or 0, average / total * 100 if total else 0.0,
+        )
+    return rows
+
+
+def format_seconds(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return '%ds' % seconds
+    if seconds < 3600:
+        return '%dm%02ds' % divmod(seconds, 60)
+    hours, seconds = divmod(seconds, 3600)
+    return '%dh%02dm' % (hours, seconds // 60)
+
+
+class Progress:
+    """Log progress through a known set of steps with an estimated time left.
+
+    ``estimates`` maps step names to their expected duration, usually taken
+    from earlier runs. Steps without one are assumed to take as long as the
+    average step completed so far. Progress is logged at most once every
+    ``interval`` seconds.
+    """
+
+    def __init__(self, kind: str, names: Iterable[str],
+                 estimates: Optional[Dict[str, float]] = None, interval: float = 5.0) -> None:
+        self.kind = kind
+        self.estimates = estimates or {}
+        self.remaining = set(names)
+        self.total = len(self.remaining)
+        self.done = 0
+        self.interval = interval
+        self.started = monotonic()
+        self.logged = self.started
+        self.lock = Lock()
+        known = [self.estimates[name] for name in self.remaining if name in self.estimates]
+        if known:
+            logger.info(
+                "Estimated %s for %d of %d %s(s) based on earlier runs",
+                format_seconds(sum(known)), len(known), self.total, self.kind,
+            )
+
+    def eta(self) -> Optional[float]:
+        elapsed = monotonic() - self.started
+        unknown = 0
+        left = 0.0
+        for name in self.remaining:
+            if name in self.estimates:
+                left += self.estimates[name]
+            else:
+                unknown += 1
+        if unknown:
+            if not self.done:
+                return None
+            left += unknown * elapsed / self.done
+        return left
+
+    def advance(self, name: str) -> None:
+        with self.lock:
+            self.remaining.discard(name)
+            self.done += 1
+            current = monotonic()
+            if self.done == self.total or current - self.logged < self.interval:
+                return
+            self.logged = current
+            eta = self.eta()
+            logger.info(
+                "%d/%d %s(s) done, %s elapsed, ETA %s",
+                self.done, self.total, self.kind, format_seconds(current - self.started),
+                'unknown' if eta is None else format_seconds(eta),
+            )
@@ -0,0 +1,103 @@
+"""Apply one migration tree to many databases concurrently."""
+
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from dataclasses import dataclass
+from json import loads
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Union
+import logging
+
+from zmigrate.stats import Progress
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Result:
+    target: str
+    ok: bool
+    seconds: float
+    error: Optional[str] = None
+
+
+def parse(raw: Union[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Return the settings overridden by target ``raw``.
+
+    A target is either a mapping of settings (``driver``, ``host``,
+    ``database``...) or a plain string naming the database.
+    """
+    if isinstance(raw, dict):
+        return raw
+    return {'database': raw}
+
+
+def load(path: str) -> List[Dict[str, Any]]:
+    """Load targets from ``path``, one per line.
+
+    Lines are either JSON objects or bare database names. Blank lines and
+    lines starting with ``#`` are ignored.
+    """
+    targets = []
+    with open(path, "r", encoding="utf-8") as fh:
+        for raw_line in fh:
+            line = raw_line.strip()
+            if not line or line.startswith('#'):
+                continue
+            targets.append(parse(loads(line) if line.startswith('{') else line))
+    return targets
+
+
+def label(args) -> str:
+    if args.driver == 'sqlite3':
+        return str(args.database)
+    return '%s/%s' % (args.host, args.database)
+
+
+def run(args, targets: List[Any], work: Callable[[Any], None], jobs: int) -> List[Result]:
+    """Call ``work`` with a copy of ``args`` for every target, ``jobs`` at a time.
+
+    Every target runs to completion regardless of failures elsewhere; the
+    outcome of each one is returned in the order of ``targets``.
+    """
+
+    progress = Progress('target', [str(i) for i in range(len(targets))])
+
+    def one(i: int, raw) -> Result:
+        try:
+            return migrate_one(raw)
+        finally:
+            progress.advance(str(i))
+
+    def migrate_one(raw) -> Result:
+        targetArgs = copy(args)
+        for key, value in parse(raw).items():
+            setattr(targetArgs, key, value)
+        name = label(targetArgs)
+        started = monotonic()
+        try:
+            work(targetArgs)
+        except Exception as exc:
+            logger.exception("%s: migration failed", name)
+            return Result(name, False, monotonic() - started, str(exc))
+        return Result(name, True, monotonic() - started)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        results = list(pool.map(one, range(len(targets)), targets))
+
+    for result in results:
+        if result.ok:
+            logger.info("%s: ok (%.2fs)", result.target, result.seconds)
+        else:
+            logger.error("%s: FAILED (%.2fs): %s", result.target, result.seconds, result.error)
+    failed = sum(1 for result in results if not result.ok)
+    logger.info("%d target(s) migrated, %d failed", len(results) - failed, failed)
+    return results
+
+
+def raise_for_failures(results: List[Result], kind: str = 'target') -> None:
+    failed = [result.target for result in results if not result.ok]
+    if failed:
+        raise Exception(
+            f"Migration failed for {len(failed)} of {len(results)} {kind}(s): {', '.join(failed)}"
+        )
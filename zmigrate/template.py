@@ -0,0 +1,169 @@
+"""Provision fresh databases by cloning a migrated template.
+
+A template is a database migrated to the full tree once and keyed by a
+fingerprint of the tree's contents. Fresh databases are then created from it
+instead of replaying every revision: ``CREATE DATABASE ... TEMPLATE`` on
+Postgres and the sqlite3 backup API (which also covers ``:memory:``) on SQLite.
+
+A run builds (or checks) the template at most once per server, before the
+first database it has to create there, and then drops the templates of
+older trees.
+"""
+
+from copy import copy
+from hashlib import sha1
+from os import getpid, listdir, makedirs, remove, replace
+from os.path import isdir, isfile, join
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+import logging
+import re
+
+from zmigrate import backfill, seed
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'zmigrate_tpl_'
+_FILE = re.compile(r"[0-9a-f]{40}\.db")
+
+_locks: Dict[str, Lock] = {}
+_locksLock = Lock()
+
+
+def fingerprint(args, tree, dirs: Sequence) -> str:
+    """Return a fingerprint of everything that shapes a fully migrated database.
+
+    Every script and seed file of ``dirs`` is checksummed, so without a
+    :class:`zmigrate.tree.Manifest` (``--manifest``) the whole tree is read
+    and the cost grows with its size. A manifest's cached checksums are used
+    for the files whose size and mtime haven't changed.
+    """
+    digest = sha1()
+    digest.update(('%s:%s\0' % (args.driver, bool(args.seed))).encode('utf-8'))
+    # meta.json can change how a revision runs (or what it replaces).
+    files = ['up.sql', backfill.FILE, 'meta.json']
+    if args.seed:
+        files.append('seed.sql')
+    for dir in sorted(dirs):
+        digest.update(('%s\0' % (dir,)).encode('utf-8'))
+        paths = [name for name in files if tree.has(dir, name)]
+        if args.seed:
+            for subdir in ('seed', seed.SPLIT_DIR):
+                paths.extend('%s/%s' % (subdir, name) for name in tree.files(dir, subdir))
+        for path in paths:
+            digest.update(('%s:%s\0' % (path, tree.checksum(dir, path))).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def wanted(args) -> bool:
+    """Return whether ``args`` asks for fresh databases to be cloned from a template."""
+    return bool(args.template) and args.direction == 'up' \
+        and not (args.range.first or args.range.last)
+
+
+def name(args, treeFingerprint: str) -> str:
+    """Return the template database for ``treeFingerprint``."""
+    if args.driver == 'sqlite3':
+        return join(args.template_dir, treeFingerprint + '.db')
+    return PREFIX + treeFingerprint[:16]
+
+
+def ensure(
+    args, tree, dirs: Sequence, connect: Callable, migrate: Callable,
+    treeFingerprint: Optional[str] = None,
+) -> str:
+    """Return the template for the tree, building it with ``migrate`` if needed.
+
+    ``connect(args)`` opens a driver and ``migrate(args, dirs, db)`` migrates
+    it. Builds are serialized per template within the process.
+    ``treeFingerprint`` is computed with :func:`fingerprint` if not given.
+    """
+    if treeFingerprint is None:
+        treeFingerprint = fingerprint(args, tree, dirs)
+    template = name(args, treeFingerprint)
+    with _locksLock:
+        lock = _locks.setdefault(template, Lock())
+    with lock:
+        tplArgs = copy(args)
+        tplArgs.direction = 'up'
+        if args.driver == 'sqlite3':
+            if isfile(template):
+                return template
+            makedirs(args.template_dir, exist_ok=True)
+            tplArgs.database = '%s.%d.tmp' % (template, getpid())
+            logger.info("Building template %s", template)
+            try:
+                with connect(tplArgs) as db:
+                    migrate(tplArgs, dirs, db)
+                replace(tplArgs.database, template)
+            except BaseException:
+                if isfile(tplArgs.database):
+                    remove(tplArgs.database)
+                raise
+            return template
+
+        # Migrating an up to date template is a no-op, and one interrupted
+        # half way through is simply resumed.
+        tplArgs.database = template
+        with connect(tplArgs) as db:
+            migrate(tplArgs, dirs, db)
+        return template
+
+
+def prune(args, template: str, connect: Callable) -> None:
+    """Drop the templates other than ``template``, built from older trees."""
+    if args.driver == 'sqlite3':
+        if not isdir(args.template_dir):
+            return
+        for item in listdir(args.template_dir):
+            path = join(args.template_dir, item)
+            if _FILE.fullmatch(item) and path != template:
+                logger.info("Removing stale template %s", path)
+                remove(path)
+        return
+
+    tplArgs = copy(args)
+    tplArgs.database = template
+    with connect(tplArgs) as db:
+        rows = db.execute(
+            "SELECT datname FROM pg_catalog.pg_database WHERE datname LIKE %s",
+            readRows=True,
+            params=(PREFIX.replace('_', '\\_') + '%',),
+        )
+        for (stale,) in rows:
+            if stale == template:
+                continue
+            logger.info("Dropping stale template %s", stale)
+            try:
+                db.drop_database(stale)
+            except Exception as exc:
+                # Another process may be cloning it right now.
+                logger.warning("Couldn't drop template %s: %s", stale, exc)
+
+
+def provider(tree, dirs: Sequence, connect: Callable, migrate: Callable) -> Callable[[Any], str]:
+    """Return ``get(args)``, returning the template for the target ``args``.
+
+    See :func:`ensure`. A template is only built or checked by the first call
+    for its server (or template directory), and stale ones pruned then.
+    Later calls wait for it and return its name without touching it, so no
+    connection to the template is open while databases are created from it.
+    The tree is fingerprinted once per driver and ``--seed``, not per server.
+    """
+    lock = Lock()
+    built: Dict[Tuple[Any, ...], str] = {}
+    fingerprints: Dict[Tuple[Any, ...], str] = {}
+
+    def get(args) -> str:
+        where = args.template_dir if args.driver == 'sqlite3' else args.host
+        key = (args.driver, bool(args.seed), where)
+        with lock:
+            if key not in built:
+                if key[:2] not in fingerprints:
+                    fingerprints[key[:2]] = fingerprint(args, tree, dirs)
+                template = ensure(args, tree, dirs, connect, migrate, fingerprints[key[:2]])
+                prune(args, template, connect)
+                built[key] = template
+            return built[key]
+
+    return get
@@ -0,0 +1,103 @@
+"""Schema-per-tenant migrations over a few shared connections."""
+
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Callable, List
+import logging
+
+from zmigrate import head
+from zmigrate.stats import Progress
+from zmigrate.targets import Result
+
+logger = logging.getLogger(__name__)
+
+
+def resolve(db, patterns: List[str]) -> List[str]:
+    """Expand ``patterns`` into schema names.
+
+    Entries containing ``*`` or ``%`` are matched against the existing schemas;
+    anything else is taken literally and created when missing.
+    """
+    schemas: List[str] = []
+    for pattern in patterns:
+        if '*' in pattern or '%' in pattern:
+            matched = db.list_schemas(pattern.replace('*', '%'))
+            if not matched:
+                logger.warning("No schema matches %s", pattern)
+            schemas.extend(matched)
+        else:
+            schemas.append(pattern)
+    # Keep the first occurrence of every schema.
+    return list(dict.fromkeys(schemas))
+
+
+def run(args, db, schemas: List[str], names: List[str], work: Callable) -> List[Result]:
+    """Migrate every schema in ``schemas`` over the single connection ``db``.
+
+    ``work(args, db)`` migrates whichever schema is currently selected. Up to
+    ``args.tenant_batch`` tenants share one transaction; a failure rolls back
+    and reports every tenant of its batch, then the next batch carries on.
+    """
+    results: List[Result] = []
+    batchSize = max(1, args.tenant_batch)
+    progress = Progress('schema', schemas)
+    for i in range(0, len(schemas), batchSize):
+        todo = []
+        for schema in schemas[i:i + batchSize]:
+            db.set_schema(schema, create=args.direction == 'up')
+            if args.fast_path and args.direction == 'up' and head.matches(db, names):
+                logger.info("%s is already at head", schema)
+                results.append(Result(schema, True, 0.0))
+                progress.advance(schema)
+            else:
+                todo.append(schema)
+        if not todo:
+            continue
+
+        started = monotonic()
+        batched = len(todo) > 1
+        try:
+            if batched:
+                db.begin()
+            for schema in todo:
+                logger.info("Migrating schema %s", schema)
+                db.set_schema(schema)
+                work(args, db)
+            if batched:
+                db.commit()
+        except Exception as exc:
+            logger.exception("Migration failed for schema(s) %s", ", ".join(todo))
+            # Also clears an aborted implicit transaction on Postgres.
+            db.rollback()
+            elapsed = monotonic() - started
+            results.extend(Result(schema, False, elapsed, str(exc)) for schema in todo)
+        else:
+            elapsed = (monotonic() - started) / len(todo)
+            results.extend(Result(schema, True, elapsed) for schema in todo)
+        for schema in todo:
+            progress.advance(schema)
+    return results
+
+
+def run_all(args, connect: Callable, names: List[str], work: Callable) -> List[Result]:
+    """Resolve ``args.schemas`` and migrate them over ``args.jobs`` connections.
+
+    ``connect(args)`` opens a driver. Schemas are spread round-robin over the
+    connections and the results are returned in schema order.
+    """
+    with connect(args) as db:
+        schemas = resolve(db, args.schemas)
+    jobs = max(1, min(args.jobs, len(schemas)))
+    parts = [schemas[i::jobs] for i in range(jobs)]
+
+    def one(part: List[str]) -> List[Result]:
+        with connect(args) as db:
+            return run(args, db, part, names, work)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        byName = {r.target: r for part in pool.map(one, parts) for r in part}
+
+    results = [byName[schema] for schema in schemas]
+    failed = sum(1 for result in results if not result.ok)
+    logger.info("%d schema(s) migrated, %d failed", len(results) - failed, failed)
+    return results
@@ -0,0 +1,190 @@
+"""Access to the scripts of a migration tree.
+
+:class:`Tree` reads the migration directory directly. :class:`Manifest` keeps
+an index of the tree (revision names, the files in each revision with their
+sizes, mtimes and checksums) in a JSON file so that later runs don't have to
+walk the whole tree again. Only directories whose mtime changed are rescanned,
+and only when a revision is actually looked at.
+"""
+
+from json import dump, load
+from os import listdir, replace, stat
+from os.path import isdir, isfile, join
+from stat import S_ISDIR, S_ISREG
+from threading import RLock
+from typing import Any, BinaryIO, Dict, List, Optional, TextIO, Tuple
+import logging
+
+from zmigrate.checksum import file_checksum
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+class Tree:
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def names(self) -> List[str]:
+        """Return the revision directory names."""
+        return listdir(self.root)
+
+    def path(self, dir, name: str) -> str:
+        return '%s/%s/%s' % (self.root, dir, name)
+
+    def has(self, dir, name: str) -> bool:
+        """Return whether revision ``dir`` contains the file ``name``."""
+        return isfile(self.path(dir, name))
+
+    def files(self, dir, subdir: str) -> List[str]:
+        """Return the sorted file names inside ``subdir`` of revision ``dir``."""
+        path = self.path(dir, subdir)
+        if not isdir(path):
+            return []
+        return sorted(name for name in listdir(path) if isfile(join(path, name)))
+
+    def stat(self, dir, name: str) -> Tuple[int, int]:
+        """Return the ``(size, mtime_ns)`` of file ``name`` in revision ``dir``."""
+        st = stat(self.path(dir, name))
+        return st.st_size, st.st_mtime_ns
+
+    def open(self, dir, name: str, newline: Optional[str] = None) -> TextIO:
+        return open(self.path(dir, name), "r", encoding="utf-8", newline=newline)
+
+    def open_binary(self, dir, name: str) -> BinaryIO:
+        return open(self.path(dir, name), "rb")
+
+    def checksum(self, dir, name: str) -> str:
+        """Return the content checksum of file ``name`` in revision ``dir``."""
+        with self.open_binary(dir, name) as fh:
+            return file_checksum(fh)
+
+    def save(self) -> None:
+        """Persist any cached state. Plain trees have none."""
+
+    def close(self) -> None:
+        """Release the resources held by the tree. Plain trees hold none."""
+
+    def __enter__(self) -> "Tree":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+class Manifest(Tree):
+    """A :class:`Tree` whose layout is cached in the JSON file ``manifestPath``."""
+
+    def __init__(self, root: str, manifestPath: str) -> None:
+        super().__init__(root)
+        self.manifestPath = manifestPath
+        self.lock = RLock()
+        self.dirty = False
+        # Revisions already validated during this run.
+        self.checked = set()
+        self.data = self._load()
+
+    def _load(self) -> Dict[str, Any]:
+        data = None
+        if isfile(self.manifestPath):
+            try:
+                with open(self.manifestPath, "r", encoding="utf-8") as fh:
+                    data = load(fh)
+            except ValueError:
+                logger.warning("Ignoring corrupt manifest %s", self.manifestPath)
+        if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+            self.dirty = True
+            data = {'version': MANIFEST_VERSION, 'root': None, 'revisions': {}}
+        return data
+
+    def names(self) -> List[str]:
+        with self.lock:
+            mtime = stat(self.root).st_mtime_ns
+            if mtime != self.data['root']:
+                # Revisions were added or removed. Keep what we know about the
+                # survivors; they are revalidated when they are looked at.
+                revisions = self.data['revisions']
+                self.data['revisions'] = {name: revisions.get(name) for name in listdir(self.root)}
+                self.data['root'] = mtime
+                self.dirty = True
+            return list(self.data['revisions'])
+
+    def _fresh(self, name: str, entry: Dict[str, Any]) -> bool:
+        base = join(self.root, name)
+        try:
+            if stat(base).st_mtime_ns != entry['mtime']:
+                return False
+            for subdir, mtime in entry['dirs'].items():
+                if stat(join(base, subdir)).st_mtime_ns != mtime:
+                    return False
+        except OSError:
+            return False
+        return True
+
+    def _scan(self, name: str) -> Dict[str, Any]:
+        logger.debug("Scanning %s", name)
+        base = join(self.root, name)
+        entry: Dict[str, Any] = {'mtime': stat(base).st_mtime_ns, 'dirs': {}, 'files': {}}
+        for item in listdir(base):
+            st = stat(join(base, item))
+            if S_ISDIR(st.st_mode):
+                entry['dirs'][item] = st.st_mtime_ns
+                for sub in listdir(join(base, item)):
+                    subst = stat(join(base, item, sub))
+                    if S_ISREG(subst.st_mode):
+                        entry['files']['%s/%s' % (item, sub)] = [subst.st_size, subst.st_mtime_ns]
+            elif S_ISREG(st.st_mode):
+                entry['files'][item] = [st.st_size, st.st_mtime_ns]
+        return entry
+
+    def entry(self, dir) -> Dict[str, Any]:
+        """Return the cached listing of revision ``dir``, rescanning it if it changed."""
+        name = str(dir)
+        with self.lock:
+            entry = self.data['revisions'].get(name)
+            if name in self.checked and entry is not None:
+                return entry
+            if entry is None or not self._fresh(name, entry):
+                entry = self._scan(name)
+                self.data['revisions'][name] = entry
+                self.dirty = True
+            self.checked.add(name)
+            return entry
+
+    def has(self, dir, name: str) -> bool:
+        return name in self.entry(dir)['files']
+
+    def files(self, dir, subdir: str) -> List[str]:
+        prefix = subdir + '/'
+        return sorted(
+            name[len(prefix):] for name in self.entry(dir)['files'] if name.startswith(prefix)
+        )
+
+    def stat(self, dir, name: str) -> Tuple[int, int]:
+        size, mtime = self.entry(dir)['files'][name][:2]
+        return size, mtime
+
+    def checksum(self, dir, name: str) -> str:
+        # Files can be edited in place without touching their directory's
+        # mtime, so the file itself is always stat'ed before trusting the
+        # cached checksum.
+        st = stat(self.path(dir, name))
+        cached = self.entry(dir)['files'].get(name)
+        if cached and cached[:2] == [st.st_size, st.st_mtime_ns] and len(cached) > 2:
+            return cached[2]
+        value = super().checksum(dir, name)
+        with self.lock:
+            self.entry(dir)['files'][name] = [st.st_size, st.st_mtime_ns, value]
+            self.dirty = True
+        return value
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            tmpPath = self.manifestPath + '.tmp'
+            with open(tmpPath, "w", encoding="utf-8") as fh:
+                dump(self.data, fh, separators=(',', ':'))
+            replace(tmpPath, self.manifestPath)
+            self.dirty = False